@@ -0,0 +1,270 @@
+"""
+Asset loading for both front-ends.
+
+The asset managers load every image once, up front (after the window exists,
+so they can be converted to whatever format the display wants), and pack the
+28 mino sprites into a single atlas. Lookups go through the atlas, as pygame
+subsurfaces or pyglet texture regions, in the same imgs[mode][shape] shape
+that the renderers have always used.
+
+The decoding is spread over a Loader's pool of threads, while the main thread
+keeps a loading screen going (and does anything that has to happen on the main
+thread, like uploading textures). Sounds aren't needed for the first frame, so
+they're left to Sounds, which loads each one the first time it's played.
+
+Everything keeps a LoadReport of how long each asset took to load and how
+much memory it ended up using, along with milestones like the time to the
+first frame.
+"""
+
+import concurrent.futures
+import io
+import threading
+import time
+
+import bakecache
+
+MINO_MODES = ("dying", "ghost", "locked", "normal")
+MINO_SHAPES = "IJLOSTZ"
+
+IMAGES = {
+	"background":     "assets/images/main-background.png",
+	"matrix":         "assets/images/matrix.png",
+	"vfx_harddrop":   "assets/images/vfx-hardDrop.png",
+	"vfx_sparkle":    "assets/images/vfx-sparkle.png",
+	"vfx_minolocked": "assets/images/vfx-minoLocked-01.png",
+}
+
+def mino_path(mode, shape):
+	return f"assets/images/mino-01-{mode}-~size-25~-{shape}.png"
+
+class LoadReport:
+	"""
+		load time and memory use, per asset (added from whichever thread
+		loaded it), plus startup milestones
+	"""
+	def __init__(self, start=None):
+		self.start = time.perf_counter() if start is None else start  # what the milestones are timed from
+		self.entries = []  # (name, seconds, bytes)
+		self.milestones = {}  # name: seconds since start
+
+	def add(self, name, seconds, nbytes):
+		self.entries.append((name, seconds, nbytes))
+
+	def timed(self, name, fn, *args, nbytes=lambda result: 0):
+		"""
+			fn(*args), recording how long it took
+		"""
+		start = time.perf_counter()
+		result = fn(*args)
+		self.add(name, time.perf_counter() - start, nbytes(result))
+		return result
+
+	def mark(self, name):
+		"""
+			records that name happened now (only the first time)
+		"""
+		self.milestones.setdefault(name, time.perf_counter() - self.start)
+
+	def __str__(self):
+		lines = ["{:<24} {:>9} {:>10}".format("asset", "load ms", "KiB")]
+		for name, seconds, nbytes in self.entries:
+			lines.append("{:<24} {:>9.2f} {:>10.1f}".format(name, seconds * 1000, nbytes / 1024))
+		lines.append("{:<24} {:>9.2f} {:>10.1f}".format(
+			"total",
+			sum(seconds for _, seconds, _ in self.entries) * 1000,
+			sum(nbytes for _, _, nbytes in self.entries) / 1024,
+		))
+		if self.milestones:
+			lines.append("{:<24} {:>9}".format("milestone", "at ms"))
+			for name, seconds in self.milestones.items():
+				lines.append("{:<24} {:>9.2f}".format(name, seconds * 1000))
+		return "\n".join(lines)
+
+class Loader:
+	"""
+		Fans loading out over a pool of threads
+
+		map() is like the builtin, except the calls run in parallel, and
+		while it waits for them it keeps calling idle(loader) (e.g. to draw
+		a loading screen, so the window stays alive). done counts the calls
+		that have finished so far.
+	"""
+
+	IDLE_INTERVAL = 1 / 30  # seconds
+
+	def __init__(self, idle=None, workers=None):
+		self.pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="loader")
+		self.idle = idle
+		self.done = 0
+
+	def submit(self, fn, *args):
+		return self.pool.submit(fn, *args)
+
+	def wait(self, futures):
+		"""
+			the futures' results, in order
+		"""
+		pending = set(futures)
+		while pending:
+			finished, pending = concurrent.futures.wait(pending, self.IDLE_INTERVAL)
+			self.done += len(finished)
+			if self.idle:
+				self.idle(self)
+		return [future.result() for future in futures]
+
+	def map(self, fn, *iterables):
+		return self.wait([self.pool.submit(fn, *args) for args in zip(*iterables)])
+
+	def shutdown(self):
+		self.pool.shutdown()
+
+class Sounds:
+	"""
+		Sound effects by name, each loaded (by load(path)) the first time
+		it's asked for, rather than all of them up front. prefetch() loads
+		the rest in the background, so the first play doesn't have to wait.
+
+		init() is called once, before the first load (e.g. to open the
+		audio device), and nbytes(sound) is for the report.
+	"""
+
+	def __init__(self, paths, load, init=None, nbytes=lambda sound: 0, report=None):
+		self.paths = paths
+		self.load = load
+		self.init = init
+		self.nbytes = nbytes
+		self.report = report or LoadReport()
+		self.sounds = {}
+		self.lock = threading.Lock()
+		self.init_lock = threading.Lock()
+
+	def ready(self):
+		with self.init_lock:
+			if self.init:
+				self.report.timed("audio init", self.init)
+				self.init = None
+
+	def __getitem__(self, name):
+		sound = self.sounds.get(name)
+		if sound is None:
+			with self.lock:  # (prefetch() might be loading this one right now)
+				sound = self.sounds.get(name)
+				if sound is None:
+					self.ready()
+					sound = self.sounds[name] = self.report.timed(f"sound {name}", self.load, self.paths[name], nbytes=self.nbytes)
+		return sound
+
+	def prefetch(self):
+		threading.Thread(target=lambda: [self[name] for name in self.paths], name="sound prefetch", daemon=True).start()
+
+class PygameAssets:
+	"""
+		images converted to the display's pixel format (so blits don't have
+		to convert every pixel, every time), and a mino atlas
+
+		mino_transform is applied to each mino before it's packed (e.g. to
+		scale it up to the render size), and map is what the loading gets
+		spread out with (e.g. a Loader's)
+	"""
+
+	def __init__(self, mino_transform=None, map=map, report=None):
+		import pygame
+		self.pygame = pygame
+		self.report = report or LoadReport()
+		self.images = dict(zip(IMAGES, map(self.load, IMAGES, IMAGES.values())))
+		self.minos = self.load_minos(mino_transform or (lambda image: image), map)
+
+	def load(self, name, path):
+		pygame = self.pygame
+		start = time.perf_counter()
+		image = pygame.image.load(path)
+		if image.get_flags() & pygame.SRCALPHA or image.get_colorkey() is not None:
+			image = image.convert_alpha()  # (colour keys become alpha)
+		else:
+			image = image.convert()
+		self.report.add(name, time.perf_counter() - start, image.get_bytesize() * image.get_width() * image.get_height())
+		return image
+
+	def load_minos(self, transform, map):
+		pygame = self.pygame
+		keys = [(mode, shape) for mode in MINO_MODES for shape in MINO_SHAPES]
+		sprites = dict(zip(keys, map(
+			lambda mode, shape: transform(self.load(f"mino {mode} {shape}", mino_path(mode, shape))),
+			*zip(*keys)
+		)))
+
+		start = time.perf_counter()
+		w, h = sprites[MINO_MODES[0], MINO_SHAPES[0]].get_size()
+		atlas = pygame.Surface((w * len(MINO_SHAPES), h * len(MINO_MODES)), pygame.SRCALPHA).convert_alpha()
+		atlas.fill((0, 0, 0, 0))
+		minos = {}
+		for row, mode in enumerate(MINO_MODES):
+			minos[mode] = {}
+			for col, shape in enumerate(MINO_SHAPES):
+				rect = pygame.Rect(col * w, row * h, w, h)
+				atlas.blit(sprites[mode, shape], rect, special_flags=pygame.BLEND_RGBA_MAX)  # copy, rather than blend onto the transparent atlas
+				minos[mode][shape] = atlas.subsurface(rect)
+		self.atlas = atlas
+		self.report.add("mino atlas", time.perf_counter() - start, atlas.get_bytesize() * atlas.get_width() * atlas.get_height())
+		return minos
+
+class PygletAssets:
+	"""
+		images as textures, with the minos packed into one texture atlas (so
+		drawing the board doesn't keep switching textures)
+
+		map is what the decoding gets spread out with, the textures are
+		made by whichever thread made this (the one with the GL context)
+	"""
+
+	ATLAS_BORDER = 1  # px of padding around each mino, so filtering doesn't bleed in from its neighbours
+
+	def __init__(self, map=map, report=None):
+		import pyglet
+		self.pyglet = pyglet
+		self.report = report or LoadReport()
+		decoded = map(self.load, IMAGES, IMAGES.values())
+		self.images = {name: image.get_texture() for name, image in zip(IMAGES, decoded)}
+		self.minos = self.load_minos(map)
+
+	def load(self, name, path):
+		"""
+			the decoded image, which comes out of the asset cache when it can
+			(pyglet's PNG decoding is slow without PIL)
+		"""
+		pyglet = self.pyglet
+		start = time.perf_counter()
+		with pyglet.resource.file(path) as f:
+			encoded = f.read()
+		image = bakecache.cached(
+			"image-" + name.replace(" ", "-"),
+			bakecache.key([encoded], pyglet.version),
+			lambda: pyglet.image.load(path, file=io.BytesIO(encoded)),
+			lambda image: [({"size": [image.width, image.height]}, image.get_image_data().get_bytes("RGBA", image.width * 4))],
+			lambda entries: pyglet.image.ImageData(*entries[0][0]["size"], "RGBA", bytes(entries[0][1]), entries[0][0]["size"][0] * 4),
+		)
+		self.report.add(name, time.perf_counter() - start, image.width * image.height * 4)
+		return image
+
+	def load_minos(self, map):
+		keys = [(mode, shape) for mode in MINO_MODES for shape in MINO_SHAPES]
+		sprites = dict(zip(keys, map(
+			lambda mode, shape: self.load(f"mino {mode} {shape}", mino_path(mode, shape)),
+			*zip(*keys)
+		)))
+
+		start = time.perf_counter()
+		w, h = sprites[MINO_MODES[0], MINO_SHAPES[0]].width, sprites[MINO_MODES[0], MINO_SHAPES[0]].height
+		side = 1
+		while side < max(len(MINO_SHAPES) * (w + 2 * self.ATLAS_BORDER), len(MINO_MODES) * (h + 2 * self.ATLAS_BORDER)):
+			side *= 2
+		atlas = self.pyglet.image.atlas.TextureAtlas(side, side)
+		minos = {}
+		for mode in MINO_MODES:
+			minos[mode] = {}
+			for shape in MINO_SHAPES:
+				minos[mode][shape] = atlas.add(sprites[mode, shape], self.ATLAS_BORDER)
+		self.atlas = atlas
+		self.report.add("mino atlas", time.perf_counter() - start, side * side * 4)
+		return minos
@@ -0,0 +1,130 @@
+"""
+An on-disk cache of baked assets.
+
+Baking (scaling, rotating and fading sprites, decoding images and sounds)
+always gives the same result for the same inputs, so it only needs doing once.
+Each bake is stored as a bundle in .assetcache/ (next to assets/), named after
+a hash of everything that went into it: the source files' contents, and the
+bake parameters. So when an asset or a parameter changes, the hash does too,
+and the next launch just bakes a fresh bundle (and deletes the stale one).
+
+A bundle is a list of entries, each a little JSON metadata and a blob of raw
+bytes (pixels, samples). The file is laid out so it can be memory-mapped and
+the blobs used in place, without parsing or copying them:
+
+	MAGIC, u32 header length, JSON header, then the blobs, each aligned to ALIGN bytes
+
+where the header is a list of {"meta": ..., "offset": ..., "length": ...}.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".assetcache")
+
+MAGIC = b"FBGC"
+VERSION = 1  # (bump this if the bundle format changes)
+ALIGN = 64
+
+def key(sources=(), params=()):
+	"""
+		a hash of the sources (file paths, or their contents as bytes) and
+		params (anything repr()able)
+	"""
+	h = hashlib.blake2b(digest_size=16)
+	h.update(repr((VERSION, params)).encode())
+	for source in sources:
+		if isinstance(source, bytes):
+			h.update(source)
+			continue
+		with open(source, "rb") as f:
+			h.update(f.read())
+	return h.hexdigest()
+
+def bundle_path(name, key):
+	return os.path.join(CACHE_DIR, f"{name}-{key}.bin")
+
+def load(name, key):
+	"""
+		the bundle's entries, as [(meta, memoryview)] into a private mapping
+		of the file, or None if there's no such bundle (or it's unreadable)
+	"""
+	try:
+		with open(bundle_path(name, key), "rb") as f:
+			data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)  # (copy-on-write, so nothing can scribble on the file)
+	except (OSError, ValueError):  # (ValueError is an empty file)
+		return None
+	view = memoryview(data)
+	try:
+		if view[:4] != MAGIC:
+			return None
+		header_length, = struct.unpack_from("<I", view, 4)
+		header = json.loads(bytes(view[8:8 + header_length]))
+		entries = []
+		for entry in header:
+			offset, length = entry["offset"], entry["length"]
+			if offset + length > len(view):
+				return None
+			entries.append((entry["meta"], view[offset:offset + length]))
+		return entries
+	except (ValueError, KeyError, TypeError, struct.error):
+		return None
+
+def store(name, key, entries):
+	"""
+		writes [(meta, bytes-like)] entries as a bundle, and deletes any
+		older bundles with the same name. returns False if it couldn't (in
+		which case it's just baked again next time)
+	"""
+	header = []
+	offset = 0
+	for meta, blob in entries:
+		length = memoryview(blob).nbytes
+		header.append({"meta": meta, "offset": offset, "length": length})
+		offset += -(-length // ALIGN) * ALIGN
+	# the blob offsets are relative to the end of the header until we know how long it is
+	start = 0
+	while True:
+		encoded = json.dumps([{**entry, "offset": entry["offset"] + start} for entry in header]).encode()
+		needed = -(-(8 + len(encoded)) // ALIGN) * ALIGN
+		if needed == start:
+			break
+		start = needed
+
+	path = bundle_path(name, key)
+	try:
+		os.makedirs(CACHE_DIR, exist_ok=True)
+		temp = f"{path}.{os.getpid()}.tmp"
+		with open(temp, "wb") as f:
+			f.write(MAGIC + struct.pack("<I", len(encoded)) + encoded)
+			for (meta, blob), entry in zip(entries, header):
+				f.seek(start + entry["offset"])
+				f.write(blob)
+			f.truncate(start + offset)  # (padding out the last blob, even if it's empty)
+		os.replace(temp, path)  # (so a half-written bundle never has a real name)
+		for other in os.listdir(CACHE_DIR):
+			if other.endswith(".bin") and other[:-4].rsplit("-", 1)[0] == name and os.path.join(CACHE_DIR, other) != path:
+				os.remove(os.path.join(CACHE_DIR, other))
+	except OSError:
+		return False
+	return True
+
+def cached(name, key, bake, pack, unpack):
+	"""
+		unpack(entries) of the bundle for name and key, baking it first if
+		it isn't cached: bake() makes the thing, and pack(thing) turns it
+		into entries. (a fresh bake gets unpacked from the bundle it was just
+		stored in too, so the result is always the same kind of thing)
+	"""
+	entries = load(name, key)
+	if entries is None:
+		baked = bake()
+		if not store(name, key, pack(baked)):
+			return baked
+		entries = load(name, key)
+		if entries is None:
+			return baked
+	return unpack(entries)
@@ -0,0 +1,417 @@
+"""
+Batched simulation: N independent games stepped in lockstep with NumPy.
+
+BatchGame follows engine.Game's rules exactly (same tick structure, same
+quirks), but keeps every board's state in arrays and applies each step of the
+game loop to all the boards it affects at once. Given the same seeds and the
+same inputs, board i of a BatchGame produces exactly the same scores, pieces
+and grid as engine.Game(rng=random.Random(seeds[i])).
+
+Boards are stored as one integer bitmask per row (like board.BitBoard, but
+without the colour plane, which only the renderers need), so the width is
+limited to 62 columns.
+
+Inputs are one Action per board per tick (as its .value, 0 for nothing) plus
+a bitmask of held keys, where bit i is engine.HELD_KEYS[i].
+"""
+
+import random
+import numpy as np
+
+from data import PIECES, WALLKICKS
+from engine import (
+	Action, GameState, HELD_KEYS,
+	CLEAR_ANIMATION_DELAY, CLEAR_ANIMATION_DURATION, TICK_RATE,
+	gridwidth, gridheight, topzone,
+)
+
+LINE_SCORES = np.array([0, 100, 300, 500, 800], dtype=np.int64)
+
+PLAYING = GameState.PLAYING.value
+PAUSED = GameState.PAUSED.value
+GAMEOVER = GameState.GAMEOVER.value
+
+def compile_tables(pieces, wallkicks):
+	"""
+		Packs a compiled rotation system (see data.compile_shapes) into arrays
+		indexed by [shape index, rotation, ...], where the shape index is the
+		position in pieces' key order (which is also the 7-bag's order)
+	"""
+	shapes = list(pieces)
+	nrows = max(piece.bottom for rotations in pieces.values() for piece in rotations) + 1
+	nkicks = max(len(kicks) for table in wallkicks.values() for kicks in table.values())
+
+	masks = np.zeros((len(shapes), 4, nrows), dtype=np.int64)
+	extents = np.zeros((3, len(shapes), 4), dtype=np.int64)  # left, right, bottom
+	kicks = np.zeros((len(shapes), 4, 2, nkicks, 2), dtype=np.int64)  # [.., direction (cw, ccw), kick, (dx, dy)]
+	for s, shape in enumerate(shapes):
+		for rot, piece in enumerate(pieces[shape]):
+			for dy, mask in piece.rows:
+				masks[s, rot, dy] = mask
+			extents[:, s, rot] = piece.left, piece.right, piece.bottom
+			for d, direction in enumerate((1, -1)):
+				table = wallkicks[shape][(rot, (rot + direction) % 4)]
+				# pad by repeating the last kick, retrying a kick that already failed is harmless
+				table = table + [table[-1]] * (nkicks - len(table))
+				kicks[s, rot, d] = table
+	return shapes, masks, extents, kicks
+
+class BatchGame:
+	pieces = PIECES
+	wallkicks = WALLKICKS
+
+	def __init__(self, seeds, width=gridwidth, height=gridheight, topzone=topzone):
+		"""
+			one board per seed (each seed goes to its own random.Random,
+			which does nothing but shuffle that board's 7-bag)
+		"""
+		if width > 62:
+			raise ValueError("boards wider than 62 columns don't fit in an int64 row mask")
+
+		self.n = len(seeds)
+		self.width = width
+		self.height = height
+		self.topzone = topzone
+		self.full_mask = (1 << width) - 1
+
+		self.shapes, self.masks, (self.left, self.right, self.bottom), self.kicks = compile_tables(self.pieces, self.wallkicks)
+		self.time_per_drop = np.array([self._time_per_drop(level) for level in range(256)])
+
+		# each board's piece sequence is generated ahead of time, a few bags at a time
+		self.rngs = [random.Random(seed) for seed in seeds]
+		self.sequence = np.zeros((self.n, 0), dtype=np.int8)
+		self.sequence_len = np.zeros(self.n, dtype=np.int64)  # (boards run out at different times, so each row has its own length)
+		self.sequence_pos = np.zeros(self.n, dtype=np.int64)
+
+		n = self.n
+		self.rows = np.zeros((n, height), dtype=np.int64)
+		self.gamestate = np.full(n, PLAYING, dtype=np.int64)
+		self.score = np.zeros(n, dtype=np.int64)
+		self.level = np.ones(n, dtype=np.int64)
+		self.line_count = np.zeros(n, dtype=np.int64)
+		self.gameticks = np.zeros(n, dtype=np.int64)
+		self.pieces_placed = np.zeros(n, dtype=np.int64)
+		self.time_til_drop = np.zeros(n)
+		self.line_clear_animation_ticks_remaining = np.zeros(n, dtype=np.int64)
+		self.rows_to_collapse = np.zeros((n, height), dtype=bool)
+		self.prev_back2back = np.zeros(n, dtype=bool)
+		self.heldticks = np.zeros((n, len(HELD_KEYS)), dtype=np.int64)
+		self.hold = np.full(n, -1, dtype=np.int64)  # shape index, -1 for nothing held
+		self.can_swap = np.ones(n, dtype=bool)
+		self.shape_queue = np.zeros((n, 3), dtype=np.int64)
+		self.active_shape = np.zeros(n, dtype=np.int64)
+		self.active_x = np.zeros(n, dtype=np.int64)
+		self.active_y = np.zeros(n, dtype=np.int64)
+		self.active_rot = np.zeros(n, dtype=np.int64)
+
+		self.reset(np.arange(n))
+
+	@staticmethod
+	def _time_per_drop(level):
+		# has to be evaluated exactly like engine.Game.time_per_drop, so the timers stay bit-identical
+		return (0.8 - ((level - 1) * 0.007)) ** (level - 1)
+
+	def reset(self, idx):
+		"""
+			(re)start the games on the boards in idx
+		"""
+		# a fresh game starts a fresh bag, so throw away the rest of the current one
+		bag = len(self.shapes)
+		self.sequence_pos[idx] = -(-self.sequence_pos[idx] // bag) * bag
+
+		self.rows[idx] = 0
+		self.gamestate[idx] = PLAYING
+		for i in range(3):
+			self.shape_queue[idx, i] = self._next_shapes(idx)
+		self.score[idx] = 0
+		self.level[idx] = 1
+		self.line_count[idx] = 0
+		self.gameticks[idx] = 0
+		self.pieces_placed[idx] = 0
+		self.time_til_drop[idx] = self.time_per_drop[1]
+		self.line_clear_animation_ticks_remaining[idx] = 0
+		self.rows_to_collapse[idx] = False
+		self.prev_back2back[idx] = False
+		self.heldticks[idx] = 0
+		self.hold[idx] = -1
+		self.can_swap[idx] = True
+		self._spawn(idx)
+
+	# ======== STEPPING ========
+
+	def step(self, actions=None, held=None):
+		"""
+			Advance every board by one tick (the equivalent of engine.Game.update)
+
+			actions is an array of Action values (0 for no action), held an
+			array of HELD_KEYS bitmasks. Either can be left out.
+		"""
+		if actions is None:
+			actions = np.zeros(self.n, dtype=np.int64)
+		if held is None:
+			held = np.zeros(self.n, dtype=np.int64)
+		actions = np.asarray(actions)
+		held = np.asarray(held)
+
+		playing = self.gamestate == PLAYING
+		self.gamestate[(self.gamestate == PAUSED) & (actions == Action.PAUSE.value)] = PLAYING
+		restart = np.flatnonzero((self.gamestate == GAMEOVER) & (actions == Action.RESTART.value))
+		if restart.size:
+			self.reset(restart)
+
+		# line clear animation
+		animating = playing & (self.line_clear_animation_ticks_remaining > 0)
+		self.line_clear_animation_ticks_remaining[animating] -= 1
+		finished = np.flatnonzero(animating & (self.line_clear_animation_ticks_remaining == 0))
+		if finished.size:
+			self._collapse_rows(finished)
+			self._spawn(finished)
+
+		live = playing & ~animating
+		self.gameticks[live] += 1
+
+		self._try_rotate(np.flatnonzero(live & (actions == Action.ROTATE_CW.value)), 1)
+		self._try_rotate(np.flatnonzero(live & (actions == Action.ROTATE_CCW.value)), -1)
+		self._swap_hold(np.flatnonzero(live & (actions == Action.HOLD.value)))
+		self._hard_drop(np.flatnonzero(live & (actions == Action.HARD_DROP.value)))
+		self.gamestate[live & (actions == Action.PAUSE.value)] = PAUSED
+
+		# keep track of how long these keys have been held
+		for i in range(len(HELD_KEYS)):
+			down = (held & (1 << i)) != 0
+			self.heldticks[live, i] = np.where(down[live], self.heldticks[live, i] + 1, 0)
+
+		heldticks = self.heldticks
+		left, right, down = (heldticks[:, HELD_KEYS.index(name)] for name in ("left", "right", "down"))
+
+		softdrop = np.flatnonzero(live & (down % 2 == 1))  # 30Hz softdrop
+		if softdrop.size:
+			moved = softdrop[~self._collides(softdrop, self.active_x[softdrop], self.active_y[softdrop] + 1)]
+			self.active_y[moved] += 1
+			self.time_til_drop[moved] = self.time_per_drop[self.level[moved]]
+			self.score[moved] += 1
+
+		# 30Hz ARR, 10 frame DAS
+		self._try_movex(np.flatnonzero(live & ((left == 1) | ((left > 10) & (left % 2 == 1)))), -1)
+		self._try_movex(np.flatnonzero(live & ((right == 1) | ((right > 10) & (right % 2 == 1)))), 1)
+
+		self.time_til_drop[live] -= 1 / TICK_RATE
+		due = np.flatnonzero(live & (self.time_til_drop < 0))
+		if due.size:
+			rows = np.ones(due.size, dtype=np.int64)
+			more = (rows < self.height) & (self.time_til_drop[due] + self.time_per_drop[self.level[due]] < 0)
+			while more.any():
+				self.time_til_drop[due[more]] += self.time_per_drop[self.level[due[more]]]
+				rows[more] += 1
+				more &= (rows < self.height) & (self.time_til_drop[due] + self.time_per_drop[self.level[due]] < 0)
+			self._apply_gravity(due, rows)
+			self.time_til_drop[due] += self.time_per_drop[self.level[due]]
+
+	# ======== GAME RULES ========
+	# these all take an array of board indices to act on
+
+	def _collides(self, idx, x, y, rot=None):
+		"""
+			does each board's active piece collide at (x, y), in rotation rot
+			(default: its current one)
+		"""
+		shape = self.active_shape[idx]
+		if rot is None:
+			rot = self.active_rot[idx]
+		left = self.left[shape, rot]
+		hit = (x + left < 0) | (x + self.right[shape, rot] >= self.width) | (y + self.bottom[shape, rot] >= self.height)  # walls or floor
+		shift = np.maximum(x + left, 0)
+		masks = self.masks[shape, rot]
+		for dy in range(masks.shape[1]):
+			row = y + dy
+			cells = self.rows[idx, np.clip(row, 0, self.height - 1)]
+			hit |= (row >= 0) & ((cells & (masks[:, dy] << shift)) != 0)  # (above the ceiling only the walls count)
+		return hit
+
+	def _drop_distance(self, idx, limit=None):
+		distance = np.zeros(idx.size, dtype=np.int64)
+		falling = np.ones(idx.size, dtype=bool)
+		if limit is not None:
+			falling &= limit > 0
+		while falling.any():
+			sub = np.flatnonzero(falling)
+			landed = self._collides(idx[sub], self.active_x[idx[sub]], self.active_y[idx[sub]] + distance[sub] + 1)
+			falling[sub[landed]] = False
+			distance[sub[~landed]] += 1
+			if limit is not None:
+				falling &= distance < limit
+		return distance
+
+	def _reset_timer_if_resting(self, idx):
+		resting = idx[self._collides(idx, self.active_x[idx], self.active_y[idx] + 1)]
+		self.time_til_drop[resting] = self.time_per_drop[self.level[resting]]
+
+	def _try_rotate(self, idx, direction):
+		if not idx.size:
+			return
+		new_rot = (self.active_rot[idx] + direction) % 4
+		kicks = self.kicks[self.active_shape[idx], self.active_rot[idx], 0 if direction == 1 else 1]
+		trying = np.ones(idx.size, dtype=bool)
+		for k in range(kicks.shape[1]):
+			sub = np.flatnonzero(trying)
+			if not sub.size:
+				break
+			new_x = self.active_x[idx[sub]] + kicks[sub, k, 0]
+			new_y = self.active_y[idx[sub]] - kicks[sub, k, 1]  # positive Y is upwards, in wallkick data
+			ok = ~self._collides(idx[sub], new_x, new_y, new_rot[sub])
+			moved = idx[sub[ok]]
+			self.active_rot[moved] = new_rot[sub[ok]]
+			self.active_x[moved] = new_x[ok]
+			self.active_y[moved] = new_y[ok]
+			trying[sub[ok]] = False
+		self._reset_timer_if_resting(idx[~trying])
+
+	def _try_movex(self, idx, direction):
+		if not idx.size:
+			return
+		moved = idx[~self._collides(idx, self.active_x[idx] + direction, self.active_y[idx])]
+		self.active_x[moved] += direction
+		self._reset_timer_if_resting(moved)
+
+	def _hard_drop(self, idx):
+		if not idx.size:
+			return
+		distance = self._drop_distance(idx)
+		self.active_y[idx] += distance
+		self.score[idx] += 2 * distance
+		self.time_til_drop[idx] = self.time_per_drop[self.level[idx]]
+		self._lockdown(idx)
+
+	def _apply_gravity(self, idx, rows):
+		distance = self._drop_distance(idx, rows)
+		self._lockdown(idx[distance == 0])
+		self.active_y[idx] += distance
+
+	def _swap_hold(self, idx):
+		idx = idx[self.can_swap[idx]]
+		if not idx.size:
+			return
+		empty = idx[self.hold[idx] < 0]
+		swap = idx[self.hold[idx] >= 0]
+		self.hold[empty] = self.active_shape[empty]
+		self._spawn(empty)
+		self.active_shape[swap], self.hold[swap] = self.hold[swap], self.active_shape[swap]
+		self._spawn(swap, respawn=True)
+		self.can_swap[idx] = False
+
+	def _lockdown(self, idx):
+		if not idx.size:
+			return
+		self._stamp(idx)
+		cleared = self._check_lines(idx)
+		self._spawn(idx[~cleared])
+		self.can_swap[idx] = True
+		self.pieces_placed[idx] += 1
+
+	def _stamp(self, idx):
+		shape = self.active_shape[idx]
+		rot = self.active_rot[idx]
+		x = self.active_x[idx] + self.left[shape, rot]
+		y = self.active_y[idx]
+		masks = self.masks[shape, rot]
+		for dy in range(masks.shape[1]):
+			sel = masks[:, dy] != 0
+			# (rows above the ceiling wrap around, same as they do in board.BitBoard)
+			self.rows[idx[sel], (y[sel] + dy) % self.height] |= masks[sel, dy] << x[sel]
+
+	def _check_lines(self, idx):
+		"""
+			returns which of the boards in idx cleared any lines
+		"""
+		full = self.rows[idx] == self.full_mask
+		self.rows_to_collapse[idx] = full
+		linecount = full.sum(axis=1)
+		cleared = linecount > 0
+		idx = idx[cleared]
+		full = full[cleared]
+		linecount = linecount[cleared]
+		if not idx.size:
+			return cleared
+
+		self.rows[idx] = np.where(full, 0, self.rows[idx])
+
+		tetris = linecount == 4
+		points = np.where(tetris & self.prev_back2back[idx], LINE_SCORES[4] * 3 // 2, LINE_SCORES[linecount])  # 1.5x back-to-back bonus
+		self.prev_back2back[idx] = tetris
+		self.score[idx] += self.level[idx] * points
+
+		new_line_total = self.line_count[idx] + linecount
+		self.level[idx] += self.line_count[idx] // 10 != new_line_total // 10  # if we crossed a new multiple of 10 boundary
+		self.line_count[idx] = new_line_total
+		if self.level.max() >= len(self.time_per_drop):
+			self.time_per_drop = np.array([self._time_per_drop(level) for level in range(2 * len(self.time_per_drop))])
+
+		self.line_clear_animation_ticks_remaining[idx] = CLEAR_ANIMATION_DELAY + CLEAR_ANIMATION_DURATION
+		return cleared
+
+	def _collapse_rows(self, idx):
+		collapse = self.rows_to_collapse[idx]
+		# stable sort puts the rows being removed on top, and keeps the rest in order
+		order = np.argsort(~collapse, axis=1, kind="stable")
+		rows = np.take_along_axis(self.rows[idx], order, axis=1)
+		count = collapse.sum(axis=1)
+		self.rows[idx] = np.where(np.arange(self.height) < count[:, None], 0, rows)
+		self.rows_to_collapse[idx] = False
+
+	def _spawn(self, idx, respawn=False):
+		if not idx.size:
+			return
+		if not respawn:
+			self.active_shape[idx] = self.shape_queue[idx, 0]
+			self.shape_queue[idx, :-1] = self.shape_queue[idx, 1:]
+			self.shape_queue[idx, -1] = self._next_shapes(idx)
+		self.active_x[idx] = (self.width - 4) // 2
+		self.active_y[idx] = self.topzone - 2
+		self.active_rot[idx] = 0
+
+		blocked = self._collides(idx, self.active_x[idx], self.active_y[idx])
+		self.gamestate[idx[blocked]] = GAMEOVER
+
+	def _next_shapes(self, idx):
+		short = idx[self.sequence_pos[idx] >= self.sequence_len[idx]]
+		if short.size:
+			self._extend_sequences(short, 16)
+		shapes = self.sequence[idx, self.sequence_pos[idx]]
+		self.sequence_pos[idx] += 1
+		return shapes
+
+	def _extend_sequences(self, idx, bags):
+		# each board drops the whole bags it's used up on its own, so a board
+		# that's sitting at GAMEOVER doesn't hold on to everyone else's
+		bag_size = len(self.shapes)
+		extended = []
+		for i in idx:
+			used = self.sequence_pos[i] // bag_size * bag_size
+			sequence = list(self.sequence[i, used:self.sequence_len[i]])
+			self.sequence_pos[i] -= used
+
+			# engine.Game.random_shape shuffles the bag then pops off the end
+			rng = self.rngs[i]
+			for _ in range(bags):
+				bag = list(range(bag_size))
+				rng.shuffle(bag)
+				sequence.extend(reversed(bag))
+			extended.append(sequence)
+
+		width = max(self.sequence.shape[1], max(len(sequence) for sequence in extended))
+		if width > self.sequence.shape[1]:
+			self.sequence = np.pad(self.sequence, ((0, 0), (0, width - self.sequence.shape[1])))
+		for i, sequence in zip(idx, extended):
+			self.sequence[i, :len(sequence)] = sequence
+			self.sequence_len[i] = len(sequence)
+
+	# ======== INSPECTION ========
+
+	def cell(self, i, x, y):
+		"""
+			whether (x, y) on board i is filled (there's no colour plane)
+		"""
+		return bool((int(self.rows[i, y]) >> x) & 1)
+
+	def alive(self):
+		return self.gamestate != GAMEOVER
@@ -0,0 +1,376 @@
+"""
+Micro-benchmarks for the engine and render hot paths.
+
+	python3 bench.py                          # run everything, print a table
+	python3 bench.py -k render                # only the cases with "render" in their name
+	python3 bench.py --save baseline.json     # record a baseline
+	python3 bench.py --compare baseline.json  # exit 1 if any case got more than --threshold slower, or didn't run
+
+Each case is timed over enough iterations to take --min-time seconds, and
+the best of --repeat runs is reported (the fastest run is the one with the
+least interference from everything else on the machine). The engine cases
+run on a few representative boards: "empty", "half" (half the visible rows
+full of garbage), and "topout" (garbage right up to the top of the
+playfield).
+
+The render cases draw offscreen (SDL's dummy video driver, and a headless
+pyglet context), and are skipped if pygame or pyglet can't be loaded. (when
+comparing, a skipped case counts as a failure unless --allow-missing is given,
+so a box without a display library can't pass by not checking anything)
+"""
+
+import argparse
+import copy
+import gc
+import json
+import os
+import pickle
+import random
+import sys
+import time
+
+import engine
+from data import WALLKICKS
+from sound import NullBackend
+
+BOARDS = {
+	"empty": 0,
+	"half": (engine.gridheight - engine.topzone) // 2,
+	"topout": engine.gridheight - engine.topzone - 3,
+}
+
+CASES = {}
+
+class Skip(Exception):
+	pass
+
+def case(name):
+	"""
+		registers fn(n) as a benchmark, which should do n iterations of
+		something and return how many seconds the interesting part took
+	"""
+	def register(fn):
+		CASES[name] = fn
+		return fn
+	return register
+
+def populate(game, fill, seed=0):
+	"""
+		fill the bottom fill rows of game's board with garbage (a hole or
+		three per row, so nothing's cleared), and put the active piece back
+		at the top
+	"""
+	rng = random.Random(seed)
+	for y in range(game.height - fill, game.height):
+		holes = rng.sample(range(game.width), rng.randint(1, 3))
+		game.board.set_row(y, [" " if x in holes else rng.choice("IJLOSTZ") for x in range(game.width)])
+	game.spawn_shape(respawn=True)
+	return game
+
+def make_game(fill, game_class=engine.Game):
+	return populate(game_class(seed=0), fill)
+
+def placements(game):
+	"""
+		every (x, rot) the active piece could be moved to from the top
+	"""
+	spots = []
+	for rot, piece in enumerate(game.pieces[game.active_shape]):
+		for x in range(-piece.left, game.width - piece.right):
+			if not game.does_collide(x, game.active_y, rot):
+				spots.append((x, rot))
+	return spots
+
+def clones(obj, n):
+	"""
+		n independent copies of obj, for cases that use things up (pickling
+		is a lot quicker than copy.deepcopy, which matters when n is big)
+	"""
+	data = pickle.dumps(obj)
+	return [pickle.loads(data) for _ in range(n)]
+
+def timed(fn, n, items):
+	"""
+		call fn(item) n times, cycling through items
+	"""
+	items = (items * (n // len(items) + 1))[:n]
+	gc.disable()  # like timeit, so a collection doesn't land in the middle of one case but not another
+	try:
+		start = time.perf_counter()
+		for item in items:
+			fn(item)
+		return time.perf_counter() - start
+	finally:
+		gc.enable()
+
+
+# ======== ENGINE CASES ========
+
+for board_name, fill in BOARDS.items():
+	def bench_does_collide(n, fill=fill):
+		game = make_game(fill)
+		tests = [
+			(x, y, rot)
+			for rot in range(4)
+			for x in range(-2, game.width)
+			for y in range(0, game.height, 3)
+		]
+		return timed(lambda t: game.does_collide(*t), n, tests)
+	case("does_collide/" + board_name)(bench_does_collide)
+
+	def bench_ghost_y(n, fill=fill):
+		game = make_game(fill)
+		spots = placements(game)
+		def ghost(spot):
+			game.active_x, game.active_rot = spot
+			game.ghost_y()
+		return timed(ghost, n, spots)
+	case("ghost_y/" + board_name)(bench_ghost_y)
+
+	def bench_hard_drop(n, fill=fill):
+		template = make_game(fill)
+		games = clones(template, n)
+		return timed(lambda game: game.hard_drop(), n, games)
+	case("hard_drop/" + board_name)(bench_hard_drop)
+
+	def make_tetris_ready(fill):
+		# four full rows at the bottom, with the garbage on top of them
+		game = make_game(fill)
+		for y in range(game.height - 4):
+			game.board.set_row(y, [game.board.cell(x, y + 4) for x in range(game.width)])
+		for y in range(game.height - 4, game.height):
+			game.board.set_row(y, "I" * game.width)
+		return game, list(range(game.height - 4, game.height))
+
+	def bench_check_lines(n, fill=fill):
+		game, rows = make_tetris_ready(fill)
+		boards = clones(game.board, n)
+		def check(board):
+			game.board = board
+			game.check_lines(rows)
+		return timed(check, n, boards)
+	case("check_lines/" + board_name)(bench_check_lines)
+
+	def bench_do_collapse_rows(n, fill=fill):
+		game, rows = make_tetris_ready(fill)
+		game.board.clear_rows(rows)
+		boards = clones(game.board, n)
+		def collapse(board):
+			game.board = board
+			game.rows_to_collapse = rows
+			game.do_collapse_rows()
+		return timed(collapse, n, boards)
+	case("do_collapse_rows/" + board_name)(bench_do_collapse_rows)
+
+# one case per distinct wall kick table, rotating a piece that's pushed up against the left wall
+kick_shapes = {}
+for shape, table in sorted(WALLKICKS.items()):
+	kick_shapes.setdefault(id(table), shape)
+for shape in kick_shapes.values():
+	def bench_try_rotate(n, shape=shape):
+		game = make_game(BOARDS["half"])
+		game.active_shape = shape
+		game.active_rot = 0
+		game.active_x = -game.active_piece().left
+		game.active_y += game.drop_distance()
+		start_state = (game.active_x, game.active_y, game.active_rot)
+		def rotate(direction):
+			game.try_rotate(direction)
+			game.active_x, game.active_y, game.active_rot = start_state
+		return timed(rotate, n, [1, -1])
+	case("try_rotate/" + shape)(bench_try_rotate)
+
+
+# ======== FRONT-END CASES ========
+
+def load_pygame():
+	os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+	os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+	try:
+		import main
+	except Exception as e:
+		raise Skip("can't load the pygame front-end ({})".format(e))
+	main.sounds.backend = NullBackend()  # (so playing sounds doesn't count towards anything)
+	return main
+
+def load_pyglet():
+	try:
+		import pyglet
+		pyglet.options["headless"] = True
+		pyglet.options["audio"] = ("silent",)
+		import main_pyglet
+	except Exception as e:
+		raise Skip("can't load the pyglet front-end ({})".format(e))
+	main_pyglet.sounds.backend = NullBackend()
+	return main_pyglet
+
+def hard_dropped(frontend, fill):
+	"""
+		a front-end Game that has just hard-dropped a piece (so it has a
+		realistic amount of particles flying around)
+	"""
+	game = make_game(fill, frontend.Game)
+	game.fx_rng.seed(0)
+	game.hard_drop()
+	return game
+
+def bench_particles(frontend, n):
+	"""
+		n particle updates, i.e. a tick with 100 particles alive counts as 100
+	"""
+	game = hard_dropped(frontend, 0)
+	particles = game.particles
+	updates = 0
+	elapsed = 0
+	while updates < n:
+		pool = copy.deepcopy(particles)
+		start = time.perf_counter()
+		while len(pool) and updates < n:
+			updates += len(pool)
+			pool.update()
+		elapsed += time.perf_counter() - start
+	return elapsed
+
+def bench_particle_burst(frontend, n):
+	"""
+		n bursts: a tetris followed by a string of fast hard drops, and every
+		tick of those particles' lives (spawning included, since that's
+		where the sprites get scaled)
+	"""
+	game = hard_dropped(frontend, 0)
+	rows = list(range(game.height - 4, game.height))
+	elapsed = 0
+	for i in range(n):
+		game.reset()
+		game.fx_rng.seed(i)
+		start = time.perf_counter()
+		game.on_rows_cleared(rows)
+		for x in range(0, 8, 2):
+			game.spawn_shape(respawn=True)
+			game.active_x = x
+			game.on_hard_drop(game.active_y, game.height - game.active_y - 2)
+		while len(game.particles):
+			game.update_gameloop([], [])
+		elapsed += time.perf_counter() - start
+	return elapsed
+
+@case("particles/pygame")
+def bench_particles_pygame(n):
+	return bench_particles(load_pygame(), n)
+
+@case("particles/pyglet")
+def bench_particles_pyglet(n):
+	return bench_particles(load_pyglet(), n)
+
+@case("particle_burst/pygame")
+def bench_particle_burst_pygame(n):
+	return bench_particle_burst(load_pygame(), n)
+
+@case("particle_burst/pyglet")
+def bench_particle_burst_pyglet(n):
+	return bench_particle_burst(load_pyglet(), n)
+
+for board_name, fill in BOARDS.items():
+	def bench_render_pygame(n, fill=fill):
+		main = load_pygame()
+		game = hard_dropped(main, fill)
+		def render(_):
+			main.screen.fill((0, 0, 0))
+			game.render_gameplay(main.screen)
+		return timed(render, n, [None])
+	case("render_gameplay/pygame/" + board_name)(bench_render_pygame)
+
+	def bench_render_pyglet(n, fill=fill):
+		main_pyglet = load_pyglet()
+		import pyglet
+		game = hard_dropped(main_pyglet, fill)
+		main_pyglet.window.switch_to()
+		def render(_):
+			main_pyglet.window.clear()
+			game.render_gameplay(main_pyglet.window)
+		elapsed = timed(render, n, [None])
+		start = time.perf_counter()
+		pyglet.gl.glFinish()  # don't leave any of the work queued up on the GPU
+		return elapsed + time.perf_counter() - start
+	case("render_gameplay/pyglet/" + board_name)(bench_render_pyglet)
+
+
+# ======== RUNNER ========
+
+def measure(fn, min_time, repeat):
+	"""
+		returns the best time per iteration, in seconds
+	"""
+	n = 1
+	while True:  # find an n that takes long enough to time accurately
+		elapsed = fn(n)
+		if elapsed >= min_time / 10 or n >= 1 << 24:
+			break
+		n *= 10 if elapsed < min_time / 100 else 2
+	n = max(n, int(n * min_time / elapsed)) if elapsed else n
+	return min(fn(n) / n for _ in range(repeat))
+
+def format_time(seconds):
+	for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+		if seconds >= scale:
+			return "{:.2f}{}".format(seconds / scale, unit)
+	return "{:.0f}ns".format(seconds / 1e-9)
+
+def main():
+	parser = argparse.ArgumentParser(description="benchmark the engine and render hot paths")
+	parser.add_argument("-k", metavar="PATTERN", help="only run cases whose name contains PATTERN")
+	parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timing run (default: %(default)s)")
+	parser.add_argument("--repeat", type=int, default=5, help="timing runs per case (default: %(default)s)")
+	parser.add_argument("--save", metavar="FILE", help="save the results as a baseline")
+	parser.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+	parser.add_argument("--threshold", type=float, default=0.10, help="how much slower than the baseline counts as a regression (default: %(default)s, i.e. 10%%)")
+	parser.add_argument("--allow-missing", action="store_true", help="don't fail --compare on baseline cases that didn't run (skipped, or no longer exist)")
+	args = parser.parse_args()
+
+	baseline = {}
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+
+	results = {}
+	regressions = []
+	for name, fn in CASES.items():
+		if args.k and args.k not in name:
+			continue
+		try:
+			result = measure(fn, args.min_time, args.repeat)
+		except Skip as e:
+			print("{:<36} skipped: {}".format(name, e))
+			continue
+		results[name] = result
+
+		line = "{:<36} {:>10}".format(name, format_time(result))
+		if name in baseline:
+			change = result / baseline[name] - 1
+			line += " {:>+8.1%}".format(change)
+			if change > args.threshold:
+				line += "  REGRESSED"
+				regressions.append(name)
+		print(line)
+
+	if args.save:
+		with open(args.save, "w") as f:
+			json.dump(results, f, indent="\t", sort_keys=True)
+			f.write("\n")
+
+	# (cases left out with -k don't count as missing)
+	missing = [name for name in baseline if name not in results and not (args.k and args.k not in name)]
+	if missing:
+		print("{} baseline case(s) didn't run: {}".format(len(missing), ", ".join(missing)))
+
+	failed = False
+	if regressions:
+		print("{} case(s) regressed by more than {:.0%}: {}".format(len(regressions), args.threshold, ", ".join(regressions)))
+		failed = True
+	if missing and not args.allow_missing:
+		failed = True
+	if failed:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
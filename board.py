@@ -0,0 +1,266 @@
+"""
+Playfield storage backends.
+
+Both boards have the same interface, and engine.Game talks to whichever one
+Game.board_class points at. Rows are numbered from the top (y=0) like
+everywhere else, and pieces (compiled data.Piece tables) are positioned by the
+top-left corner of their SHAPES sprite.
+
+ListBoard is the original list-of-lists-of-characters grid, which is slow
+but obviously correct. BitBoard keeps one integer bitmask per row (bit x set
+means column x is occupied) so collision and line checks are just a few
+integer ops, plus a separate byte-per-cell colour plane that only the
+renderers care about. It also keeps a skyline (the topmost filled row of each
+column) up to date, so that most drop distance queries are a few lookups
+rather than a collision test per row.
+
+BitBoard rows live in a ring buffer, so collapsing cleared rows only has to
+move the rows below the topmost cleared one (everything above it moves down
+"for free" by rotating the ring), and never reallocates anything. That keeps
+line clears cheap on very tall boards.
+"""
+
+# cell contents, as stored in the BitBoard colour plane
+CELLS = " IJLOSTZ"
+CELL_CODES = {cell: code for code, cell in enumerate(CELLS)}
+
+class ListBoard:
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+		self.gridstate = [[" "]*width for _ in range(height)]
+
+	def cell(self, x, y):
+		return self.gridstate[y][x]
+
+	def row_mask(self, y):
+		return sum(1 << x for x, val in enumerate(self.gridstate[y]) if val != " ")
+
+	def set_row(self, y, cells):
+		self.gridstate[y] = list(cells)
+
+	def collides(self, piece, testx, testy):
+		for x, y in piece.cells:
+			posy = testy + y
+			posx = testx + x
+			if posy >= self.height:
+				return True  # we hit the floor
+			if posx < 0 or posx >= self.width:
+				return True  # we hit a wall
+			if posy < 0:
+				continue  # I don't think this should ever happen, but if we're above the ceiling, ignore
+
+			# if we reached here, (posx, posy) is definitely inside the grid
+			if self.gridstate[posy][posx] != " ":
+				return True  # collision with a block already on the grid
+
+		# if we made it this far, there were no collisions
+		return False
+
+	def stamp(self, piece, posx, posy):
+		"""
+			returns the rows that were written to, top to bottom
+		"""
+		for x, y in piece.cells:
+			self.gridstate[posy + y][posx + x] = piece.shape
+		return [posy + y for y, _ in piece.rows]
+
+	def drop_distance(self, piece, x, y):
+		"""
+			how many rows the piece can fall from (x, y) before it lands
+		"""
+		distance = 0
+		while not self.collides(piece, x, y + distance + 1):
+			distance += 1
+		return distance
+
+	def full_rows(self, rows=None):
+		if rows is None:
+			rows = range(self.height)
+		return [y for y in rows if self.gridstate[y].count(" ") == 0]
+
+	def clear_rows(self, rows):
+		for y in rows:
+			self.gridstate[y] = [" "] * self.width
+
+	def collapse_rows(self, rows):
+		rows = set(rows)
+		kept = [row for y, row in enumerate(self.gridstate) if y not in rows]
+		self.gridstate = [[" "] * self.width for _ in rows] + kept
+
+class BitBoard:
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+		self.full_mask = (1 << width) - 1
+		self.blank_colours = bytes(width)
+		# physical storage, logical row y is at index (self.top + y) % height
+		self.top = 0
+		self.rows = [0] * height
+		self.colours = [bytearray(width) for _ in range(height)]
+		self.heights = [height] * width  # topmost filled (logical) row of each column (height if it's empty)
+
+	def cell(self, x, y):
+		return CELLS[self.colours[(self.top + y) % self.height][x]]
+
+	def row_mask(self, y):
+		return self.rows[(self.top + y) % self.height]
+
+	def set_row(self, y, cells):
+		i = (self.top + y) % self.height
+		mask = 0
+		for x, val in enumerate(cells):
+			self.colours[i][x] = CELL_CODES[val]
+			if val != " ":
+				mask |= 1 << x
+		self.rows[i] = mask
+		self.rebuild_heights()
+
+	def rebuild_heights(self, start=0, columns=None):
+		"""
+			recompute the skyline for the given columns (a mask, default
+			all of them), only looking at rows from start downwards
+		"""
+		heights = self.heights
+		remaining = self.full_mask if columns is None else columns  # columns we haven't found the top of yet
+		found = remaining
+		while found:
+			lowest = found & -found
+			heights[lowest.bit_length() - 1] = self.height
+			found ^= lowest
+
+		rows = self.rows
+		top = self.top
+		height = self.height
+		for y in range(start, height):
+			if not remaining:
+				break
+			found = rows[(top + y) % height] & remaining
+			if not found:
+				continue
+			remaining ^= found
+			while found:
+				lowest = found & -found
+				heights[lowest.bit_length() - 1] = y
+				found ^= lowest
+
+	def collides(self, piece, x, y):
+		x += piece.left
+		if x < 0 or x + piece.right - piece.left >= self.width or y + piece.bottom >= self.height:
+			return True  # walls or floor
+		rows = self.rows
+		top = self.top
+		height = self.height
+		for dy, mask in piece.rows:
+			if y + dy >= 0 and rows[(top + y + dy) % height] & (mask << x):  # (above the ceiling only the walls count)
+				return True
+		return False
+
+	def stamp(self, piece, x, y):
+		"""
+			returns the rows that were written to, top to bottom
+		"""
+		code = CELL_CODES[piece.shape]
+		top = self.top
+		height = self.height
+		heights = self.heights
+		for dx, dy in piece.cells:
+			self.colours[(top + y + dy) % height][x + dx] = code
+			if y + dy < heights[x + dx]:
+				heights[x + dx] = y + dy
+		x += piece.left
+		touched = []
+		for dy, mask in piece.rows:
+			self.rows[(top + y + dy) % height] |= mask << x
+			touched.append(y + dy)
+		return touched
+
+	def drop_distance(self, piece, x, y):
+		"""
+			how many rows the piece can fall from (x, y) before it lands
+
+			(x, y) has to be inside the walls, but can overlap the stack
+		"""
+		heights = self.heights
+		distance = self.height - y
+		for dx, dy in piece.col_bottoms:
+			gap = heights[x + dx] - (y + dy) - 1
+			if gap < 0:
+				break  # this column of the piece is below the skyline (tucked under an overhang), so we have to search
+			if gap < distance:
+				distance = gap
+		else:
+			return distance
+
+		distance = 0
+		while not self.collides(piece, x, y + distance + 1):
+			distance += 1
+		return distance
+
+	def full_rows(self, rows=None):
+		if rows is None:
+			rows = range(self.height)
+		full_mask = self.full_mask
+		top = self.top
+		height = self.height
+		return [y for y in rows if self.rows[(top + y) % height] == full_mask]
+
+	def clear_rows(self, rows):
+		for y in rows:
+			i = (self.top + y) % self.height
+			self.rows[i] = 0
+			self.colours[i][:] = self.blank_colours
+
+		# only the columns whose top was in a cleared row have a new top, and
+		# it's somewhere below the first cleared row
+		cleared = set(rows)
+		stale = 0
+		for x, y in enumerate(self.heights):
+			if y in cleared:
+				stale |= 1 << x
+		if stale:
+			self.rebuild_heights(min(cleared), stale)
+
+	def collapse_rows(self, rows):
+		if not rows:
+			return
+		cleared = set(rows)
+		first = min(cleared)
+		count = len(cleared)
+		top = self.top
+		height = self.height
+		phys_rows = self.rows
+		colours = self.colours
+
+		# Everything above the first cleared row needs to move down by count,
+		# which rotating the ring by count does for us. So in the old
+		# numbering, the rows below it get packed upwards into
+		# first..height-count-1, and the count rows left over at the bottom
+		# wrap around to become the new (empty) top rows.
+		write = first
+		for read in range(first, height):
+			if read in cleared:
+				continue
+			if read != write:
+				r = (top + read) % height
+				w = (top + write) % height
+				phys_rows[w] = phys_rows[r]
+				colours[w], colours[r] = colours[r], colours[w]  # swap, so the buffers are recycled rather than shared
+			write += 1
+		for y in range(write, height):
+			i = (top + y) % height
+			phys_rows[i] = 0
+			colours[i][:] = self.blank_colours
+		self.top = (top - count) % height
+
+		# columns whose top was above the first cleared row just moved down,
+		# the rest have to be looked for again (but only below the rows that moved)
+		heights = self.heights
+		stale = 0
+		for x in range(self.width):
+			if heights[x] < first:
+				heights[x] += count
+			else:
+				stale |= 1 << x
+		if stale:
+			self.rebuild_heights(first + count, stale)
@@ -0,0 +1,156 @@
+"""
+Computer players, for driving headless engine.Game instances (see
+tournament.py).
+
+A policy gets asked for its inputs once per tick, and answers with the same
+(pressed, held) pair that Game.update() takes, so bots play by exactly the same
+rules (DAS, gravity, lock timing etc.) as a human would. They only use the
+public Game and board interfaces, so they work with either board backend.
+"""
+
+from abc import ABC, abstractmethod
+import random
+
+from engine import Action, HELD_KEYS
+
+class Policy(ABC):
+	def __init__(self, seed=None):
+		self.rng = random.Random(seed)
+
+	@abstractmethod
+	def act(self, game):
+		"""
+			returns (pressed, held) for this tick
+		"""
+		pass
+
+class IdlePolicy(Policy):
+	"""
+		never touches the controls, so the pieces just stack up in the middle
+	"""
+
+	def act(self, game):
+		return [], ()
+
+class RandomPolicy(Policy):
+	"""
+		mashes buttons
+	"""
+
+	def act(self, game):
+		pressed = []
+		if self.rng.random() < 0.1:
+			pressed.append(self.rng.choice((Action.ROTATE_CW, Action.ROTATE_CCW, Action.HOLD, Action.HARD_DROP)))
+		held = [name for name in HELD_KEYS if self.rng.random() < 0.3]
+		return pressed, held
+
+class GreedyPolicy(Policy):
+	"""
+		tries every rotation and column for the active piece, and steers
+		towards whichever one leaves the best looking stack (the usual
+		height/lines/holes/bumpiness weighting, no lookahead)
+	"""
+
+	HEIGHT_WEIGHT = -0.510066
+	LINES_WEIGHT = 0.760666
+	HOLES_WEIGHT = -0.35663
+	BUMPINESS_WEIGHT = -0.184483
+
+	PATIENCE = 60  # ticks to spend steering before giving up and dropping wherever we are
+
+	def __init__(self, seed=None):
+		super().__init__(seed)
+		self.placed = None
+		self.target = None
+		self.steering_ticks = 0
+		self.tapped = False
+
+	def act(self, game):
+		if game.line_clear_animation_ticks_remaining:
+			return [], ()  # inputs are ignored until the next piece spawns anyway
+
+		if self.placed != game.pieces_placed:  # new piece, work out where it should go
+			self.placed = game.pieces_placed
+			self.target = self.choose(game)
+			self.steering_ticks = 0
+		self.steering_ticks += 1
+
+		if self.target is None or self.steering_ticks > self.PATIENCE:
+			return [Action.HARD_DROP], ()
+		rot, x = self.target
+
+		pressed = []
+		if game.active_rot != rot:
+			pressed.append(Action.ROTATE_CW)
+
+		# movement only happens on the first tick of a press, so let go in between
+		held = ()
+		if self.tapped:
+			self.tapped = False
+		elif game.active_x < x:
+			held = ("right",)
+			self.tapped = True
+		elif game.active_x > x:
+			held = ("left",)
+			self.tapped = True
+
+		if not pressed and not held and game.active_x == x:
+			pressed.append(Action.HARD_DROP)
+		return pressed, held
+
+	def choose(self, game):
+		"""
+			returns the best (rotation, x) for the active piece, or None if it
+			can't go anywhere
+		"""
+		board = game.board
+		rows = [board.row_mask(y) for y in range(game.height)]
+		best = None
+		best_score = None
+		for rot, piece in enumerate(game.pieces[game.active_shape]):
+			for x in range(-piece.left, game.width - piece.right):
+				if board.collides(piece, x, game.active_y):
+					continue
+				y = game.active_y + board.drop_distance(piece, x, game.active_y)
+				score = self.evaluate(rows, piece, x, y, game.width)
+				if best_score is None or score > best_score:
+					best = (rot, x)
+					best_score = score
+		return best
+
+	def evaluate(self, rows, piece, x, y, width):
+		"""
+			score the stack we'd get by locking piece at (x, y)
+		"""
+		rows = rows[:]
+		for dy, mask in piece.rows:
+			if y + dy >= 0:
+				rows[y + dy] |= mask << (x + piece.left)
+
+		full_mask = (1 << width) - 1
+		kept = [row for row in rows if row != full_mask]
+		lines = len(rows) - len(kept)
+
+		heights = [0] * width
+		holes = 0
+		above = 0  # columns that have something above the current row
+		for y, row in enumerate(kept, len(rows) - len(kept)):
+			found = row & ~above
+			while found:
+				lowest = found & -found
+				heights[lowest.bit_length() - 1] = len(rows) - y
+				found ^= lowest
+			holes += bin(above & ~row).count("1")
+			above |= row
+
+		bumpiness = sum(abs(a - b) for a, b in zip(heights, heights[1:]))
+		return (self.HEIGHT_WEIGHT * sum(heights)
+			+ self.LINES_WEIGHT * lines
+			+ self.HOLES_WEIGHT * holes
+			+ self.BUMPINESS_WEIGHT * bumpiness)
+
+POLICIES = {
+	"idle": IdlePolicy,
+	"random": RandomPolicy,
+	"greedy": GreedyPolicy,
+}
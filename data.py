@@ -1,3 +1,5 @@
+from collections import namedtuple
+
 CELL_COLOURS = {
     " ": (0x20, 0x20, 0x20),
     "I": (0x00, 0xf0, 0xf0),
@@ -89,7 +91,7 @@ SHAPES = {
     "O": [[
         " OO ",
         " OO ",
-        "     "
+        "    "
     ], [
         " OO ",
         " OO ",
@@ -159,6 +161,90 @@ SHAPES = {
     ]]
 }
 
+"""
+The hot paths never look at the ASCII art above directly, they use these
+tables instead, compiled once at import. compile_shapes() works on any dict
+in the same format, so other rotation systems can be compiled the same way.
+
+Piece fields, for one rotation of one shape:
+    shape       - the shape's name (which is also its cell character)
+    cells       - ((x, y), ...) of the filled cells, relative to the sprite's top-left
+    rows        - ((y, mask), ...) for each non-empty row, where bit 0 of mask is column "left"
+    left, top, right, bottom - bounding box of the filled cells (inclusive)
+    col_bottoms - ((x, y), ...) of the lowest filled cell in each column, left to right
+"""
+Piece = namedtuple("Piece", "shape cells rows left top right bottom col_bottoms")
+
+def compile_piece(shape, sprite):
+    cells = tuple(
+        (x, y)
+        for y, row in enumerate(sprite)
+        for x, val in enumerate(row)
+        if val != " "
+    )
+    xs = [x for x, _ in cells]
+    ys = [y for _, y in cells]
+    left = min(xs)
+
+    rows = {}
+    bottoms = {}
+    for x, y in cells:
+        rows[y] = rows.get(y, 0) | (1 << (x - left))
+        bottoms[x] = max(bottoms.get(x, y), y)
+
+    return Piece(
+        shape=shape,
+        cells=cells,
+        rows=tuple(sorted(rows.items())),
+        left=left,
+        top=min(ys),
+        right=max(xs),
+        bottom=max(ys),
+        col_bottoms=tuple(sorted(bottoms.items())),
+    )
+
+def compile_shapes(shapes):
+    """
+    Returns {shape: [Piece for each rotation]}
+
+    Raises ValueError if any shape doesn't have exactly 4 rotations, or any
+    sprite is malformed: ragged rows, sprites that change size between
+    rotations, stray characters, or rotations that don't all have the same
+    (non-zero) number of cells.
+    """
+    if not shapes:
+        raise ValueError("no shapes to compile")
+
+    compiled = {}
+    for shape, rotations in shapes.items():
+        if len(shape) != 1 or shape == " ":
+            raise ValueError(f"shape name {shape!r} must be a single non-space character")
+        if len(rotations) != 4:
+            raise ValueError(f"shape {shape!r} must have 4 rotations")
+
+        dims = (len(rotations[0]), len(rotations[0][0]) if rotations[0] else 0)
+        pieces = []
+        for rot, sprite in enumerate(rotations):
+            where = f"shape {shape!r} rotation {rot}"
+            if any(len(row) != len(sprite[0]) for row in sprite):
+                raise ValueError(f"{where} has rows of uneven length")
+            if (len(sprite), len(sprite[0]) if sprite else 0) != dims:
+                raise ValueError(f"{where} is not the same size as rotation 0")
+            stray = set("".join(sprite)) - {" ", shape}
+            if stray:
+                raise ValueError(f"{where} contains unexpected characters {sorted(stray)}")
+            if shape not in "".join(sprite):
+                raise ValueError(f"{where} is empty")
+            pieces.append(compile_piece(shape, sprite))
+
+        if len({len(piece.cells) for piece in pieces}) != 1:
+            raise ValueError(f"shape {shape!r} changes cell count between rotations")
+        compiled[shape] = pieces
+
+    return compiled
+
+PIECES = compile_shapes(SHAPES)
+
 JLTSZ_WALLKICKS = {
     (0, 1): [(0, 0), (-1, 0), (-1, 1), ( 0,-2), (-1,-2)],
     (1, 0): [(0, 0), ( 1, 0), ( 1,-1), ( 0, 2), ( 1, 2)],
@@ -0,0 +1,460 @@
+"""
+Pure game logic, shared by main.py (pygame) and main_pyglet.py (pyglet).
+
+Nothing in here is allowed to touch pygame or pyglet, so it can be imported
+and driven headlessly (batch simulations, CI, bots etc.)
+
+Front-ends subclass Game, translate their own key events into Actions, and
+override the hook methods at the bottom of the class to play sounds and spawn
+particles.
+"""
+
+from enum import Enum, auto
+import hashlib
+import random
+
+from data import PIECES, WALLKICKS
+from board import BitBoard
+
+# default board size (the rows in the topzone are above the visible playfield)
+gridwidth, gridheight = 10, 24
+topzone = 4
+
+TICK_RATE = 60 # game logic ticks per second, however fast the front-end is drawing
+
+CLEAR_ANIMATION_DELAY = 20 # ticks
+CLEAR_ANIMATION_DURATION = 5 # ticks
+
+class GameState(Enum):
+	"""
+		all possible gameplay states
+	"""
+	PLAYING = auto()
+	PAUSED = auto()
+	ANIMATING = auto()  # game logic paused for rendering line-clear animation
+	GAMEOVER = auto()
+
+class Action(Enum):
+	"""
+		one-shot inputs (i.e. key presses, as opposed to held keys)
+	"""
+	ROTATE_CW = auto()
+	ROTATE_CCW = auto()
+	HOLD = auto()
+	HARD_DROP = auto()
+	PAUSE = auto()  # toggles
+	RESTART = auto()
+
+# names of the keys whose held state matters (see Game.heldticks)
+HELD_KEYS = ("left", "right", "down")
+
+class FixedTimestep:
+	"""
+		Turns real time into whole game ticks, so the game runs at the same
+		speed whatever rate the front-end draws at
+
+		advance(dt) adds dt seconds and returns how many ticks are now due,
+		carrying the remainder over to next time. fraction is how far
+		into the next tick that remainder is (0 to 1), for interpolating
+		between the last two ticks when drawing. More than max_ticks due at
+		once (after the window was dragged, say) get dropped, rather than
+		played back-to-back in a burst.
+	"""
+
+	def __init__(self, rate=TICK_RATE, max_ticks=8):
+		self.rate = rate
+		self.max_ticks = max_ticks
+		self.accumulator = 0.0  # in ticks
+
+	def advance(self, dt):
+		self.accumulator += dt * self.rate
+		ticks = int(self.accumulator + 1e-6)  # (so n frames of exactly 1/rate are n ticks, despite rounding)
+		self.accumulator -= ticks
+		if ticks > self.max_ticks:
+			ticks = self.max_ticks
+			self.accumulator = 0.0
+		return ticks
+
+	@property
+	def fraction(self):
+		return min(max(self.accumulator, 0.0), 1.0)
+
+class Game:
+	"""
+		Contains the entire game state and gameplay logic
+	"""
+
+	board_class = BitBoard  # or board.ListBoard
+
+	# the rotation system: compiled data.Piece tables, and the wall kicks to go with them
+	pieces = PIECES
+	wallkicks = WALLKICKS
+
+	def __init__(self, width=gridwidth, height=gridheight, topzone=topzone, seed=None, rng=None):
+		"""
+			Each game owns its gameplay RNG, which is only used for shuffling
+			the 7-bag, so the same seed always gives the same piece sequence
+			(across restarts too), no matter what the front-end does with its
+			own randomness. seed=None means a fresh random seed.
+
+			rng overrides the gameplay RNG with anything that has a shuffle()
+			method, in which case seed is ignored.
+		"""
+		self.width = width
+		self.height = height
+		self.topzone = topzone
+		self.seed = seed
+		self.rng = random.Random(seed) if rng is None else rng
+		self.recorder = None  # a replay.Recorder, if the inputs are being recorded
+		self.reset()
+
+	def reset(self):
+		self.random_bag = []
+		self.gamestate = GameState.PLAYING
+		self.board = self.board_class(self.width, self.height)
+		self.on_board_changed()
+		self.shape_queue = [self.random_shape() for _ in range(3)]
+		self.score = 0
+		self.level = 1
+		self.line_count = 0
+		self.pieces_placed = 0
+		self.gameticks = 0
+		self.time_til_drop = self.time_per_drop()
+		self.line_clear_animation_ticks_remaining = 0
+		self.rows_to_collapse = []
+		self.prev_back2back = False
+		self.heldticks = {
+			"left": 0,
+			"right": 0,
+			"down": 0
+		}
+		self.hold = None
+		self.can_swap = True
+
+		self.active_shape = None
+		self.active_x = None
+		self.active_y = None
+		self.active_rot = None
+		self.prev_active = None  # (shape, x, y, rot) before the last tick, see active_position()
+		self.spawn_shape()
+
+	def random_shape(self):
+		if not self.random_bag:
+			self.random_bag = list(self.pieces.keys())
+			self.rng.shuffle(self.random_bag)
+		return self.random_bag.pop()
+
+	def spawn_shape(self, respawn=False):
+		if not respawn:
+			self.active_shape = self.shape_queue.pop(0)
+			self.shape_queue.append(self.random_shape())
+		self.active_x = (self.width - 4) // 2
+		self.active_y = self.topzone - 2
+		self.active_rot = 0
+
+		if self.does_collide():
+			self.gamestate = GameState.GAMEOVER
+			self.play_sfx("blockout")
+			self.on_gameover()
+
+	def try_rotate(self, direction):
+		new_rot = (self.active_rot + direction) % 4
+		wallkicks = self.wallkicks[self.active_shape][(self.active_rot, new_rot)]
+
+		for dx, dy in wallkicks:
+			new_x = self.active_x + dx
+			new_y = self.active_y - dy  # positive Y is upwards, in wallkick data (because that's what the tetris wiki uses)
+			if not self.does_collide(new_x, new_y, new_rot):
+				self.active_rot = new_rot
+				self.active_x = new_x
+				self.active_y = new_y
+				self.play_sfx("rotate")
+				if self.is_resting(): #XXX should this be if it *was* resting?
+					self.time_til_drop = self.time_per_drop()
+				return True
+
+		return False
+
+	def try_movex(self, direction):
+		self.active_x += direction
+		if self.does_collide():
+			# revert
+			self.active_x -= direction
+			return False
+		else:
+			self.play_sfx("move")
+			if self.is_resting():
+				self.time_til_drop = self.time_per_drop()
+			return True
+
+	def try_movey(self, direction):
+		self.active_y += direction
+		if self.does_collide():
+			# revert
+			self.active_y -= direction
+			return False
+		else:
+			return True
+
+	def active_piece(self):
+		return self.pieces[self.active_shape][self.active_rot]
+
+	def stamp_piece(self):
+		rows = self.board.stamp(self.active_piece(), self.active_x, self.active_y)
+		self.on_board_changed()
+		return rows
+
+	def drop_distance(self):
+		"""
+			how many rows the active piece can fall before it lands
+		"""
+		return self.board.drop_distance(self.active_piece(), self.active_x, self.active_y)
+
+	def is_resting(self):
+		return self.drop_distance() == 0
+
+	def does_collide(self, testx=None, testy=None, testrot=None):
+		if testx is None:
+			testx = self.active_x
+		if testy is None:
+			testy = self.active_y
+		if testrot is None:
+			testrot = self.active_rot
+		return self.board.collides(self.pieces[self.active_shape][testrot], testx, testy)
+
+	def active_position(self, fraction=1.0):
+		"""
+			where to draw the active piece, fraction of the way (see
+			FixedTimestep.fraction) from where it was before the last tick to
+			where it is now. only single cell moves (gravity, soft drop,
+			shifting) get smoothed, anything else (hard drops, kicks, a new
+			piece) just snaps
+		"""
+		prev = self.prev_active
+		if fraction >= 1 or prev is None or prev[0] != self.active_shape or prev[3] != self.active_rot:
+			return self.active_x, self.active_y
+		dx = self.active_x - prev[1]
+		dy = self.active_y - prev[2]
+		if abs(dx) > 1 or not 0 <= dy <= 1:
+			return self.active_x, self.active_y
+		return prev[1] + dx * fraction, prev[2] + dy * fraction
+
+	def ghost_y(self):
+		"""
+			where the active piece would land if it was hard-dropped
+		"""
+		return self.active_y + self.drop_distance()
+
+	def do_collapse_rows(self):
+		self.board.collapse_rows(self.rows_to_collapse)
+		self.rows_to_collapse = []
+		self.on_board_changed()
+
+	def check_lines(self, rows=None):
+		"""
+			rows are the only rows that could have been completed (i.e. the
+			ones the last piece was stamped into), or None to check them all
+		"""
+		self.rows_to_collapse = self.board.full_rows(rows)
+		if not self.rows_to_collapse:
+			return False
+
+		self.board.clear_rows(self.rows_to_collapse)
+
+		self.on_board_changed()
+		self.on_rows_cleared(self.rows_to_collapse)
+
+		linecount = len(self.rows_to_collapse)
+		back2back_bonus = 1.0
+		if linecount == 4:
+			if self.prev_back2back:
+				back2back_bonus = 1.5
+			self.play_sfx("tetris")
+			self.prev_back2back = True
+		else:
+			self.play_sfx("lineClear")
+			self.prev_back2back = False
+		self.play_sfx("collapse")
+
+		self.score += int(self.level * [0, 100, 300, 500, 800][linecount] * back2back_bonus)
+		new_line_total = self.line_count + linecount
+		if self.line_count // 10 != new_line_total // 10: # if we crossed a new multiple of 10 boundary
+			self.level += 1
+			self.play_sfx("levelUp")
+		self.line_count = new_line_total
+
+		self.line_clear_animation_ticks_remaining = CLEAR_ANIMATION_DELAY + CLEAR_ANIMATION_DURATION
+
+		return True
+
+	def pause(self):
+		self.gamestate = GameState.PAUSED
+
+	def unpause(self):
+		self.gamestate = GameState.PLAYING
+
+	def update(self, pressed, held):
+		"""
+			Advance the game by one tick (1/TICK_RATE seconds)
+
+			pressed is a list of Actions, in the order they happened.
+			held is a collection of the HELD_KEYS names currently held down.
+		"""
+		if self.recorder is not None:
+			self.recorder.record(pressed, held)
+
+		self.prev_active = (self.active_shape, self.active_x, self.active_y, self.active_rot)
+		if self.gamestate == GameState.PLAYING:
+			self.update_gameloop(pressed, held)
+		elif self.gamestate == GameState.PAUSED:
+			for action in pressed:
+				if action == Action.PAUSE:
+					self.unpause()
+		elif self.gamestate == GameState.GAMEOVER:
+			for action in pressed:
+				if action == Action.RESTART:
+					self.reset()
+
+	def update_gameloop(self, pressed, held):
+		if self.line_clear_animation_ticks_remaining > 0:
+			self.line_clear_animation_ticks_remaining -= 1
+			if self.line_clear_animation_ticks_remaining == 0:
+				self.do_collapse_rows()
+				self.spawn_shape()
+			return
+
+		self.gameticks += 1
+
+		for action in pressed:
+			if action == Action.ROTATE_CW:
+				self.try_rotate(1)
+			if action == Action.ROTATE_CCW:
+				self.try_rotate(-1)
+			if action == Action.HOLD:
+				self.swap_hold()
+			if action == Action.HARD_DROP:
+				self.hard_drop()
+			if action == Action.PAUSE:
+				self.pause()
+
+		# keep track of how long these keys have been held
+		for name in HELD_KEYS:
+			if name in held:
+				self.heldticks[name] += 1
+			else:
+				self.heldticks[name] = 0
+
+		if self.heldticks["down"] == 1: # sfx on first press
+			self.play_sfx("move")
+		if self.heldticks["down"] % 2 == 1: # 30Hz softdrop
+			if self.drop_distance():
+				self.active_y += 1
+				self.time_til_drop = self.time_per_drop()
+				self.score += 1
+
+		if self.heldticks["left"] == 1 or (self.heldticks["left"] > 10 and self.heldticks["left"] % 2 == 1):  # 30Hz ARR, 10 tick DAS
+			self.try_movex(-1)
+
+		if self.heldticks["right"] == 1 or (self.heldticks["right"] > 10 and self.heldticks["right"] % 2 == 1):  # 30Hz ARR, 10 tick DAS
+			self.try_movex(1)
+
+		self.time_til_drop -= 1 / TICK_RATE
+		if self.time_til_drop < 0:
+			rows = 1
+			while rows < self.height and self.time_til_drop + self.time_per_drop() < 0:  # past level 13, more than one row is due per tick
+				self.time_til_drop += self.time_per_drop()
+				rows += 1
+			self.apply_gravity(rows)
+			self.time_til_drop += self.time_per_drop()
+
+	def state_hash(self):
+		"""
+			an 8-byte digest of everything that affects how the game plays out
+			from here, for checking that a replay hasn't diverged
+		"""
+		h = hashlib.blake2b(digest_size=8)
+		for y in range(self.height):
+			h.update("".join(self.board.cell(x, y) for x in range(self.width)).encode())
+		h.update(repr((
+			self.gamestate.name,
+			self.active_shape, self.active_x, self.active_y, self.active_rot,
+			self.hold, self.can_swap, self.shape_queue, self.random_bag,
+			self.score, self.level, self.line_count, self.pieces_placed, self.prev_back2back,
+			self.gameticks, self.time_til_drop,
+			self.line_clear_animation_ticks_remaining, self.rows_to_collapse,
+			[self.heldticks[name] for name in HELD_KEYS],
+		)).encode())
+		return h.digest()
+
+	def time_per_drop(self):
+		return (0.8 - ((self.level - 1) * 0.007)) ** (self.level - 1)
+
+	def hard_drop(self):
+		drop_height = self.drop_distance()
+		self.active_y += drop_height
+		self.score += 2 * drop_height
+
+		self.on_hard_drop(self.active_y - drop_height, drop_height)
+		self.play_sfx("hardDrop")
+		self.time_til_drop = self.time_per_drop()
+		self.lockdown()
+
+	def swap_hold(self):
+		if not self.can_swap:
+			return
+		self.play_sfx("hold")
+
+		if self.hold is None:
+			self.hold = self.active_shape
+			self.spawn_shape()
+		else:
+			self.active_shape, self.hold = self.hold, self.active_shape
+			self.spawn_shape(respawn=True)
+
+		self.can_swap = False # this gets reset on next lockdown
+
+	def lockdown(self):
+		self.pieces_placed += 1
+		if not self.check_lines(self.stamp_piece()):
+			self.spawn_shape()
+		self.can_swap = True
+		self.play_sfx("lock")
+
+	def apply_gravity(self, rows=1):
+		distance = self.drop_distance()
+		if not distance:
+			#print(self.last_rotate_tick, self.last_drop_time * 60)
+			#if self.last_rotate_tick + 60 < self.last_drop_time * 60:
+			self.lockdown()
+		else:
+			self.active_y += min(rows, distance)
+
+
+	# ======== FRONT-END HOOKS ========
+	# these are all no-ops here, so a headless Game is silent and has no VFX
+
+	def play_sfx(self, name):
+		pass
+
+	def on_gameover(self):
+		pass
+
+	def on_rows_cleared(self, rows):
+		"""
+			rows have just been blanked, and will be collapsed once the
+			line clear animation finishes
+		"""
+		pass
+
+	def on_hard_drop(self, drop_top, drop_height):
+		"""
+			called after the piece has moved down, but before it locks
+		"""
+		pass
+
+	def on_board_changed(self):
+		"""
+			the board's cells have changed: a piece was stamped, rows were
+			cleared or collapsed, or it's a whole new board
+		"""
+		pass
@@ -14,7 +14,7 @@ TODO:
 - Game menus etc.
 - controller input
 - 2 player???
-- loading screen?
+- loading screen [DONE]
 - Non-copyrighted assets (lol)
 
 BUG:
@@ -25,493 +25,538 @@ theory: there's a one-frame window where you can press space and re-drop the sam
 twice?
 """
 
-from enum import Enum, auto
-from abc import ABC, abstractmethod
+import argparse
+import os
 import random
+import time
 import pygame
 
-from data import CENTRE_SHIFT, SHAPES, WALLKICKS
+from assets import IMAGES, LoadReport, Loader, PygameAssets, Sounds, mino_path
+import bakecache
+from data import CENTRE_SHIFT
+import engine
+from engine import Action, GameState, gridwidth, gridheight, topzone, CLEAR_ANIMATION_DURATION
+from particles import ParticlePool, STREAK, SPARKLE, ROW_CLEAR
+from profiler import FrameProfiler, NullProfiler
+from sound import NullBackend, NullMusic, PygameBackend, SoundManager, VOICES
+from tracing import Tracer
 
 BLACK = (0x00, 0x00, 0x00)
 WHITE = (0xff, 0xff, 0xff)
 
-pygame.init()
+parser = argparse.ArgumentParser()
+parser.add_argument("--seed", type=int, help="seed for the piece sequence (random by default)")
+parser.add_argument("--record", metavar="FILE", help="record inputs to FILE, for replay.py")
+parser.add_argument("--dirty-rects", action="store_true", help="only redraw and present the parts of the screen that changed")
+parser.add_argument("--scale", type=float, default=2, help="size of the window, relative to the 1280x720 layout (default: %(default)s)")
+parser.add_argument("--asset-report", action="store_true", help="after the first frame, print how long each asset took to load, how much memory it uses, and the time to the first frame")
+parser.add_argument("--sdl-scaled", action="store_true", help="render at 1x and let SDL scale it up to fit the window (in hardware, where available)")
+parser.add_argument("--fps", type=float, help="cap on frames drawn per second, 0 for uncapped (default: the display's refresh rate, the game itself always runs at 60 ticks per second)")
+parser.add_argument("--no-sleep", action="store_true", help="run one game tick per frame, back to back without waiting (for headless runs, with SDL_VIDEODRIVER=dummy)")
+parser.add_argument("--profile", metavar="FILE", help="on exit, write per-phase frame time percentiles to FILE (.json for JSON, otherwise CSV), F3 shows them in-game")
+parser.add_argument("--trace", metavar="FILE", help="on exit, write Chrome trace events (hot path spans and calls per frame) to FILE, and print the call counts")
+parser.add_argument("--audio-rate", type=int, default=44100, help="mixer sample rate, in Hz (default: %(default)s)")
+parser.add_argument("--audio-buffer", type=int, default=512, help="mixer buffer size, in samples: smaller means less latency, but more chance of crackling (default: %(default)s)")
+parser.add_argument("--voices", type=int, default=VOICES, help="how many sounds can play at once (default: %(default)s)")
+parser.add_argument("--no-audio", action="store_true", help="don't open an audio device or load any sounds")
+parser.add_argument("--max-particles", type=int, default=512, help="cap on live particles, new ones are dropped past this (default: %(default)s)")
+# (parsed up here because the display gets set up at import time, importers get the defaults)
+args = parser.parse_args(None if __name__ == "__main__" else [])
+
+report = LoadReport()  # (timing starts here, for --asset-report's time to first frame)
+
+# everything is laid out for 1280x720, then drawn natively at render_scale times that,
+# with all the art scaled up once at load time (rather than scaling every frame)
+render_scale = 1 if args.sdl_scaled else args.scale
+
+# only what the loading screen needs gets set up at import, everything else is load()ed when the first Game is made
+pygame.display.init()
 pygame.font.init()
-pygame.mixer.init()
 
-font = pygame.font.Font("./assets/fonts/CenturyGothic.ttf", 20)
-mediumfont = pygame.font.SysFont("Ubuntu", 48)
-hugefont = pygame.font.SysFont("Ubuntu", 128)
-
-size = width, height = 1280, 720
-render_surface = pygame.surface.Surface(size)
-screen = pygame.display.set_mode((width*2, height*2))
+size = width, height = round(1280 * render_scale), round(720 * render_scale)
+if args.sdl_scaled:
+	screen = pygame.display.set_mode(size, pygame.SCALED)
+else:
+	screen = pygame.display.set_mode(size)
 
 clock = pygame.time.Clock()
 
-gridwidth, gridheight = 10, 24
-topzone = 4
-cell_size = 26 #(height * 0.8) // (gridheight - topzone)
+cell_size = round(26 * render_scale) #(height * 0.8) // (gridheight - topzone)
 
 top_margin = (height - (cell_size*(gridheight-topzone))) // 2
 left_margin = (width - (cell_size*gridwidth)) // 2
 
-CLEAR_ANIMATION_DELAY = 20 # frames
-CLEAR_ANIMATION_DURATION = 5 # frames
-
-sfx = {
-	"move":        pygame.mixer.Sound("assets/sound/move.wav"),
-	"rotate":      pygame.mixer.Sound("assets/sound/rotate.wav"),
-	"hardDrop":    pygame.mixer.Sound("assets/sound/hardDrop.wav"),
-	"tetris":      pygame.mixer.Sound("assets/sound/tetris.wav"),
-	"lineClear":   pygame.mixer.Sound("assets/sound/lineClear.wav"),
-	"collapse":    pygame.mixer.Sound("assets/sound/collapse.wav"),
-	"blockout":    pygame.mixer.Sound("assets/sound/blockout.wav"),
-	"levelUp":     pygame.mixer.Sound("assets/sound/levelUp.wav"),
-	"lock":        pygame.mixer.Sound("assets/sound/lock.wav"),
-	"hold":        pygame.mixer.Sound("assets/sound/hold.wav"),
-	"korobeiniki": pygame.mixer.Sound("assets/sound/Korobeiniki-F01.wav")
-}
+def init_mixer():
+	pygame.mixer.init(frequency=args.audio_rate, buffer=args.audio_buffer)
+	pygame.mixer.music.load("assets/sound/Korobeiniki-F01.wav")
 
-pygame.mixer.music.load("assets/sound/Korobeiniki-F01.wav")
-
-def load_images():
-	images = {}
-	for mode in ["dying", "ghost", "locked", "normal"]:
-		images[mode] = {}
-		for shape in "IJLOSTZ":
-			images[mode][shape] = pygame.image.load(f"assets/images/mino-01-{mode}-~size-25~-{shape}.png")
-	return images
-
-imgs = load_images()
-bgimg = pygame.image.load("assets/images/main-background.png")
-matriximg = pygame.image.load("assets/images/matrix.png")
-vfx_harddrop = pygame.image.load("assets/images/vfx-hardDrop.png")
-vfx_sparkle = pygame.image.load("assets/images/vfx-sparkle.png")
-vfx_minolocked = pygame.image.load("assets/images/vfx-minoLocked-01.png")
-
-# pre-bake sprite frames for the line clear animation
-minolock_frames = []
-scale = 1.0
-for i in range(26):
-	if i <= 5:
-		scale += 0.05
-	else:
-		scale -= 0.05
-	frame = pygame.transform.rotozoom(vfx_minolocked, i*5, scale)
-	frame.set_alpha(200 * (1 - i/26))
-	minolock_frames.append(frame)
-
-class Particle(ABC):
-	@abstractmethod
-	def update(self):
-		"""
-		Returns True if the particle is still alive, False if its dead
-		"""
-		pass
+def sound_bytes(sound):
+	frequency, format, channels = pygame.mixer.get_init()
+	return round(sound.get_length() * frequency) * channels * abs(format) // 8
 
-	@abstractmethod
-	def render(self, surface):
-		pass
+def load_sound(path):
+	"""
+		a Sound, decoded (and resampled to the mixer's format) by pygame, or
+		straight out of the asset cache
+	"""
+	return bakecache.cached(
+		"sound-" + os.path.splitext(os.path.basename(path))[0],
+		bakecache.key([path], pygame.mixer.get_init()),
+		lambda: pygame.mixer.Sound(path),
+		lambda sound: [({}, sound.get_raw())],
+		lambda entries: pygame.mixer.Sound(buffer=entries[0][1]),
+	)
+
+# (none of these are needed for the first frame, so each one's loaded when it's first played, and main() prefetches the rest after the first frame)
+sfx = Sounds({
+	"move":      "assets/sound/move.wav",
+	"rotate":    "assets/sound/rotate.wav",
+	"hardDrop":  "assets/sound/hardDrop.wav",
+	"tetris":    "assets/sound/tetris.wav",
+	"lineClear": "assets/sound/lineClear.wav",
+	"collapse":  "assets/sound/collapse.wav",
+	"blockout":  "assets/sound/blockout.wav",
+	"levelUp":   "assets/sound/levelUp.wav",
+	"lock":      "assets/sound/lock.wav",
+	"hold":      "assets/sound/hold.wav",
+}, load_sound, init=init_mixer, nbytes=sound_bytes, report=report)
+
+# everything plays through this, see sound.py
+sounds = SoundManager(NullBackend() if args.no_audio else PygameBackend(sfx, args.voices), args.voices)
+
+def music():
+	"""
+		pygame.mixer.music, once the mixer's open (which is also when the
+		music's loaded)
+	"""
+	if args.no_audio:
+		return NullMusic()
+	sfx.ready()
+	return pygame.mixer.music
+
+def scaled(n):
+	"""
+		a 1280x720 layout coordinate, in screen pixels
+	"""
+	return round(n * render_scale)
+
+def prescale(image):
+	"""
+		scale a sprite up to render_scale (scale2x where possible, since
+		that's what the whole frame used to get every frame)
+	"""
+	factor = render_scale
+	while factor >= 2 and factor % 2 == 0:
+		image = pygame.transform.scale2x(image)
+		factor //= 2
+	if factor != 1:
+		image = pygame.transform.smoothscale(image, (round(image.get_width() * factor), round(image.get_height() * factor)))
+	return image
+
+def faded(sprite, alpha):
+	"""
+		a copy of sprite with its opacity baked into the per-pixel alpha
+	"""
+	sprite = sprite.copy()
+	sprite.fill((255, 255, 255, alpha), special_flags=pygame.BLEND_RGBA_MULT)
+	return sprite
+
+# the active piece's lock delay fade, pre-rendered at FADE_LEVELS opacities
+FADE_LEVELS = 32
+
+def fade_ladder(sprite):
+	# (without the last one, which is the fully opaque sprite itself, so the shared sprites never get set_alpha()'d)
+	return [faded(sprite, round(255 * i / (FADE_LEVELS - 1))) for i in range(FADE_LEVELS - 1)]
+
+def minolock_frame(angle, zoom, alpha):
+	frame = pygame.transform.rotozoom(vfx_minolocked, angle, zoom)
+	frame.set_alpha(alpha)
+	return frame
+
+def streak_sprite(height):
+	return pygame.transform.smoothscale(vfx_harddrop, (cell_size, cell_size*height))
+
+def sparkle_sprite(size):
+	return pygame.transform.smoothscale(vfx_sparkle, (size, size))
+
+def surface_bytes(surfaces):
+	if isinstance(surfaces, pygame.Surface):
+		surfaces = [surfaces]
+	return sum(surface.get_bytesize() * surface.get_width() * surface.get_height() for surface in surfaces)
+
+def pack_surfaces(surfaces):
+	return [({"size": surface.get_size(), "alpha": surface.get_alpha()}, pygame.image.tobytes(surface, "BGRA")) for surface in surfaces]
+
+def unpack_surfaces(entries):
+	surfaces = []
+	for meta, pixels in entries:
+		surface = pygame.image.frombuffer(pixels, meta["size"], "BGRA")  # (the pixels stay in the mapped file, rather than being copied)
+		if meta["alpha"] is not None:
+			surface.set_alpha(meta["alpha"])
+		surfaces.append(surface)
+	return surfaces
+
+def baked_surfaces(name, sources, params, bake):
+	"""
+		bake(), a list of Surfaces, or the same list out of the asset cache
+		(see bakecache.py). sources and params are everything that went
+		into them, apart from the render scale and pixel format
+	"""
+	key = bakecache.key(sources, (params, render_scale, screen.get_masks(), pygame.version.ver))
+	return bakecache.cached(name, key, bake, pack_surfaces, unpack_surfaces)
+
+# translucent black, for dimming the game behind overlay messages
+dim_layer = pygame.Surface(size).convert()
+dim_layer.fill(BLACK)
+dim_layer.set_alpha(128)
+
+loading_font = pygame.font.Font(None, scaled(48))  # (pygame's built-in font, which is quick to load)
+loading_width = loading_font.size("Loading...")[0]
+
+def draw_loading_screen(loader):
+	pygame.event.pump()  # (so the window doesn't look hung, a QUIT stays queued up for main())
+	screen.fill(BLACK)
+	text = loading_font.render("Loading" + "." * int(time.perf_counter() * 3 % 4), True, WHITE)
+	screen.blit(text, ((width - loading_width) // 2, (height - text.get_height()) // 2))
+	pygame.display.flip()
+	report.mark("loading screen")
+
+def load_fonts():
+	# (one after another, since FreeType doesn't like faces being opened on several threads at once)
+	return (
+		report.timed("font", pygame.font.Font, "./assets/fonts/CenturyGothic.ttf", round(20 * render_scale)),
+		report.timed("smallfont", pygame.font.Font, "./assets/fonts/CenturyGothic.ttf", round(12 * render_scale)),
+		report.timed("mediumfont", pygame.font.SysFont, "Ubuntu", round(48 * render_scale)),
+		report.timed("hugefont", pygame.font.SysFont, "Ubuntu", round(128 * render_scale)),
+	)
+
+assets = None  # (and everything below, until load())
+
+def load():
+	"""
+		loads all the fonts and images, and bakes everything derived from
+		them, with the decoding and scaling spread over a pool of threads
+		while the main thread shows a loading screen. only does anything
+		the first time it's called
+	"""
+	global assets, font, smallfont, mediumfont, hugefont, imgs, vfx_harddrop, vfx_sparkle, vfx_minolocked
+	global fade_ladders, background_layer, minolock_frames
+	if assets is not None:
+		return
+
+	loader = Loader(idle=draw_loading_screen)
+	draw_loading_screen(loader)
+	fonts = loader.submit(load_fonts)
+
+	loaded = PygameAssets(mino_transform=prescale, map=loader.map, report=report)
+	imgs = loaded.minos
+	vfx_harddrop = loaded.images["vfx_harddrop"]  # (these get scaled when they're used)
+	vfx_sparkle = loaded.images["vfx_sparkle"]
+	vfx_minolocked = loaded.images["vfx_minolocked"]
+
+	bgimg, matriximg = report.timed("background (scaled)", loader.map, prescale, (loaded.images["background"], loaded.images["matrix"]), nbytes=surface_bytes)
+
+	# (the things that take a while to bake come out of the asset cache, when they can)
+	shapes = list(imgs["normal"])
+	faded_sprites = report.timed("fade ladders", baked_surfaces,
+		"fade-ladders", [mino_path("normal", shape) for shape in shapes], FADE_LEVELS,
+		lambda: [sprite for ladder in loader.map(fade_ladder, imgs["normal"].values()) for sprite in ladder],
+		nbytes=surface_bytes
+	)
+	fade_ladders = {
+		shape: faded_sprites[i * (FADE_LEVELS - 1):(i + 1) * (FADE_LEVELS - 1)] + [imgs["normal"][shape]]
+		for i, shape in enumerate(shapes)
+	}
+
+	# sprite frames for the line clear animation
+	frames = []
+	scale = 1.0
+	for i in range(26):
+		if i <= 5:
+			scale += 0.05
+		else:
+			scale -= 0.05
+		frames.append((i*5, scale * render_scale, 200 * (1 - i/26)))
+	minolock_frames = report.timed("minolock frames", baked_surfaces,
+		"minolock-frames", [IMAGES["vfx_minolocked"]], frames,
+		lambda: loader.map(minolock_frame, *zip(*frames)),
+		nbytes=surface_bytes
+	)
+
+	# every size of particle sprite a hard drop can make (see Game.on_hard_drop())
+	streak_heights = range(1, gridheight + 1)
+	sparkle_sizes = range(int(3 * render_scale), int(7 * render_scale) + 1)
+	sprites = report.timed("particle sprites", baked_surfaces,
+		"particle-sprites", [IMAGES["vfx_harddrop"], IMAGES["vfx_sparkle"]], (cell_size, streak_heights, sparkle_sizes),
+		lambda: loader.map(streak_sprite, streak_heights) + loader.map(sparkle_sprite, sparkle_sizes),
+		nbytes=surface_bytes
+	)
+	particle_sprites.streaks.update(zip(streak_heights, sprites))
+	particle_sprites.sparkles.update(zip(sparkle_sizes, sprites[len(streak_heights):]))
+
+	# static layer: everything that never changes, composed once so it's a single opaque blit per frame
+	start = time.perf_counter()
+	background_layer = pygame.Surface(size).convert()
+	background_layer.fill(BLACK)
+	background_layer.blit(bgimg, (scaled(240), scaled(61)))
+	background_layer.blit(matriximg, (scaled(240+264), scaled(61+32)))
+	report.add("background layer", time.perf_counter() - start, surface_bytes(background_layer))
+
+	font, smallfont, mediumfont, hugefont = loader.wait([fonts])[0]
+	loader.shutdown()
+	assets = loaded
+	report.mark("loaded")
+
+class CachedText:
+	"""
+		a line of text that only gets re-rasterized when it changes
+	"""
+	def __init__(self, font, colour=WHITE):
+		self.font = font
+		self.colour = colour
+		self.text = None
+		self.surface = None
+
+	def render(self, text):
+		if text != self.text:
+			self.text = text
+			self.surface = self.font.render(text, True, self.colour)
+		return self.surface
+
+class DisplayList:
+	"""
+		stands in for a Surface, but just remembers what was blitted where
+		(and at what alpha), so frames can be compared and partially redrawn
+	"""
+	def __init__(self):
+		self.items = []  # (key, source, dest, rect, alpha)
 
-class StreakParticle(Particle):
-	def __init__(self, row, col, height):
+	def blit(self, source, dest):
+		if isinstance(dest, pygame.Rect):
+			dest = dest.topleft
+		alpha = source.get_alpha()
+		rect = pygame.Rect(dest, source.get_size()).inflate(2, 2)  # (a bit of slack, because dest can be fractional)
+		self.items.append(((id(source), tuple(dest), alpha), source, dest, rect, alpha))
+		return rect
+
+	def draw(self, surface, clip):
 		"""
-		row is the top row, "height" extends downwards (positive direction)
+			draw everything that overlaps clip onto surface, without touching
+			anything outside it
 		"""
-		self.alpha = 128
-		self.row = row
-		self.col = col
-		self.height = height
-		self.sprite = pygame.transform.smoothscale(vfx_harddrop, (26, 26*height))
-	
-	def update(self):
-		self.alpha -= 5
-		return self.alpha > 0
-	
-	def render(self, surface):
-		self.sprite.set_alpha(self.alpha)
-		surface.blit(self.sprite, (left_margin + self.col * cell_size, top_margin + self.row * cell_size))
-
-
-class SparkleParticle(Particle):
-	def __init__(self, row, col, alpha):
-		self.row = row + random.random()
-		self.col = col + random.random()
-		self.yvel = 0.01 + random.random() * 0.01
-		self.alpha = alpha
-		sparkle_size = 3 + random.random() * 4
-		self.sprite = pygame.transform.smoothscale(vfx_sparkle, (sparkle_size, sparkle_size))
-	
-	def update(self):
-		self.alpha -= 5
-		self.row -= self.yvel
-		return self.alpha > 0
-	
-	def render(self, surface):
-		self.sprite.set_alpha(self.alpha)
-		surface.blit(self.sprite, (
-			int(left_margin + self.col * cell_size),
-			int(top_margin + self.row * cell_size)
-		))
-
-
-class RowClearParticle(Particle):
-	def __init__(self, row, col, anim_progress):
-		self.row = row
-		self.col = col
-		self.anim_progress = anim_progress
-	
-	def update(self):
-		self.anim_progress += 1
-		return self.anim_progress < 26
-	
-	def render(self, surface):
-		#vfx_minolocked.set_alpha((1 - max(0, self.anim_progress)/20) * 255)
-		sprite = minolock_frames[max(0, int(self.anim_progress))]
-		#sprite.set_alpha(80)
-		#assert(type(sprite) is pygame.Surface)
-		w, h = sprite.get_size()
-		surface.blit(sprite, (
-			left_margin + (self.col + 0.5 ) * cell_size - w / 2,
-			top_margin + (self.row + 0.5) * cell_size - h / 2
-		))
+		surface.set_clip(clip)
+		for _, source, dest, rect, alpha in self.items:
+			if not rect.colliderect(clip):
+				continue
+			old_alpha = source.get_alpha()
+			if alpha != old_alpha:
+				source.set_alpha(alpha)
+				surface.blit(source, dest)
+				source.set_alpha(old_alpha)
+			else:
+				surface.blit(source, dest)
+		surface.set_clip(None)
 
-class GameState(Enum):
+def merge_rects(rects):
 	"""
-		all possible gameplay states
+		union together rects that overlap (or nearly touch), so each area only
+		gets redrawn once
 	"""
-	PLAYING = auto()
-	PAUSED = auto()
-	ANIMATING = auto()  # game logic paused for rendering line-clear animation
-	GAMEOVER = auto()
+	merged = []
+	for rect in rects:
+		rect = rect.copy()
+		while True:
+			i = rect.inflate(4, 4).collidelist(merged)
+			if i < 0:
+				break
+			rect.union_ip(merged.pop(i))
+		merged.append(rect)
+	return merged
 
-class Game:
+class DirtyRectPresenter:
 	"""
-		Contains the entire game state, gameplay logic, and rendering logic
+		Gets frames onto the screen by only redrawing the parts that changed
+
+		Each frame is rendered into a DisplayList, and compared with the
+		previous one: anything that appeared, vanished, moved or changed
+		alpha marks its rect dirty. Only the dirty rects get redrawn and
+		passed to pygame.display.update(). If most of the screen changed,
+		it's cheaper to just redraw and flip() the lot.
 	"""
+	FULL_REDRAW_FRACTION = 0.5
 
 	def __init__(self):
-		self.random_bag = []
-		self.gamestate = GameState.PLAYING
-		self.gridstate = [[" "]*gridwidth for _ in range(gridheight)]
-		self.shape_queue = [self.random_shape() for _ in range(3)]
-		self.score = 0
-		self.level = 1
-		self.line_count = 0
-		self.gameticks = 0
-		self.time_til_drop = self.time_per_drop()
-		self.line_clear_animation_ticks_remaining = 0
-		self.rows_to_collapse = []
-		self.prev_back2back = False
-		self.heldticks = {
-			"left": 0,
-			"right": 0,
-			"down": 0
-		}
-		self.hold = None
-		self.can_swap = True
-
-		self.active_shape = None
-		self.active_x = None
-		self.active_y = None
-		self.active_rot = None
-		self.particles = []
-		self.spawn_shape()
-
-		#pygame.mixer.music.play(-1, 0.0)
-	
-	def random_shape(self):
-		if not self.random_bag:
-			self.random_bag = list(SHAPES.keys())
-			random.shuffle(self.random_bag)
-		return self.random_bag.pop()
-
-	def spawn_shape(self, respawn=False):
-		if not respawn:
-			self.active_shape = self.shape_queue.pop(0)
-			self.shape_queue.append(self.random_shape())
-		self.active_x = 3
-		self.active_y = 2
-		self.active_rot = 0
-
-		if self.does_collide():
-			self.gamestate = GameState.GAMEOVER
-			sfx["blockout"].play()
-			pygame.mixer.music.stop()
-
-	def try_rotate(self, direction):
-		new_rot = (self.active_rot + direction) % 4
-		wallkicks = WALLKICKS[self.active_shape][(self.active_rot, new_rot)]
-
-		for dx, dy in wallkicks:
-			new_x = self.active_x + dx
-			new_y = self.active_y - dy  # positive Y is upwards, in wallkick data (because that's what the tetris wiki uses)
-			if not self.does_collide(new_x, new_y, new_rot):
-				self.active_rot = new_rot
-				self.active_x = new_x
-				self.active_y = new_y
-				sfx["rotate"].play()
-				if self.is_resting(): #XXX should this be if it *was* resting?
-					self.time_til_drop = self.time_per_drop()
-				return True
-		
-		return False
-	
-	def try_movex(self, direction):
-		self.active_x += direction
-		if self.does_collide():
-			# revert
-			self.active_x -= direction
-			return False
-		else:
-			sfx["move"].play()
-			if self.is_resting():
-				self.time_til_drop = self.time_per_drop()
-			return True
-	
-	def try_movey(self, direction):
-		self.active_y += direction
-		if self.does_collide():
-			# revert
-			self.active_y -= direction
-			return False
-		else:
-			return True
-
-	def stamp_piece(self):
-		shape_sprite = SHAPES[self.active_shape][self.active_rot]
-		for y, row in enumerate(shape_sprite):
-			for x, val in enumerate(row):
-				posy = self.active_y + y
-				posx = self.active_x + x
-				if val != " ":
-					self.gridstate[posy][posx] = val
-
-	def is_resting(self):
-		return self.does_collide(testy=self.active_y+1)
-
-	def does_collide(self, testx=None, testy=None, testrot=None):
-		if testx is None:
-			testx = self.active_x
-		if testy is None:
-			testy = self.active_y
-		if testrot is None:
-			testrot = self.active_rot
-
-		shape_sprite = SHAPES[self.active_shape][testrot]
-		for y, row in enumerate(shape_sprite):
-			for x, val in enumerate(row):
-				posy = testy + y
-				posx = testx + x
-				if posy >= gridheight:
-					if val != " ":
-						return True  # we hit the floor
-					continue  # an empty cell within the bounding box is through the floor, ignore
-				if posx < 0 or posx >= gridwidth:
-					if val != " ":
-						return True  # we hit a wall
-					continue  # an empty cell within bounding box is outside the walls, ignore
-				if posy < 0:
-					continue  # I don't think this should ever happen, but if we're above the ceiling, ignore
-				
-				# if we reached here, (posx, posy) is definitely inside the grid
-				if val != " " and self.gridstate[posy][posx] != " ":
-					return True  # collision with a block already on the grid
-		
-		# if we made it this far, there were no collisions
-		return False
-	
-	def do_collapse_rows(self):
-		for y in range(gridheight):  # scan the grid from top to bottom
-			if y in self.rows_to_collapse:
-				self.gridstate = [[" "] * gridwidth] + self.gridstate[:y] + self.gridstate[y+1:]
-		self.rows_to_collapse = []
-
-	def check_lines(self):
-		self.rows_to_collapse = []
-		for y in range(gridheight):  # scan the grid from top to bottom
-			if self.gridstate[y].count(" ") == 0:
-				self.gridstate[y] = [" "] * gridwidth
-				for x in range(gridwidth):
-					self.particles.append(RowClearParticle(
-						y - topzone, x, -x
-					))
-				self.rows_to_collapse.append(y)
-		
-		if not self.rows_to_collapse:
-			return False
-		
-		linecount = len(self.rows_to_collapse)
-		back2back_bonus = 1.0
-		if linecount == 4:
-			if self.prev_back2back:
-				back2back_bonus = 1.5
-			sfx["tetris"].play()
-			self.prev_back2back = True
-		else:
-			sfx["lineClear"].play()
-			self.prev_back2back = False
-		sfx["collapse"].play()
-		
-		self.score += int(self.level * [0, 100, 300, 500, 800][linecount] * back2back_bonus)
-		new_line_total = self.line_count + linecount
-		if self.line_count // 10 != new_line_total // 10: # if we crossed a new multiple of 10 boundary
-			self.level += 1
-			sfx["levelUp"].play()
-		self.line_count = new_line_total
+		self.prev_items = None
 
-		self.line_clear_animation_ticks_remaining = CLEAR_ANIMATION_DELAY + CLEAR_ANIMATION_DURATION
+	def present(self, display_list):
+		items = {}
+		for key, _, _, rect, _ in display_list.items:
+			items[key] = rect
 
-		return True
-		
-	def pause(self):
-		self.gamestate = GameState.PAUSED
-		pygame.mixer.music.pause()
-	
-	def unpause(self):
-		self.gamestate = GameState.PLAYING
-		pygame.mixer.music.unpause()
+		bounds = screen.get_rect()
+		if self.prev_items is None:
+			dirty = [bounds]
+		else:
+			dirty = [rect for key, rect in items.items() if key not in self.prev_items]
+			dirty += [rect for key, rect in self.prev_items.items() if key not in items]
+		self.prev_items = items
 
-	def update(self, events):
-		if self.gamestate == GameState.PLAYING:
-			self.update_gameloop(events)
-		elif self.gamestate == GameState.PAUSED:
-			for event in events:
-				if event.type == pygame.KEYDOWN and event.key == pygame.K_p:
-					self.unpause()
-		elif self.gamestate == GameState.GAMEOVER:
-			for event in events:
-				if event.type == pygame.KEYDOWN and event.key == pygame.K_RETURN:
-					self.__init__()
-	
-	def update_gameloop(self, events):
-		# update particles (keep only those that are still alive!)
-		self.particles = list(filter(lambda p: p.update(), self.particles))
-
-		if self.line_clear_animation_ticks_remaining > 0:
-			self.line_clear_animation_ticks_remaining -= 1
-			if self.line_clear_animation_ticks_remaining == 0:
-				self.do_collapse_rows()
-				self.spawn_shape()
+		dirty = merge_rects([rect.clip(bounds) for rect in dirty if rect.colliderect(bounds)])
+		if not dirty:
 			return
 
-		self.gameticks += 1
-
-		for event in events:
-			if event.type == pygame.KEYDOWN:
-				if event.key in [pygame.K_UP, pygame.K_x]:
-					self.try_rotate(1)
-				#if event.key == pygame.K_DOWN:
-				#    if self.try_movey(1):
-				#        self.score += 1
-				#if event.key == pygame.K_LEFT:
-				#    self.try_movex(-1)
-				#if event.key == pygame.K_RIGHT:
-				#    self.try_movex(1)
-				if event.key == pygame.K_z:
-					self.try_rotate(-1)
-				if event.key == pygame.K_c:
-					self.swap_hold()
-				if event.key == pygame.K_SPACE:
-					drop_top = self.active_y
-
-					while self.try_movey(1):
-						self.score += 2
-					
-					drop_height = self.active_y - drop_top
-					visited_cols = set()
-					shape_sprite = SHAPES[self.active_shape][self.active_rot]
-					for y, row in list(enumerate(shape_sprite))[::-1]:
-						for x, val in enumerate(row):
-							if val != " ":
-								if x in visited_cols:
-									continue
-								visited_cols.add(x)
-
-								self.particles.append(StreakParticle(
-									drop_top + y - topzone,
-									self.active_x + x,
-									drop_height
-								))
-
-								for sparkle_y in range(drop_height):
-									if random.random() > 0.5:
-										continue
-									self.particles.append(SparkleParticle(
-										drop_top + y - topzone + sparkle_y,
-										self.active_x + x,
-										(sparkle_y/drop_height) * 200
-									))
-					sfx["hardDrop"].play()
-					self.time_til_drop = self.time_per_drop()
-					self.lockdown()
-				
-				if event.key == pygame.K_p:
-					self.pause()
-		
-		# keep track of how long these keys have been held
-		keys = pygame.key.get_pressed()
-		if keys[pygame.K_DOWN]:
-			self.heldticks["down"] += 1
-		else:
-			self.heldticks["down"] = 0
-		if keys[pygame.K_LEFT]:
-			self.heldticks["left"] += 1
-		else:
-			self.heldticks["left"] = 0
-		if keys[pygame.K_RIGHT]:
-			self.heldticks["right"] += 1
-		else:
-			self.heldticks["right"] = 0
-		
-		if self.heldticks["down"] == 1: # sfx on first press
-			sfx["move"].play()
-		if self.heldticks["down"] % 2 == 1: # 30Hz softdrop
-			if self.try_movey(1):
-				self.time_til_drop = self.time_per_drop()
-				self.score += 1
-		
-		if self.heldticks["left"] == 1 or (self.heldticks["left"] > 10 and self.heldticks["left"] % 2 == 1):  # 30Hz ARR, 10 frame DAS
-			self.try_movex(-1)
-		
-		if self.heldticks["right"] == 1 or (self.heldticks["right"] > 10 and self.heldticks["right"] % 2 == 1):  # 30Hz ARR, 10 frame DAS
-			self.try_movex(1)
-		
-		self.time_til_drop -= 1/60
-		if self.time_til_drop < 0:
-			self.apply_gravity()
-			self.time_til_drop += self.time_per_drop()
-	
-	def time_per_drop(self):
-		return (0.8 - ((self.level - 1) * 0.007)) ** (self.level - 1)
-
-	def swap_hold(self):
-		if not self.can_swap:
+		if sum(rect.w * rect.h for rect in dirty) > bounds.w * bounds.h * self.FULL_REDRAW_FRACTION:
+			display_list.draw(screen, bounds)
+			pygame.display.flip()
 			return
-		sfx["hold"].play()
 
-		if self.hold is None:
-			self.hold = self.active_shape
-			self.spawn_shape()
+		for rect in dirty:
+			display_list.draw(screen, rect)
+		pygame.display.update(dirty)
+
+class BlitCounter:
+	"""
+		stands in for a Surface (or DisplayList), counting blits for a Tracer
+	"""
+	def __init__(self, surface, tracer):
+		self.surface = surface
+		self.tracer = tracer
+
+	def blit(self, source, dest):
+		self.tracer.count("blit")
+		return self.surface.blit(source, dest)
+
+# ======== PARTICLES ========
+# (particles.ParticlePool does the simulation, this is just how they look)
+
+class ParticleSprites:
+	"""
+		scaled copies of the particle sprites, reused rather than
+		smoothscaling a fresh one for every particle. streaks are cached by
+		drop height in cells, and sparkles by size in whole pixels, which is
+		what smoothscale rounds them down to anyway. load() bakes all the
+		sizes a hard drop can make, anything else gets made the first time
+		it's needed
+	"""
+	def __init__(self):
+		self.streaks = {}
+		self.sparkles = {}
+
+	def streak(self, height):
+		sprite = self.streaks.get(height)
+		if sprite is None:
+			sprite = self.streaks[height] = streak_sprite(height)
+		return sprite
+
+	def sparkle(self, size):
+		sprite = self.sparkles.get(size)
+		if sprite is None:
+			sprite = self.sparkles[size] = sparkle_sprite(size)
+		return sprite
+
+particle_sprites = ParticleSprites()
+
+KEYMAP = {
+	pygame.K_UP: Action.ROTATE_CW,
+	pygame.K_x: Action.ROTATE_CW,
+	pygame.K_z: Action.ROTATE_CCW,
+	pygame.K_c: Action.HOLD,
+	pygame.K_SPACE: Action.HARD_DROP,
+	pygame.K_p: Action.PAUSE,
+	pygame.K_RETURN: Action.RESTART,
+}
+
+HELD_KEYMAP = {
+	"left": pygame.K_LEFT,
+	"right": pygame.K_RIGHT,
+	"down": pygame.K_DOWN,
+}
+
+class Game(engine.Game):
+	"""
+		pygame front-end: input mapping, sounds, particles, and rendering logic
+		(the game rules themselves live in engine.Game)
+	"""
+
+	max_particles = args.max_particles
+	profiler = NullProfiler()  # main() swaps in a FrameProfiler
+
+	def __init__(self, *args, **kwargs):
+		load()
+		self.fx_rng = random.Random()  # cosmetic only, so VFX never affect the piece sequence
+		self.particles = ParticlePool(self.max_particles)
+		self.tick_fraction = 1.0  # how far into the next tick this frame is, see engine.FixedTimestep
+		self.score_text = CachedText(font)
+		self.level_text = CachedText(font)
+		self.line_count_text = CachedText(font)
+		self.title_text = CachedText(hugefont)
+		self.subtitle_text = CachedText(mediumfont)
+		super().__init__(*args, **kwargs)
+
+	def reset(self):
+		self.particles.clear()
+		super().reset()
+
+		#pygame.mixer.music.play(-1, 0.0)
+
+	def pause(self):
+		super().pause()
+		music().pause()
+
+	def unpause(self):
+		super().unpause()
+		music().unpause()
+
+	def update(self, events, replayed=None, actions=()):
+		"""
+			replayed is a recorded (pressed, held) tick to use instead of the keyboard,
+			actions are Actions to press before the keys (e.g. pausing when the window loses focus)
+		"""
+		if replayed is not None:
+			super().update(*replayed)
 		else:
-			self.active_shape, self.hold = self.hold, self.active_shape
-			self.spawn_shape(respawn=True)
-		
-		self.can_swap = False # this gets reset on next lockdown
-	
-	def lockdown(self):
-		self.stamp_piece()
-		if not self.check_lines():
-			self.spawn_shape()
-		self.can_swap = True
-		sfx["lock"].play()
-	
-	def apply_gravity(self):
-		if not self.try_movey(1):
-			#print(self.last_rotate_tick, self.last_drop_time * 60)
-			#if self.last_rotate_tick + 60 < self.last_drop_time * 60:
-			self.lockdown()
+			pressed = list(actions) + [
+				KEYMAP[event.key] for event in events
+				if event.type == pygame.KEYDOWN and event.key in KEYMAP
+			]
+			keys = pygame.key.get_pressed()
+			held = [name for name, k in HELD_KEYMAP.items() if keys[k]]
+			super().update(pressed, held)
+		sounds.end_tick()
+
+	def update_gameloop(self, pressed, held):
+		# update particles (the dead ones get dropped)
+		self.profiler.lap("update")
+		self.particles.update()
+		self.profiler.lap("particles")
+		super().update_gameloop(pressed, held)
+
+	def play_sfx(self, name):
+		sounds.play(name)
+
+	def on_gameover(self):
+		music().stop()
+
+	def on_rows_cleared(self, rows):
+		for y in rows:
+			for x in range(self.width):
+				# the animation starts x ticks late, so it sweeps across the row
+				self.particles.spawn(ROW_CLEAR, y - self.topzone, x, progress=-x, lifetime=26)
+
+	def on_hard_drop(self, drop_top, drop_height):
+		for x, y in self.active_piece().col_bottoms:
+			# the streak's top row, extending drop_height rows downwards
+			self.particles.spawn(STREAK, drop_top + y - self.topzone, self.active_x + x, alpha=128, fade=5, size=drop_height)
+
+			rng = self.fx_rng
+			for sparkle_y in range(drop_height):
+				if rng.random() > 0.5:
+					continue
+				row = drop_top + y - self.topzone + sparkle_y + rng.random()
+				col = self.active_x + x + rng.random()
+				yvel = 0.01 + rng.random() * 0.01
+				size = int((3 + rng.random() * 4) * render_scale)
+				self.particles.spawn(SPARKLE, row, col, alpha=(sparkle_y/drop_height) * 200, fade=5, yvel=yvel, size=size)
 
 
 	# ======== RENDERING LOGIC ========
@@ -523,107 +568,125 @@ class Game:
 			self.render_message_overlay(surface, "PAUSED", "Press P to resume")
 		elif self.gamestate == GameState.GAMEOVER:
 			self.render_message_overlay(surface, "GAME OVER", f"Score: {self.score:,}")
+		self.profiler.lap("overlay")
 
 	def render_message_overlay(self, surface, text_string, subtitle=""):
-		overlay = pygame.Surface(size)
-		overlay.set_alpha(128)
-		overlay.fill(BLACK)
-		surface.blit(overlay, (0, 0))
+		surface.blit(dim_layer, (0, 0))
 		
 		# render centered text
-		text = hugefont.render(text_string, True, WHITE)
+		text = self.title_text.render(text_string)
 		text_rect = text.get_rect(center=(width//2, height//3))
 		surface.blit(text, text_rect)
 
-		text = mediumfont.render(subtitle, True, WHITE)
+		text = self.subtitle_text.render(subtitle)
 		text_rect = text.get_rect(center=(width//2, height//2))
 		surface.blit(text, text_rect)
 
+	def render_particles(self, surface):
+		fields = self.particles.live("kind", "row", "col", "alpha", "progress", "size")
+		for kind, row, col, alpha, progress, size in zip(*fields):
+			if kind == STREAK:
+				sprite = particle_sprites.streak(int(size))
+				sprite.set_alpha(alpha)
+				surface.blit(sprite, (left_margin + int(col) * cell_size, top_margin + int(row) * cell_size))
+			elif kind == SPARKLE:
+				sprite = particle_sprites.sparkle(int(size))
+				sprite.set_alpha(alpha)
+				surface.blit(sprite, (
+					int(left_margin + col * cell_size),
+					int(top_margin + row * cell_size)
+				))
+			else:
+				sprite = minolock_frames[max(0, int(progress))]
+				w, h = sprite.get_size()
+				surface.blit(sprite, (
+					left_margin + (col + 0.5) * cell_size - w / 2,
+					top_margin + (row + 0.5) * cell_size - h / 2
+				))
+
 	def render_gameplay(self, surface):
-		surface.blit(bgimg, (240, 61))
-		surface.blit(matriximg, (240+264, 61+32))
+		"""
+			draws the whole frame, layer by layer: the static background, then
+			the dynamic stuff (particles, board, pieces), then the HUD
+		"""
+		profiler = self.profiler
+		surface.blit(background_layer, (0, 0))
+		profiler.lap("background")
 
 		# draw particles (under everything else)
-		for particle in self.particles:
-			particle.render(surface)
+		self.render_particles(surface)
+		profiler.lap("particles_draw")
 
 		# draw main grid state
 		if self.rows_to_collapse and 0 < self.line_clear_animation_ticks_remaining < CLEAR_ANIMATION_DURATION:
-			slide_thresh = min(self.rows_to_collapse) - topzone
+			slide_thresh = min(self.rows_to_collapse) - self.topzone
 			slide = 1 + max(self.rows_to_collapse) - min(self.rows_to_collapse)
 			slide *= 1 - (self.line_clear_animation_ticks_remaining / CLEAR_ANIMATION_DURATION)
 		else:
 			slide = 0
 			slide_thresh = 0
-		for y in range(gridheight - topzone):
-			for x in range(gridwidth):
-				cell = self.gridstate[y+topzone][x]
+		for y in range(self.height - self.topzone):
+			for x in range(self.width):
+				cell = self.board.cell(x, y+self.topzone)
 				if cell != " ":
 					surface.blit(imgs["locked"][cell], (left_margin + x * cell_size, top_margin + (y + (slide if y < slide_thresh else 0)) * cell_size))
+		profiler.lap("grid")
 
-		# find ghost position
-		for ghosty in range(self.active_y, gridheight):
-			if self.does_collide(testy=(ghosty + 1)):
-				break
-		
 		# draw ghost
 		if not self.line_clear_animation_ticks_remaining:
-			shape_sprite = SHAPES[self.active_shape][self.active_rot]
-			for y, row in enumerate(shape_sprite):
-				posy = ghosty + y - topzone
+			ghosty = self.ghost_y()
+			piece = self.active_piece()
+			for x, y in piece.cells:
+				posy = ghosty + y - self.topzone
 				if posy < 0:
 					continue
-				for x, val in enumerate(row):
-					if val != " ":
-						posx = self.active_x+x
-						surface.blit(imgs["ghost"][val], (left_margin + posx * cell_size, top_margin + posy * cell_size))
+				posx = self.active_x+x
+				surface.blit(imgs["ghost"][piece.shape], (left_margin + posx * cell_size, top_margin + posy * cell_size))
+		profiler.lap("ghost")
 
 		# draw active shape
 		if not self.line_clear_animation_ticks_remaining:
 			if self.is_resting():
-				alpha = int((self.time_til_drop / self.time_per_drop()) * 255)
+				fade = round((self.time_til_drop / self.time_per_drop()) * (FADE_LEVELS - 1))
+				fade = max(0, min(fade, FADE_LEVELS - 1))
 			else:
-				alpha = 255
-			shape_sprite = SHAPES[self.active_shape][self.active_rot]
-			for y, row in enumerate(shape_sprite):
-				posy = self.active_y + y - topzone
-				if posy < 0:
+				fade = FADE_LEVELS - 1
+			piece = self.active_piece()
+			sprite = fade_ladders[piece.shape][fade]
+			drawx, drawy = self.active_position(self.tick_fraction)
+			for x, y in piece.cells:
+				if self.active_y + y - self.topzone < 0:
 					continue
-				for x, val in enumerate(row):
-					if val != " ":
-						posx = self.active_x + x
-						imgs["normal"][val].set_alpha(alpha)
-						surface.blit(imgs["normal"][val], (left_margin + posx * cell_size, top_margin + posy * cell_size))
-						imgs["normal"][val].set_alpha(255)
+				surface.blit(sprite, (
+					round(left_margin + (drawx + x) * cell_size),
+					round(top_margin + (drawy + y - self.topzone) * cell_size)
+				))
+		profiler.lap("piece")
 
 		# draw preview of next shape
 		for i, shape in enumerate(self.shape_queue):
-			shape_sprite = SHAPES[shape][0]
 			shift = CENTRE_SHIFT[shape]
-			for y, row in enumerate(shape_sprite):
-				for x, val in enumerate(row):
-					if val != " ":
-						surface.blit(imgs["normal"][val], (left_margin + (x + gridwidth + 3 + shift) * cell_size, top_margin - 4 + (y + 3 + i * 2.5) * cell_size))
+			for x, y in self.pieces[shape][0].cells:
+				surface.blit(imgs["normal"][shape], (left_margin + (x + self.width + 3 + shift) * cell_size, top_margin - scaled(4) + (y + 3 + i * 2.5) * cell_size))
 
 		# draw hold
 		if self.hold:
-			shape_sprite = SHAPES[self.hold][0]
 			shift = CENTRE_SHIFT[self.hold]
-			for y, row in enumerate(shape_sprite):
-				for x, val in enumerate(row):
-					if val != " ":
-						surface.blit(imgs["normal"][val], (left_margin + 4 + (x - 7 + shift) * cell_size, top_margin - 4 + (y + 3) * cell_size))
+			for x, y in self.pieces[self.hold][0].cells:
+				surface.blit(imgs["normal"][self.hold], (left_margin + scaled(4) + (x - 7 + shift) * cell_size, top_margin - scaled(4) + (y + 3) * cell_size))
+		profiler.lap("preview")
 
 
 		# score
-		rendered_score = font.render(f"{self.score:,}", True, WHITE)
-		surface.blit(rendered_score, (384-rendered_score.get_width()//2, 440))
+		rendered_score = self.score_text.render(f"{self.score:,}")
+		surface.blit(rendered_score, (scaled(384)-rendered_score.get_width()//2, scaled(440)))
 
-		rendered_level = font.render(f"{self.level}", True, WHITE)
-		surface.blit(rendered_level, (384-rendered_level.get_width()//2, 500))
+		rendered_level = self.level_text.render(f"{self.level}")
+		surface.blit(rendered_level, (scaled(384)-rendered_level.get_width()//2, scaled(500)))
 
-		rendered_line_count = font.render(f"{self.line_count}", True, WHITE)
-		surface.blit(rendered_line_count, (384-rendered_line_count.get_width()//2, 560))
+		rendered_line_count = self.line_count_text.render(f"{self.line_count}")
+		surface.blit(rendered_line_count, (scaled(384)-rendered_line_count.get_width()//2, scaled(560)))
+		profiler.lap("hud")
 
 
 		# "particle" effects
@@ -632,43 +695,159 @@ class Game:
 		#surface.blit(scaled_vfx, (600, 400))
 
 
-def main():
+def render_profile(profiler):
 	"""
-		Main loop happens here
+		the F3 overlay: a table of p50/p95/p99 frame time per phase
 	"""
+	rows = [("phase (ms)", "p50", "p95", "p99")]
+	for phase, stats in profiler.summary().items():
+		rows.append((phase, *("{:.2f}".format(stats[p]) for p in ("p50", "p95", "p99"))))
+	name_width = max(smallfont.size(row[0])[0] for row in rows)
+	columns = [scaled(4) + name_width + scaled(50) * (i + 1) for i in range(3)]  # right edges of the number columns
+	line_height = smallfont.get_linesize()
+	surface = pygame.Surface((columns[-1] + scaled(8), len(rows) * line_height + scaled(8)), pygame.SRCALPHA)
+	surface.fill((0, 0, 0, 160))
+	for i, (phase, *numbers) in enumerate(rows):
+		y = scaled(4) + i * line_height
+		surface.blit(smallfont.render(phase, True, WHITE), (scaled(4), y))
+		for right, number in zip(columns, numbers):
+			text = smallfont.render(number, True, WHITE)
+			surface.blit(text, (right - text.get_width(), y))
+	return surface
+
+def refresh_rate():
+	try:
+		rates = pygame.display.get_desktop_refresh_rates()
+	except AttributeError:  # (pygame < 2.5)
+		rates = []
+	return rates[0] if rates and rates[0] > 0 else 60
+
+def main(state=None, inputs=None, dirty_rects=False, fps=None, no_sleep=False, profile=None, trace=None):
+	"""
+		Main loop happens here
 
-	state = Game()
-
-	frametime = 0
-	while True:
-		frame_start = pygame.time.get_ticks()
-
-		events = pygame.event.get()
-
-		for event in events:
-			if event.type == pygame.QUIT:
-				return # exit
-			if event.type == pygame.ACTIVEEVENT and event.state == 1 and event.gain == 0:
-				if state.gamestate != GameState.GAMEOVER:
-					state.pause()
+		inputs is an optional iterator of recorded (pressed, held) ticks to
+		play back (see replay.py), the keyboard takes over when it runs out.
+		dirty_rects turns on DirtyRectPresenter.
 
-		state.update(events)
+		The game runs at engine.TICK_RATE whatever the frame rate is: each
+		frame runs however many ticks are due (maybe none), then draws. fps
+		caps the frame rate (None for the display's refresh rate, 0 for
+		uncapped), and no_sleep instead runs exactly one tick per frame,
+		without ever waiting.
 
-		# render game state
-		render_surface.fill((0, 0, 0))
-		state.render(render_surface)
-		scaled = pygame.transform.scale2x(render_surface)
-		screen.blit(scaled, (0, 0))
+		Every frame is timed phase by phase (see profiler.py), F3 toggles
+		an overlay of the numbers, and they're written to the file profile
+		on exit, if given.
 
-		# show time it took to render the previous frame (we have a 16ms time budget to hit 60fps)
-		screen.blit(font.render(f"{frametime:.2f}ms", True, WHITE), (10, 10))
+		trace is a file to write Chrome trace events to on exit (see
+		tracing.py), the hot paths are only instrumented if it's given.
+	"""
 
-		pygame.display.flip()
+	if state is None:
+		state = Game()
+	presenter = DirtyRectPresenter() if dirty_rects else None
+	if fps is None:
+		fps = refresh_rate()
+	timestep = engine.FixedTimestep()
+	pending = []  # key presses that haven't had a tick to go to yet
+	lost_focus = False  # pause at the next chance, as a press so it gets recorded like one
+	profiler = state.profiler = FrameProfiler()
+	show_profile = False
+	profile_overlay = None
+	tracer = None
+	if trace:
+		tracer = Tracer()
+		tracer.instrument_game(type(state))
 
-		frametime = pygame.time.get_ticks() - frame_start
+	frametime = 0
+	frametime_text = CachedText(font)
+	last_frame = time.perf_counter()
+	try:
+		while True:
+			profiler.start_frame()
 
-		# wait for the next 60Hz interval
-		clock.tick(60)
+			events = pygame.event.get()
+			for event in events:
+				if event.type == pygame.QUIT:
+					return # exit
+				if event.type == pygame.ACTIVEEVENT and event.state == 1 and event.gain == 0:
+					if state.gamestate == GameState.PLAYING and inputs is None:
+						lost_focus = True
+				if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+					show_profile = not show_profile
+			pending.extend(event for event in events if event.type == pygame.KEYDOWN)
+			profiler.lap("events")
+
+			now = time.perf_counter()
+			ticks = 1 if no_sleep else timestep.advance(now - last_frame)
+			last_frame = now
+			for _ in range(ticks):
+				replayed = None
+				if inputs is not None:
+					replayed = next(inputs, None)
+					if replayed is None:
+						inputs = None
+				actions = [Action.PAUSE] if lost_focus and state.gamestate == GameState.PLAYING else []
+				state.update(pending, replayed, actions)
+				pending = []
+				if state.gamestate != GameState.PLAYING:
+					lost_focus = False  # (the line clear animation ignores presses, so it keeps trying until then)
+			state.tick_fraction = 1.0 if no_sleep else timestep.fraction
+			profiler.lap("update")
+
+			# show how long the last frame took, not counting waiting for the next one (we have a 16ms time budget to hit 60fps)
+			rendered_frametime = frametime_text.render(f"{frametime:.2f}ms")
+			if show_profile and (profile_overlay is None or profiler.frames % 30 == 0):  # (twice a second is plenty)
+				profile_overlay = render_profile(profiler)
+			profiler.lap("overlay")
+
+			display_list = DisplayList() if presenter else None
+			target = display_list or screen
+			if tracer:
+				target = BlitCounter(target, tracer)
+			# render game state (the background layer covers the whole surface, so no need to clear it first)
+			state.render(target)
+			target.blit(rendered_frametime, (10, 10))
+			if show_profile:
+				target.blit(profile_overlay, (10, 10 + rendered_frametime.get_height()))
+			profiler.lap("overlay")
+
+			if presenter:
+				presenter.present(display_list)
+			else:
+				pygame.display.flip()
+			profiler.lap("present")
+			if "first frame" not in report.milestones:
+				report.mark("first frame")
+				if args.asset_report:
+					print(report)
+				if not args.no_audio:
+					sfx.prefetch()
+
+			# wait for the next frame (clock.tick(0) doesn't wait)
+			if not no_sleep:
+				clock.tick(fps)
+			profiler.lap("wait")
+
+			profiler.end_frame()
+			frametime = profiler.last_frame("busy") * 1000
+			if tracer:
+				tracer.end_frame(particles=len(state.particles))
+	finally:
+		if profile:
+			profiler.export(profile)
+		if tracer:
+			tracer.export(trace)
+			print(tracer)
 
 if __name__ == "__main__":
-	main()
+	state = Game(seed=random.getrandbits(32) if args.seed is None else args.seed)
+	if args.record:
+		import replay
+		recorder = replay.Recorder(open(args.record, "wb"), state)
+	try:
+		main(state, dirty_rects=args.dirty_rects, fps=args.fps, no_sleep=args.no_sleep, profile=args.profile, trace=args.trace)
+	finally:
+		if args.record:
+			recorder.close()
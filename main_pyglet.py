@@ -7,17 +7,36 @@ if "asahi" in os.uname().release:
 	os.environ["MESA_GLSL_VERSION_OVERRIDE"] = "330"
 	os.environ["MESA_GLES_VERSION_OVERRIDE"] = "3.1"
 
-from enum import Enum, auto
-from abc import ABC, abstractmethod
+import argparse
+import ctypes
 import random
+import time
+import numpy as np
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--trace", metavar="FILE", help="on exit, write Chrome trace events (hot path spans and calls per frame) to FILE, and print the call counts")
+parser.add_argument("--asset-report", action="store_true", help="after the first frame, print how long each asset took to load, how much memory it uses, and the time to the first frame")
+parser.add_argument("--no-audio", action="store_true", help="don't open an audio device or load any sounds")
+args, unknown = parser.parse_known_args()
+if unknown:
+	print(f"WARNING: ignoring unknown arguments: {' '.join(unknown)}")
+
 import pyglet
+if args.no_audio:
+	pyglet.options["audio"] = ("silent",)
+from pyglet import gl
+from pyglet.graphics.shader import Shader, ShaderProgram
 from pyglet.window import key
-#from pyglet import gl
-#gl.glEnable(gl.GL_BLEND)
-#gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
 
-from data import CENTRE_SHIFT, SHAPES, WALLKICKS
+from assets import LoadReport, Loader, PygletAssets, Sounds
+from data import CENTRE_SHIFT
+import engine
+from engine import Action, GameState, gridwidth, gridheight, topzone, CLEAR_ANIMATION_DURATION
+from particles import ParticlePool, STREAK, SPARKLE, ROW_CLEAR
+from sound import NullBackend, PygletBackend, SoundManager
+from tracing import Tracer
 
+report = LoadReport()  # (timing starts here, for --asset-report's time to first frame)
 
 
 size = width, height = 800, 600
@@ -27,47 +46,69 @@ keys = key.KeyStateHandler()
 
 fps_display = pyglet.window.FPSDisplay(window=window)
 
-gridwidth, gridheight = 10, 24
-topzone = 4
 cell_size = 26 #(height * 0.8) // (gridheight - topzone)
 
 top_margin = (height - (cell_size*(gridheight-topzone-2))) // 2
 left_margin = (width - (cell_size*gridwidth)) // 2
 
-CLEAR_ANIMATION_DELAY = 20 # frames
-CLEAR_ANIMATION_DURATION = 5 # frames
-
-sfx = {
-	"move":        pyglet.resource.media("assets/sound/move.wav", streaming=False),
-	"rotate":      pyglet.resource.media("assets/sound/rotate.wav", streaming=False),
-	"hardDrop":    pyglet.resource.media("assets/sound/hardDrop.wav", streaming=False),
-	"tetris":      pyglet.resource.media("assets/sound/tetris.wav", streaming=False),
-	"lineClear":   pyglet.resource.media("assets/sound/lineClear.wav", streaming=False),
-	"collapse":    pyglet.resource.media("assets/sound/collapse.wav", streaming=False),
-	"blockout":    pyglet.resource.media("assets/sound/blockout.wav", streaming=False),
-	"levelUp":     pyglet.resource.media("assets/sound/levelUp.wav", streaming=False),
-	"lock":        pyglet.resource.media("assets/sound/lock.wav", streaming=False),
-	"hold":        pyglet.resource.media("assets/sound/hold.wav", streaming=False),
-	"korobeiniki": pyglet.resource.media("assets/sound/Korobeiniki-F01.wav")
-}
+# (same fonts and pixel sizes as the pygame front-end, pyglet sizes are in points)
+pyglet.resource.add_font("assets/fonts/CenturyGothic.ttf")
+HUD_FONT = dict(font_name="Century Gothic", font_size=20 * 72 / 96)
+MEDIUM_FONT = dict(font_name="Ubuntu", font_size=48 * 72 / 96)
+HUGE_FONT = dict(font_name="Ubuntu", font_size=128 * 72 / 96)
 
-bgm = sfx["korobeiniki"]
-# TODO: play in loop
-
-def load_images():
-	images = {}
-	for mode in ["dying", "ghost", "locked", "normal"]:
-		images[mode] = {}
-		for shape in "IJLOSTZ":
-			images[mode][shape] = pyglet.resource.image(f"assets/images/mino-01-{mode}-~size-25~-{shape}.png")
-	return images
-
-imgs = load_images()
-bgimg = pyglet.resource.image("assets/images/main-background.png")
-matriximg = pyglet.resource.image("assets/images/matrix.png")
-vfx_harddrop = pyglet.resource.image("assets/images/vfx-hardDrop.png")
-vfx_sparkle = pyglet.resource.image("assets/images/vfx-sparkle.png")
-vfx_minolocked = pyglet.resource.image("assets/images/vfx-minoLocked-01.png")
+# a loading screen, to keep the window alive while the images load
+loading_batch = pyglet.graphics.Batch()
+loading_label = pyglet.text.Label("Loading...", y=height // 2, anchor_y="center", font_size=24, batch=loading_batch)
+loading_label.x = (width - loading_label.content_width) // 2
+
+def draw_loading_screen(loader):
+	window.dispatch_events()
+	window.clear()
+	loading_label.text = "Loading" + "." * int(time.perf_counter() * 3 % 4)
+	loading_batch.draw()
+	window.flip()
+	report.mark("loading screen")
+
+def sound_bytes(sound):
+	return round(sound.duration * sound.audio_format.bytes_per_second)
+
+# (none of these are needed for the first frame, so each one's loaded when it's first played, and they're prefetched after the first frame)
+sfx = Sounds({
+	"move":      "assets/sound/move.wav",
+	"rotate":    "assets/sound/rotate.wav",
+	"hardDrop":  "assets/sound/hardDrop.wav",
+	"tetris":    "assets/sound/tetris.wav",
+	"lineClear": "assets/sound/lineClear.wav",
+	"collapse":  "assets/sound/collapse.wav",
+	"blockout":  "assets/sound/blockout.wav",
+	"levelUp":   "assets/sound/levelUp.wav",
+	"lock":      "assets/sound/lock.wav",
+	"hold":      "assets/sound/hold.wav",
+}, lambda path: pyglet.resource.media(path, streaming=False), nbytes=sound_bytes, report=report)
+
+# everything plays through this, see sound.py (pyglet's audio drivers don't have buffer size or sample rate settings)
+sounds = SoundManager(NullBackend() if args.no_audio else PygletBackend(sfx))
+
+# the music's streamed (decoded a bit at a time as it plays) and looped
+bgm = pyglet.resource.media("assets/sound/Korobeiniki-F01.wav")
+music = pyglet.media.Player()
+music.queue(bgm)
+music.loop = True
+
+# the images get decoded on a few threads, and turned into textures on this one (which has the GL context)
+loader = Loader(idle=draw_loading_screen)
+draw_loading_screen(loader)
+assets = PygletAssets(map=loader.map, report=report)
+loader.shutdown()
+report.mark("loaded")
+
+imgs = assets.minos
+bgimg = assets.images["background"]
+matriximg = assets.images["matrix"]
+vfx_harddrop = assets.images["vfx_harddrop"]
+vfx_sparkle = assets.images["vfx_sparkle"]
+vfx_minolocked = assets.images["vfx_minolocked"]
 vfx_minolocked.anchor_x = vfx_minolocked.width / 2
 vfx_minolocked.anchor_y = vfx_minolocked.height / 2
 
@@ -79,439 +120,365 @@ for i in range(26):
 		scale += 0.05
 	else:
 		scale -= 0.05
-	minolock_frames.append((i*5, scale, 200 * (1 - i/26)))
+	minolock_frames.append((i*5, scale, int(200 * (1 - i/26))))
 
 
-class Particle(ABC):
-	@abstractmethod
-	def update(self):
-		"""
-		Returns True if the particle is still alive, False if its dead
-		"""
-		pass
+# ======== SCENE ========
+
+class SpriteSlots:
+	"""
+		a growable row of long-lived sprites, all in the same batch and group
+
+		set(i, ...) shows sprite i with the given look, only touching the
+		sprite for whatever's different from last time (so something that
+		hasn't moved costs nothing but a tuple comparison), and hide_from(n)
+		hides all the sprites from n onwards
+	"""
+	def __init__(self, batch, group):
+		self.batch = batch
+		self.group = group
+		self.sprites = []
+		self.states = []  # (image, x, y, opacity, rotation, scale, scale_y), or None if hidden
+
+	def set(self, i, image, x, y, opacity=255, rotation=0, scale=1, scale_y=1):
+		state = (image, x, y, opacity, rotation, scale, scale_y)
+		while i >= len(self.sprites):
+			sprite = pyglet.sprite.Sprite(image, x, y, batch=self.batch, group=self.group)
+			sprite.visible = False
+			self.sprites.append(sprite)
+			self.states.append(None)
+		old = self.states[i]
+		if old == state:
+			return
+		sprite = self.sprites[i]
+		if old is None:
+			sprite.visible = True
+			old = (None,) * len(state)
+		if image is not old[0]:
+			sprite.image = image
+		if (x, y) != old[1:3]:
+			sprite.position = (x, y, 0)
+		if opacity != old[3]:
+			sprite.opacity = opacity
+		if rotation != old[4]:
+			sprite.rotation = rotation
+		if scale != old[5]:
+			sprite.scale = scale
+		if scale_y != old[6]:
+			sprite.scale_y = scale_y
+		self.states[i] = state
+
+	def hide(self, i):
+		if i < len(self.sprites) and self.states[i] is not None:
+			self.sprites[i].visible = False
+			self.states[i] = None
+
+	def hide_from(self, n):
+		for i in range(n, len(self.sprites)):
+			self.hide(i)
+
+class BoardRenderer:
+	"""
+		the whole playfield (every board cell, then the ghost, then the
+		active piece) as instances of one quad, drawn with a single
+		glDrawArraysInstanced call
+
+		each instance is a cell position, the mino's rectangle in the atlas,
+		an opacity, and whether it slides down with the line clear collapse.
+		the instance buffer only gets rewritten when something changes: the
+		board part when the game says the board changed, the piece part
+		when the piece moves (the collapse slide itself is just a uniform)
+	"""
+
+	VERTEX_SHADER = """#version 150 core
+		in vec2 corner;
+		in vec2 cell;
+		in vec4 tex_rect;
+		in vec2 shade;
+
+		out vec2 uv;
+		out float opacity;
+
+		uniform WindowBlock {
+			mat4 projection;
+			mat4 view;
+		} window;
+
+		uniform vec2 origin;
+		uniform float cell_size;
+		uniform vec2 tile_size;
+		uniform float slide;
+		uniform float slide_thresh;
+
+		void main() {
+			float row = cell.y;
+			if (shade.y > 0.0 && row < slide_thresh) {
+				row += slide;
+			}
+			// (snapped to whole pixels, like a non-subpixel Sprite)
+			vec2 pos = floor(origin + vec2(cell.x, -row) * cell_size) + corner * tile_size;
+			gl_Position = window.projection * window.view * vec4(pos, 0.0, 1.0);
+			uv = mix(tex_rect.xy, tex_rect.zw, corner);
+			opacity = shade.x;
+		}
+	"""
+
+	FRAGMENT_SHADER = """#version 150 core
+		in vec2 uv;
+		in float opacity;
+
+		out vec4 final_colour;
+
+		uniform sampler2D atlas;
+
+		void main() {
+			if (opacity == 0.0) {
+				discard;
+			}
+			final_colour = texture(atlas, uv) * vec4(1.0, 1.0, 1.0, opacity);
+		}
+	"""
+
+	CORNERS = (0, 0, 1, 0, 1, 1, 0, 0, 1, 1, 0, 1)  # two triangles
+
+	def __init__(self, cols, rows):
+		self.cols = cols
+		self.rows = rows
+		self.board_instances = cols * rows
+		self.instances = np.zeros((self.board_instances + 8, 8), np.float32)  # cell x, y, tex rect, opacity, slides
+		self.piece_state = None
 
-	@abstractmethod
-	def render(self, surface):
-		pass
+		tile = imgs["normal"]["I"]
+		self.texture = tile.get_texture()
+		self.program = ShaderProgram(
+			Shader(self.VERTEX_SHADER, "vertex"),
+			Shader(self.FRAGMENT_SHADER, "fragment"),
+		)
+		self.program.use()
+		self.program["origin"] = (left_margin, height - top_margin)
+		self.program["cell_size"] = cell_size
+		self.program["tile_size"] = (tile.width, tile.height)
+		self.program["atlas"] = 0
+		self.program.stop()
+
+		self.vao = gl.GLuint()
+		gl.glGenVertexArrays(1, self.vao)
+		gl.glBindVertexArray(self.vao)
+		corner_buffer, self.instance_buffer = (gl.GLuint(), gl.GLuint())
+		gl.glGenBuffers(1, corner_buffer)
+		gl.glGenBuffers(1, self.instance_buffer)
+
+		corners = (gl.GLfloat * len(self.CORNERS))(*self.CORNERS)
+		gl.glBindBuffer(gl.GL_ARRAY_BUFFER, corner_buffer)
+		gl.glBufferData(gl.GL_ARRAY_BUFFER, ctypes.sizeof(corners), corners, gl.GL_STATIC_DRAW)
+		self.attribute("corner", 2, 0, 0, 0)
+
+		gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.instance_buffer)
+		gl.glBufferData(gl.GL_ARRAY_BUFFER, self.instances.nbytes, self.instances.ctypes.data, gl.GL_DYNAMIC_DRAW)
+		stride = self.instances.strides[0]
+		self.attribute("cell", 2, stride, 0, 1)
+		self.attribute("tex_rect", 4, stride, 2 * 4, 1)
+		self.attribute("shade", 2, stride, 6 * 4, 1)
+		gl.glBindVertexArray(0)
+
+	def attribute(self, name, size, stride, offset, divisor):
+		location = self.program.attributes[name]["location"]
+		gl.glEnableVertexAttribArray(location)
+		gl.glVertexAttribPointer(location, size, gl.GL_FLOAT, gl.GL_FALSE, stride, offset)
+		gl.glVertexAttribDivisor(location, divisor)
+
+	@staticmethod
+	def tex_rect(image):
+		u0, v0, _, _, _, _, u1, v1, _, _, _, _ = image.tex_coords
+		return (u0, v0, u1, v1)
+
+	def upload(self, start, stop):
+		gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.instance_buffer)
+		offset = start * self.instances.strides[0]
+		gl.glBufferSubData(gl.GL_ARRAY_BUFFER, offset, (stop - start) * self.instances.strides[0], self.instances.ctypes.data + offset)
+
+	def set_board(self, board, topzone):
+		instances = self.instances
+		i = 0
+		for y in range(self.rows):
+			for x in range(self.cols):
+				cell = board.cell(x, y + topzone)
+				if cell != " ":
+					instances[i] = (x, y, *self.tex_rect(imgs["locked"][cell]), 1, 1)
+				else:
+					instances[i] = 0
+				i += 1
+		self.upload(0, self.board_instances)
 
-class StreakParticle(Particle):
-	def __init__(self, row, col, height):
+	def set_piece(self, piece, x, y, ghost_y, opacity):
 		"""
-		row is the top row, "height" extends downwards (positive direction)
+			piece is None to hide it (during the line clear animation)
 		"""
-		self.alpha = 128
-		self.row = row
-		self.col = col
-		self.height = height
-		#self.sprite = pygame.transform.smoothscale(vfx_harddrop, (26, 26*height))
-	
-	def update(self):
-		self.alpha -= 5
-		return self.alpha > 0
-	
-	def render(self, batch):
-		self.sprite = pyglet.sprite.Sprite(
-			vfx_harddrop,
-			left_margin + self.col * cell_size,
-			height - (top_margin + (self.row + self.height) * cell_size),
-			batch=batch)
-		self.sprite.opacity = self.alpha
-		self.sprite.scale_y = self.height
-
-class SparkleParticle(Particle):
-	def __init__(self, row, col, alpha):
-		self.row = row + random.random()
-		self.col = col + random.random()
-		self.yvel = 0.01 + random.random() * 0.01
-		self.alpha = alpha
-		self.scale = (3 + random.random() * 4) / 32
-		#self.sprite = pygame.transform.smoothscale(vfx_sparkle, (sparkle_size, sparkle_size))
-	
-	def update(self):
-		self.alpha -= 5
-		self.row -= self.yvel
-		return self.alpha > 0
-	
-	def render(self, batch):
-		self.sprite = pyglet.sprite.Sprite(
-			vfx_sparkle,
-			int(left_margin + self.col * cell_size),
-			height - int(top_margin + self.row * cell_size),
-			batch=batch
-		)
-		self.sprite.opacity = self.alpha
-		self.sprite.scale = self.scale
-
-
-class RowClearParticle(Particle):
-	def __init__(self, row, col, anim_progress):
-		self.row = row
-		self.col = col
-		self.anim_progress = anim_progress
-	
-	def update(self):
-		self.anim_progress += 1
-		return self.anim_progress < 26
-	
-	def render(self, batch):
-		rotation, scale, alpha = minolock_frames[max(0, int(self.anim_progress))]
-		self.sprite = pyglet.sprite.Sprite(
-			vfx_minolocked,
-			left_margin + (self.col + 0.5 ) * cell_size,
-			height - (top_margin + (self.row - 0.5) * cell_size),
-			batch=batch
-		)
-		self.sprite.rotation = -rotation
-		self.sprite.scale = scale
-		self.sprite.opacity = alpha
-		return
-		#vfx_minolocked.set_alpha((1 - max(0, self.anim_progress)/20) * 255)
-		sprite = minolock_frames[max(0, int(self.anim_progress))]
-		#sprite.set_alpha(80)
-		#assert(type(sprite) is pygame.Surface)
-		w, h = sprite.get_size()
-		surface.blit(sprite, (
-			left_margin + (self.col + 0.5 ) * cell_size - w / 2,
-			top_margin + (self.row + 0.5) * cell_size - h / 2
-		))
-
-class GameState(Enum):
+		state = (piece, x, y, ghost_y, opacity)
+		if state == self.piece_state:
+			return
+		self.piece_state = state
+		start = self.board_instances
+		self.instances[start:] = 0
+		if piece is not None:
+			i = start
+			for mode, top, alpha in (("ghost", ghost_y, 1), ("normal", y, opacity)):
+				rect = self.tex_rect(imgs[mode][piece.shape])
+				for cx, cy in piece.cells:
+					if top + cy >= 0:
+						self.instances[i] = (x + cx, top + cy, *rect, alpha, 0)
+					i += 1
+		self.upload(start, len(self.instances))
+
+	def draw(self, slide, slide_thresh):
+		program = self.program
+		program.use()
+		program["slide"] = slide
+		program["slide_thresh"] = slide_thresh
+		gl.glEnable(gl.GL_BLEND)
+		gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+		gl.glActiveTexture(gl.GL_TEXTURE0)
+		gl.glBindTexture(self.texture.target, self.texture.id)
+		gl.glBindVertexArray(self.vao)
+		gl.glDrawArraysInstanced(gl.GL_TRIANGLES, 0, len(self.CORNERS) // 2, len(self.instances))
+		gl.glBindVertexArray(0)
+		program.stop()
+
+class Scene:
+	"""
+		everything on the gameplay screen, as sprites in one batch that
+		lives as long as the game does (rather than building a new batch
+		of new sprites every frame), plus the BoardRenderer for the
+		playfield itself
 	"""
-		all possible gameplay states
+	def __init__(self, cols, rows):
+		self.batch = pyglet.graphics.Batch()
+		self.board = BoardRenderer(cols, rows)  # (drawn on top of the batch, the previews and hold don't overlap it)
+		background, particles, pieces = (pyglet.graphics.Group(order=i) for i in range(3))
+		self.background = pyglet.sprite.Sprite(bgimg, batch=self.batch, group=background)
+		self.matrix = pyglet.sprite.Sprite(matriximg, 264, 32, batch=self.batch, group=background)
+		# (in the order they're spawned in, so later ones draw over earlier ones like they used to)
+		self.streaks = SpriteSlots(self.batch, pyglet.graphics.Group(order=0, parent=particles))
+		self.sparkles = SpriteSlots(self.batch, pyglet.graphics.Group(order=1, parent=particles))
+		self.row_clears = SpriteSlots(self.batch, pyglet.graphics.Group(order=2, parent=particles))
+		self.previews = SpriteSlots(self.batch, pieces)
+		self.hold = SpriteSlots(self.batch, pieces)
+
+		# the HUD boxes are part of the background art, so the numbers go where the pygame front-end puts them, relative to it
+		hud = dict(x=144, anchor_x="center", anchor_y="top", batch=self.batch, group=pieces, **HUD_FONT)
+		self.score = pyglet.text.Label("", y=height - 379, **hud)
+		self.level = pyglet.text.Label("", y=height - 439, **hud)
+		self.line_count = pyglet.text.Label("", y=height - 499, **hud)
+
+		# the pause/game over screen, in its own batch since it has to go over the board
+		self.overlay = pyglet.graphics.Batch()
+		dim, text = (pyglet.graphics.Group(order=i) for i in range(2))
+		self.dim = pyglet.shapes.Rectangle(0, 0, width, height, color=(0, 0, 0, 128), batch=self.overlay, group=dim)
+		centred = dict(x=width//2, anchor_x="center", anchor_y="center", batch=self.overlay, group=text)
+		self.title = pyglet.text.Label("", y=height - height//3, **centred, **HUGE_FONT)
+		self.subtitle = pyglet.text.Label("", y=height - height//2, **centred, **MEDIUM_FONT)
+
+def set_text(label, text):
 	"""
-	PLAYING = auto()
-	PAUSED = auto()
-	ANIMATING = auto()  # game logic paused for rendering line-clear animation
-	GAMEOVER = auto()
+		only re-lays out the label if the text actually changed
+	"""
+	if label.text != text:
+		label.text = text
+
+KEYMAP = {
+	key.UP: Action.ROTATE_CW,
+	key.X: Action.ROTATE_CW,
+	key.Z: Action.ROTATE_CCW,
+	key.C: Action.HOLD,
+	key.SPACE: Action.HARD_DROP,
+	key.P: Action.PAUSE,
+	key.RETURN: Action.RESTART,
+}
 
-class Game:
+HELD_KEYMAP = {
+	"left": key.LEFT,
+	"right": key.RIGHT,
+	"down": key.DOWN,
+}
+
+class Game(engine.Game):
 	"""
-		Contains the entire game state, gameplay logic, and rendering logic
+		pyglet front-end: input mapping, sounds, particles, and rendering logic
+		(the game rules themselves live in engine.Game)
 	"""
 
-	def __init__(self):
-		self.random_bag = []
-		self.gamestate = GameState.PLAYING
-		self.gridstate = [[" "]*gridwidth for _ in range(gridheight)]
-		self.shape_queue = [self.random_shape() for _ in range(3)]
-		self.score = 0
-		self.level = 1
-		self.line_count = 0
-		self.gameticks = 0
-		self.time_til_drop = self.time_per_drop()
-		self.line_clear_animation_ticks_remaining = 0
-		self.rows_to_collapse = []
-		self.prev_back2back = False
-		self.prevkeys = dict()
-		self.heldticks = {
-			"left": 0,
-			"right": 0,
-			"down": 0
-		}
-		self.hold = None
-		self.can_swap = True
-
-		self.active_shape = None
-		self.active_x = None
-		self.active_y = None
-		self.active_rot = None
-		self.particles = []
-		self.spawn_shape()
-
-		#pygame.mixer.music.play(-1, 0.0)
-	
-	def random_shape(self):
-		if not self.random_bag:
-			self.random_bag = list(SHAPES.keys())
-			random.shuffle(self.random_bag)
-		return self.random_bag.pop()
-
-	def spawn_shape(self, respawn=False):
-		if not respawn:
-			self.active_shape = self.shape_queue.pop(0)
-			self.shape_queue.append(self.random_shape())
-		self.active_x = 3
-		self.active_y = 2
-		self.active_rot = 0
-
-		if self.does_collide():
-			self.gamestate = GameState.GAMEOVER
-			sfx["blockout"].play()
-			#pygame.mixer.music.stop()
-
-	def try_rotate(self, direction):
-		new_rot = (self.active_rot + direction) % 4
-		wallkicks = WALLKICKS[self.active_shape][(self.active_rot, new_rot)]
-
-		for dx, dy in wallkicks:
-			new_x = self.active_x + dx
-			new_y = self.active_y - dy  # positive Y is upwards, in wallkick data (because that's what the tetris wiki uses)
-			if not self.does_collide(new_x, new_y, new_rot):
-				self.active_rot = new_rot
-				self.active_x = new_x
-				self.active_y = new_y
-				sfx["rotate"].play()
-				if self.is_resting(): #XXX should this be if it *was* resting?
-					self.time_til_drop = self.time_per_drop()
-				return True
-		
-		return False
-	
-	def try_movex(self, direction):
-		self.active_x += direction
-		if self.does_collide():
-			# revert
-			self.active_x -= direction
-			return False
-		else:
-			sfx["move"].play()
-			if self.is_resting():
-				self.time_til_drop = self.time_per_drop()
-			return True
-	
-	def try_movey(self, direction):
-		self.active_y += direction
-		if self.does_collide():
-			# revert
-			self.active_y -= direction
-			return False
-		else:
-			return True
-
-	def stamp_piece(self):
-		shape_sprite = SHAPES[self.active_shape][self.active_rot]
-		for y, row in enumerate(shape_sprite):
-			for x, val in enumerate(row):
-				posy = self.active_y + y
-				posx = self.active_x + x
-				if val != " ":
-					self.gridstate[posy][posx] = val
-
-	def is_resting(self):
-		return self.does_collide(testy=self.active_y+1)
-
-	def does_collide(self, testx=None, testy=None, testrot=None):
-		if testx is None:
-			testx = self.active_x
-		if testy is None:
-			testy = self.active_y
-		if testrot is None:
-			testrot = self.active_rot
-
-		shape_sprite = SHAPES[self.active_shape][testrot]
-		for y, row in enumerate(shape_sprite):
-			for x, val in enumerate(row):
-				posy = testy + y
-				posx = testx + x
-				if posy >= gridheight:
-					if val != " ":
-						return True  # we hit the floor
-					continue  # an empty cell within the bounding box is through the floor, ignore
-				if posx < 0 or posx >= gridwidth:
-					if val != " ":
-						return True  # we hit a wall
-					continue  # an empty cell within bounding box is outside the walls, ignore
-				if posy < 0:
-					continue  # I don't think this should ever happen, but if we're above the ceiling, ignore
-				
-				# if we reached here, (posx, posy) is definitely inside the grid
-				if val != " " and self.gridstate[posy][posx] != " ":
-					return True  # collision with a block already on the grid
-		
-		# if we made it this far, there were no collisions
-		return False
-	
-	def do_collapse_rows(self):
-		for y in range(gridheight):  # scan the grid from top to bottom
-			if y in self.rows_to_collapse:
-				self.gridstate = [[" "] * gridwidth] + self.gridstate[:y] + self.gridstate[y+1:]
-		self.rows_to_collapse = []
-
-	def check_lines(self):
-		self.rows_to_collapse = []
-		for y in range(gridheight):  # scan the grid from top to bottom
-			if self.gridstate[y].count(" ") == 0:
-				self.gridstate[y] = [" "] * gridwidth
-				for x in range(gridwidth):
-					self.particles.append(RowClearParticle(
-						y - topzone, x, -x
-					))
-				self.rows_to_collapse.append(y)
-		
-		if not self.rows_to_collapse:
-			return False
-		
-		linecount = len(self.rows_to_collapse)
-		back2back_bonus = 1.0
-		if linecount == 4:
-			if self.prev_back2back:
-				back2back_bonus = 1.5
-			sfx["tetris"].play()
-			self.prev_back2back = True
-		else:
-			sfx["lineClear"].play()
-			self.prev_back2back = False
-		sfx["collapse"].play()
-		
-		self.score += int(self.level * [0, 100, 300, 500, 800][linecount] * back2back_bonus)
-		new_line_total = self.line_count + linecount
-		if self.line_count // 10 != new_line_total // 10: # if we crossed a new multiple of 10 boundary
-			self.level += 1
-			sfx["levelUp"].play()
-		self.line_count = new_line_total
+	max_particles = 512
 
-		self.line_clear_animation_ticks_remaining = CLEAR_ANIMATION_DELAY + CLEAR_ANIMATION_DURATION
+	def __init__(self, *args, **kwargs):
+		self.fx_rng = random.Random()  # cosmetic only, so VFX never affect the piece sequence
+		self.particles = ParticlePool(self.max_particles)
+		self.timestep = engine.FixedTimestep()
+		self.tick_fraction = 1.0
+		super().__init__(*args, **kwargs)
+		self.scene = Scene(self.width, self.height - self.topzone)
 
-		return True
-		
-	def pause(self):
-		self.gamestate = GameState.PAUSED
-		#pygame.mixer.music.pause()
-	
-	def unpause(self):
-		self.gamestate = GameState.PLAYING
-		#pygame.mixer.music.unpause()
+	def reset(self):
+		self.particles.clear()
+		super().reset()
 
-	def update(self, dt, keys, events):
+		music.seek(0)
+		music.play()
 
-		if self.gamestate == GameState.PLAYING:
-			self.update_gameloop(dt, keys, events)
-		elif self.gamestate == GameState.PAUSED:
-			for event in events:
-				if event == key.P:
-					self.unpause()
-		elif self.gamestate == GameState.GAMEOVER:
-			for event in events:
-				if event == key.RETURN:
-					self.__init__()
-		
-		events.clear()
-	
-	def update_gameloop(self, dt, keys, events):
-		# update particles (keep only those that are still alive!)
-		self.particles = list(filter(lambda p: p.update(), self.particles))
-
-		if self.line_clear_animation_ticks_remaining > 0:
-			self.line_clear_animation_ticks_remaining -= 1
-			if self.line_clear_animation_ticks_remaining == 0:
-				self.do_collapse_rows()
-				self.spawn_shape()
-			return
+	def pause(self):
+		super().pause()
+		music.pause()
 
-		self.gameticks += 1
-
-		for event in events:
-			if event in [key.UP, key.X]:
-				self.try_rotate(1)
-			#if event.key == pygame.K_DOWN:
-			#    if self.try_movey(1):
-			#        self.score += 1
-			#if event.key == pygame.K_LEFT:
-			#    self.try_movex(-1)
-			#if event.key == pygame.K_RIGHT:
-			#    self.try_movex(1)
-			if event == key.Z:
-				self.try_rotate(-1)
-			if event == key.C:
-				self.swap_hold()
-			if event == key.SPACE:
-				drop_top = self.active_y
-
-				while self.try_movey(1):
-					self.score += 2
-				
-				drop_height = self.active_y - drop_top
-				visited_cols = set()
-				shape_sprite = SHAPES[self.active_shape][self.active_rot]
-				for y, row in list(enumerate(shape_sprite))[::-1]:
-					for x, val in enumerate(row):
-						if val != " ":
-							if x in visited_cols:
-								continue
-							visited_cols.add(x)
-
-							self.particles.append(StreakParticle(
-								drop_top + y - topzone,
-								self.active_x + x,
-								drop_height
-							))
-
-							for sparkle_y in range(drop_height):
-								if random.random() > 0.5:
-									continue
-								self.particles.append(SparkleParticle(
-									drop_top + y - topzone + sparkle_y,
-									self.active_x + x,
-									(sparkle_y/drop_height) * 200
-								))
-				sfx["hardDrop"].play()
-				self.time_til_drop = self.time_per_drop()
-				self.lockdown()
-			
-			if event == key.P:
-				self.pause()
-		
-		# keep track of how long these keys have been held
-		if keys[key.DOWN]:
-			self.heldticks["down"] += 1
-		else:
-			self.heldticks["down"] = 0
-		if keys[key.LEFT]:
-			self.heldticks["left"] += 1
-		else:
-			self.heldticks["left"] = 0
-		if keys[key.RIGHT]:
-			self.heldticks["right"] += 1
-		else:
-			self.heldticks["right"] = 0
-		
-		if self.heldticks["down"] == 1: # sfx on first press
-			sfx["move"].play()
-		if self.heldticks["down"] % 2 == 1: # 30Hz softdrop
-			if self.try_movey(1):
-				self.time_til_drop = self.time_per_drop()
-				self.score += 1
-		
-		if self.heldticks["left"] == 1 or (self.heldticks["left"] > 10 and self.heldticks["left"] % 2 == 1):  # 30Hz ARR, 10 frame DAS
-			self.try_movex(-1)
-		
-		if self.heldticks["right"] == 1 or (self.heldticks["right"] > 10 and self.heldticks["right"] % 2 == 1):  # 30Hz ARR, 10 frame DAS
-			self.try_movex(1)
-		
-		self.time_til_drop -= 1/60
-		if self.time_til_drop < 0:
-			self.apply_gravity()
-			self.time_til_drop += self.time_per_drop()
-	
-	def time_per_drop(self):
-		return (0.8 - ((self.level - 1) * 0.007)) ** (self.level - 1)
-
-	def swap_hold(self):
-		if not self.can_swap:
-			return
-		sfx["hold"].play()
+	def unpause(self):
+		super().unpause()
+		music.play()
 
-		if self.hold is None:
-			self.hold = self.active_shape
-			self.spawn_shape()
-		else:
-			self.active_shape, self.hold = self.hold, self.active_shape
-			self.spawn_shape(respawn=True)
-		
-		self.can_swap = False # this gets reset on next lockdown
-	
-	def lockdown(self):
-		self.stamp_piece()
-		if not self.check_lines():
-			self.spawn_shape()
-		self.can_swap = True
-		sfx["lock"].play()
-	
-	def apply_gravity(self):
-		if not self.try_movey(1):
-			#print(self.last_rotate_tick, self.last_drop_time * 60)
-			#if self.last_rotate_tick + 60 < self.last_drop_time * 60:
-			self.lockdown()
+	def update(self, dt, keys, events):
+		"""
+			runs however many ticks dt seconds' worth is (maybe none, on a
+			fast display), the key presses go to the first of them
+		"""
+		held = [name for name, k in HELD_KEYMAP.items() if keys[k]]
+		for _ in range(self.timestep.advance(dt)):
+			pressed = [KEYMAP[event] for event in events if event in KEYMAP]
+			events.clear()
+			super().update(pressed, held)
+			sounds.end_tick()
+		self.tick_fraction = self.timestep.fraction
+
+	def update_gameloop(self, pressed, held):
+		# update particles (the dead ones get dropped)
+		self.particles.update()
+		super().update_gameloop(pressed, held)
+
+	def play_sfx(self, name):
+		sounds.play(name)
+
+	def on_gameover(self):
+		music.pause()
+
+	def on_board_changed(self):
+		self.board_changed = True  # (the scene catches up when it's next drawn)
+
+	def on_rows_cleared(self, rows):
+		for y in rows:
+			for x in range(self.width):
+				# the animation starts x ticks late, so it sweeps across the row
+				self.particles.spawn(ROW_CLEAR, y - self.topzone, x, progress=-x, lifetime=26)
+
+	def on_hard_drop(self, drop_top, drop_height):
+		for x, y in self.active_piece().col_bottoms:
+			# the streak's top row, extending drop_height rows downwards
+			self.particles.spawn(STREAK, drop_top + y - self.topzone, self.active_x + x, alpha=128, fade=5, size=drop_height)
+
+			rng = self.fx_rng
+			for sparkle_y in range(drop_height):
+				if rng.random() > 0.5:
+					continue
+				row = drop_top + y - self.topzone + sparkle_y + rng.random()
+				col = self.active_x + x + rng.random()
+				yvel = 0.01 + rng.random() * 0.01
+				scale = (3 + rng.random() * 4) / 32
+				self.particles.spawn(SPARKLE, row, col, alpha=(sparkle_y/drop_height) * 200, fade=5, yvel=yvel, size=scale)
 
 
 	# ======== RENDERING LOGIC ========
@@ -525,151 +492,129 @@ class Game:
 			self.render_message_overlay(window, "GAME OVER", f"Score: {self.score:,}")
 
 	def render_message_overlay(self, window, text_string, subtitle=""):
-		return
-		overlay = pygame.Surface(size)
-		overlay.set_alpha(128)
-		overlay.fill(BLACK)
-		surface.blit(overlay, (0, 0))
-		
-		# render centered text
-		text = hugefont.render(text_string, True, WHITE)
-		text_rect = text.get_rect(center=(width//2, height//3))
-		surface.blit(text, text_rect)
-
-		text = mediumfont.render(subtitle, True, WHITE)
-		text_rect = text.get_rect(center=(width//2, height//2))
-		surface.blit(text, text_rect)
+		scene = self.scene
+		set_text(scene.title, text_string)
+		set_text(scene.subtitle, subtitle)
+		scene.overlay.draw()
+
+	def render_particles(self):
+		scene = self.scene
+		streaks = sparkles = row_clears = 0
+		fields = self.particles.live("kind", "row", "col", "alpha", "progress", "size")
+		for kind, row, col, alpha, progress, size in zip(*fields):
+			if kind == STREAK:
+				scene.streaks.set(streaks,
+					vfx_harddrop,
+					left_margin + int(col) * cell_size,
+					height - (top_margin + (int(row) + int(size)) * cell_size),
+					opacity=int(alpha),
+					scale_y=int(size)
+				)
+				streaks += 1
+			elif kind == SPARKLE:
+				scene.sparkles.set(sparkles,
+					vfx_sparkle,
+					int(left_margin + col * cell_size),
+					height - int(top_margin + row * cell_size),
+					opacity=int(alpha),  # (newer pyglets insist on an int)
+					scale=size
+				)
+				sparkles += 1
+			else:
+				rotation, scale, alpha = minolock_frames[max(0, int(progress))]
+				scene.row_clears.set(row_clears,
+					vfx_minolocked,
+					left_margin + (col + 0.5) * cell_size,
+					height - (top_margin + (row - 0.5) * cell_size),
+					opacity=alpha,
+					rotation=-rotation,
+					scale=scale
+				)
+				row_clears += 1
+		scene.streaks.hide_from(streaks)
+		scene.sparkles.hide_from(sparkles)
+		scene.row_clears.hide_from(row_clears)
 
 	def render_gameplay(self, window):
-		batch = pyglet.graphics.Batch()
-		#background = pyglet.graphics.Group(order=0)
-		#foreground = pyglet.graphics.Group(order=1)
-		self.sprites = []
-		self.sprites.append(pyglet.sprite.Sprite(bgimg, batch=batch))
-		self.sprites.append(pyglet.sprite.Sprite(matriximg, 264, 32, batch=batch))
+		"""
+			brings the scene's sprites up to date with the game state, then
+			draws them all in one go
+		"""
+		scene = self.scene
 
-		# draw particles (under everything else)
-		for particle in self.particles:
-			particle.render(batch)
+		# particles (under everything else)
+		self.render_particles()
 
-		# draw main grid state
+		# main grid state, ghost and active shape
+		if self.board_changed:
+			scene.board.set_board(self.board, self.topzone)
+			self.board_changed = False
 		if self.rows_to_collapse and 0 < self.line_clear_animation_ticks_remaining < CLEAR_ANIMATION_DURATION:
-			slide_thresh = min(self.rows_to_collapse) - topzone
+			slide_thresh = min(self.rows_to_collapse) - self.topzone
 			slide = 1 + max(self.rows_to_collapse) - min(self.rows_to_collapse)
 			slide *= 1 - (self.line_clear_animation_ticks_remaining / CLEAR_ANIMATION_DURATION)
 		else:
 			slide = 0
 			slide_thresh = 0
-		for y in range(gridheight - topzone):
-			for x in range(gridwidth):
-				cell = self.gridstate[y+topzone][x]
-				if cell != " ":
-					self.sprites.append(pyglet.sprite.Sprite(imgs["locked"][cell],
-						left_margin + x * cell_size,
-						height - (top_margin + (y + (slide if y < slide_thresh else 0)) * cell_size),
-						batch=batch
-					))
-
-		# find ghost position
-		for ghosty in range(self.active_y, gridheight):
-			if self.does_collide(testy=(ghosty + 1)):
-				break
-		
-		# draw ghost
-		if not self.line_clear_animation_ticks_remaining:
-			shape_sprite = SHAPES[self.active_shape][self.active_rot]
-			for y, row in enumerate(shape_sprite):
-				posy = ghosty + y - topzone
-				if posy < 0:
-					continue
-				for x, val in enumerate(row):
-					if val != " ":
-						posx = self.active_x+x
-						self.sprites.append(pyglet.sprite.Sprite(imgs["ghost"][val],
-							left_margin + posx * cell_size, 
-							height - (top_margin + posy * cell_size),
-							batch=batch
-						))
-
-		# draw active shape
 		if not self.line_clear_animation_ticks_remaining:
 			if self.is_resting():
 				alpha = int((self.time_til_drop / self.time_per_drop()) * 255)
 			else:
 				alpha = 255
-			shape_sprite = SHAPES[self.active_shape][self.active_rot]
-			for y, row in enumerate(shape_sprite):
-				posy = self.active_y + y - topzone
-				if posy < 0:
-					continue
-				for x, val in enumerate(row):
-					if val != " ":
-						posx = self.active_x + x
-						#imgs["normal"][val].set_alpha(alpha)
-						s = pyglet.sprite.Sprite(
-							imgs["normal"][val],
-							left_margin + posx * cell_size,
-							height - (top_margin + posy * cell_size),
-							batch=batch
-						)
-						s.opacity = alpha
-						self.sprites.append(s)
-						#imgs["normal"][val].set_alpha(255)
-
-		# draw preview of next shape
-		for i, shape in enumerate(self.shape_queue):
-			shape_sprite = SHAPES[shape][0]
+			piece = self.active_piece()
+			drawx, drawy = self.active_position(self.tick_fraction)
+			scene.board.set_piece(piece, drawx, drawy - self.topzone, self.ghost_y() - self.topzone, alpha / 255)
+		else:
+			scene.board.set_piece(None, 0, 0, 0, 0)
+
+		# preview of next shapes
+		i = 0
+		for n, shape in enumerate(self.shape_queue):
 			shift = CENTRE_SHIFT[shape]
-			for y, row in enumerate(shape_sprite):
-				for x, val in enumerate(row):
-					if val != " ":
-						self.sprites.append(pyglet.sprite.Sprite(
-							imgs["normal"][val],
-							left_margin + (x + gridwidth + 3 + shift) * cell_size,
-							height - (top_margin - 4 + (y + 3 + i * 2.5) * cell_size),
-							batch=batch
-						))
-
-		# draw hold
+			for x, y in self.pieces[shape][0].cells:
+				scene.previews.set(i,
+					imgs["normal"][shape],
+					left_margin + (x + self.width + 3 + shift) * cell_size,
+					height - (top_margin - 4 + (y + 3 + n * 2.5) * cell_size)
+				)
+				i += 1
+		scene.previews.hide_from(i)
+
+		# hold
+		i = 0
 		if self.hold:
-			shape_sprite = SHAPES[self.hold][0]
 			shift = CENTRE_SHIFT[self.hold]
-			for y, row in enumerate(shape_sprite):
-				for x, val in enumerate(row):
-					if val != " ":
-						self.sprites.append(pyglet.sprite.Sprite(
-							imgs["normal"][val],
-							left_margin + 4 + (x - 7 + shift) * cell_size,
-							height - (top_margin - 4 + (y + 3) * cell_size),
-							batch=batch
-						))
-
-		batch.draw()
-		return
-
-		# score
-		rendered_score = font.render(f"{self.score:,}", True, WHITE)
-		surface.blit(rendered_score, (384-rendered_score.get_width()//2, 440))
-
-		rendered_level = font.render(f"{self.level}", True, WHITE)
-		surface.blit(rendered_level, (384-rendered_level.get_width()//2, 500))
+			for x, y in self.pieces[self.hold][0].cells:
+				scene.hold.set(i,
+					imgs["normal"][self.hold],
+					left_margin + 4 + (x - 7 + shift) * cell_size,
+					height - (top_margin - 4 + (y + 3) * cell_size)
+				)
+				i += 1
+		scene.hold.hide_from(i)
 
-		rendered_line_count = font.render(f"{self.line_count}", True, WHITE)
-		surface.blit(rendered_line_count, (384-rendered_line_count.get_width()//2, 560))
+		# HUD
+		set_text(scene.score, f"{self.score:,}")
+		set_text(scene.level, f"{self.level}")
+		set_text(scene.line_count, f"{self.line_count}")
 
-
-		# "particle" effects
-
-		#scaled_vfx = pygame.transform.smoothscale(vfx_harddrop, (26*3, 26*10))
-		#surface.blit(scaled_vfx, (600, 400))
+		scene.batch.draw()
+		scene.board.draw(slide, slide_thresh)
 
 
 
 game = Game()
 
+# --trace FILE: instrument the hot paths, and write Chrome trace events to FILE on exit (see tracing.py)
+tracer = None
+if args.trace:
+	tracer = Tracer()
+	tracer.instrument_game(Game)
+
 keysdown = set()
 
-pyglet.clock.schedule_interval(lambda dt: game.update(dt, keys, keysdown), 1/60.0)
+# every time round the event loop, with the real time since last time (the Game works out how many ticks that is)
+pyglet.clock.schedule(lambda dt: game.update(dt, keys, keysdown))
 
 @window.event
 def on_key_press(symbol, modifiers):
@@ -680,6 +625,20 @@ def on_draw():
 	window.clear()
 	game.render(window)
 	fps_display.draw()
+	if tracer:
+		tracer.end_frame(particles=len(game.particles))
+	if "first frame" not in report.milestones:
+		report.mark("first frame")
+		if args.asset_report:
+			print(report)
+		if not args.no_audio:
+			sfx.prefetch()
 
 window.push_handlers(keys)
-pyglet.app.run()
+
+if __name__ == "__main__":
+	pyglet.app.run(0)  # redraw as often as vsync allows, i.e. at the display's refresh rate
+	if tracer:
+		tracer.export(args.trace)
+		print(tracer)
+
@@ -0,0 +1,92 @@
+"""
+A pooled particle system, shared by the front-ends.
+
+Particles live in a ParticlePool: a preallocated numpy array with a row per
+attribute and a column per particle, which gets updated in bulk once per tick,
+rather than as a list of objects that each update themselves. Dead
+particles are squeezed out in place, keeping everyone else in the order
+they were spawned (which is the order they're drawn in).
+
+The pool only does the simulation. Drawing is up to the front-end, which
+reads the live slots straight out of the arrays.
+"""
+
+import numpy as np
+
+# particle kinds
+STREAK = 0     # the trail a hard drop leaves behind
+SPARKLE = 1    # the glitter that floats up off a hard drop
+ROW_CLEAR = 2  # one cell of a cleared row, playing the minolock animation
+
+FOREVER = 1 << 30  # lifetime for particles that only die by fading out
+
+class ParticlePool:
+	"""
+		Each particle has a kind, a position (row, col, in cells), an upward
+		speed (yvel, rows per tick), an alpha that goes down by fade every
+		tick, and a progress counter that goes up by one every tick. It
+		dies when its alpha runs out, or progress reaches lifetime. size is
+		whatever the front-end needs to pick a sprite (e.g. streak height).
+
+		At most capacity particles can be alive at once, and spawns beyond
+		that are dropped.
+	"""
+
+	FIELDS = ("kind", "row", "col", "yvel", "alpha", "fade", "progress", "lifetime", "size")
+
+	def __init__(self, capacity=1024):
+		self.capacity = capacity
+		self.count = 0
+		self.dropped = 0  # how many spawns were refused because the pool was full
+		# all one array (so dead particles can be squeezed out in one go), with a view of each row by name
+		self.data = np.zeros((len(self.FIELDS), capacity))
+		for i, name in enumerate(self.FIELDS):
+			setattr(self, name, self.data[i])
+
+	def __len__(self):
+		return self.count
+
+	def clear(self):
+		self.count = 0
+
+	def spawn(self, kind, row, col, alpha=255, fade=0, yvel=0, progress=0, lifetime=FOREVER, size=0):
+		"""
+			returns False if the pool is full
+		"""
+		i = self.count
+		if i >= self.capacity:
+			self.dropped += 1
+			return False
+		self.data[:, i] = (kind, row, col, yvel, alpha, fade, progress, lifetime, size)
+		self.count = i + 1
+		return True
+
+	def update(self):
+		n = self.count
+		if not n:
+			return
+		self.alpha[:n] -= self.fade[:n]
+		self.row[:n] -= self.yvel[:n]
+		self.progress[:n] += 1
+		alive = (self.alpha[:n] > 0) & (self.progress[:n] < self.lifetime[:n])
+		survivors = int(np.count_nonzero(alive))
+		if survivors == n:
+			return
+		self.data[:, :survivors] = self.data[:, :n][:, alive]
+		self.count = survivors
+
+	def live(self, *names):
+		"""
+			the named fields of every live particle, as lists (which are much
+			quicker to loop over than numpy arrays)
+		"""
+		return [getattr(self, name)[:self.count].tolist() for name in names]
+
+	def __getstate__(self):
+		# the views would come back unpickled as copies
+		return {"capacity": self.capacity, "count": self.count, "dropped": self.dropped, "data": self.data}
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		for i, name in enumerate(self.FIELDS):
+			setattr(self, name, self.data[i])
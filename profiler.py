@@ -0,0 +1,91 @@
+"""
+Per-phase frame timing.
+
+A frame is split into phases by calling lap(phase) as it goes: each lap
+charges the time since the previous one to that phase (so phases that run
+more than once a frame, like the game ticks, add up). The last window frames
+of each phase are kept, for rolling percentiles, and can be exported as CSV
+or JSON.
+
+main.py profiles every frame (it only costs a few perf_counter calls): F3
+shows the numbers, and --profile FILE writes them out on exit.
+"""
+
+import collections
+import csv
+import json
+import time
+
+PERCENTILES = (50, 95, 99)
+
+class NullProfiler:
+	"""
+		stands in for a FrameProfiler when nothing's being profiled
+	"""
+	def lap(self, phase):
+		pass
+
+class FrameProfiler:
+	IDLE_PHASES = ("wait",)  # not counted towards "busy", the frame's total work
+
+	def __init__(self, window=600):
+		self.window = window
+		self.samples = {}  # phase: deque of per-frame seconds, in the order phases were first seen
+		self.frame = {}
+		self.frames = 0
+		self.last = time.perf_counter()
+
+	def start_frame(self):
+		self.frame = {}
+		self.last = time.perf_counter()
+
+	def lap(self, phase):
+		now = time.perf_counter()
+		self.frame[phase] = self.frame.get(phase, 0) + now - self.last
+		self.last = now
+
+	def end_frame(self):
+		frame = self.frame
+		frame["busy"] = sum(seconds for phase, seconds in frame.items() if phase not in self.IDLE_PHASES)
+		for phase in frame:
+			if phase not in self.samples:
+				self.samples[phase] = collections.deque([0] * min(self.frames, self.window), self.window)
+		for phase, samples in self.samples.items():
+			samples.append(frame.get(phase, 0))  # (phases that didn't happen this frame took no time)
+		self.frames += 1
+
+	def last_frame(self, phase):
+		return self.frame.get(phase, 0)
+
+	def summary(self):
+		"""
+			{phase: {"p50": ms, "p95": ms, "p99": ms, "mean": ms, "max": ms}}
+			over the last window frames
+		"""
+		summary = {}
+		for phase, samples in self.samples.items():
+			ordered = sorted(samples)
+			stats = {
+				f"p{p}": ordered[min(len(ordered) - 1, len(ordered) * p // 100)] * 1000
+				for p in PERCENTILES
+			}
+			stats["mean"] = sum(ordered) / len(ordered) * 1000
+			stats["max"] = ordered[-1] * 1000
+			summary[phase] = stats
+		return summary
+
+	def export(self, path):
+		"""
+			writes the summary to path, as JSON if it ends in .json, CSV otherwise
+		"""
+		summary = self.summary()
+		with open(path, "w", newline="") as f:
+			if path.endswith(".json"):
+				json.dump({"frames": min(self.frames, self.window), "phases_ms": summary}, f, indent="\t")
+				f.write("\n")
+				return
+			columns = [f"p{p}" for p in PERCENTILES] + ["mean", "max"]
+			writer = csv.writer(f)
+			writer.writerow(["phase"] + [column + "_ms" for column in columns])
+			for phase, stats in summary.items():
+				writer.writerow([phase] + ["{:.3f}".format(stats[column]) for column in columns])
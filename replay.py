@@ -0,0 +1,253 @@
+"""
+Input recording and playback.
+
+Games are deterministic given their seed and inputs, so a recording is just
+the seed, the board size, and what was pressed and held on each tick (see
+Recorder for the format). Every so often the recorder also stores a hash of
+the game state, so playback can tell if the rules have changed underneath it.
+
+	python3 main.py --record game.fbr
+	python3 replay.py game.fbr              # replay headlessly, as fast as possible
+	python3 replay.py archive/*.fbr         # check lots of recordings at once
+	python3 replay.py game.fbr --show 5000  # fast-forward to tick 5000, then watch the rest in pygame
+
+Once a shown recording runs out, the keyboard takes over.
+"""
+
+import argparse
+import sys
+import time
+
+import engine
+from engine import Action, HELD_KEYS
+
+MAGIC = b"FBGR"
+VERSION = 1
+
+CHECKPOINT_INTERVAL = 600  # ticks (10 seconds)
+
+ACTIONS = {action.value: action for action in Action}
+
+class Desync(Exception):
+	pass
+
+def write_varint(out, n):
+	while n >= 0x80:
+		out.write(bytes([(n & 0x7f) | 0x80]))
+		n >>= 7
+	out.write(bytes([n]))
+
+def read_varint(data, pos):
+	"""
+		returns (value, new_pos)
+	"""
+	n = 0
+	shift = 0
+	while True:
+		byte = data[pos]
+		pos += 1
+		n |= (byte & 0x7f) << shift
+		if byte < 0x80:
+			return n, pos
+		shift += 7
+
+def zigzag(n):
+	return n << 1 if n >= 0 else (-n << 1) - 1
+
+def unzigzag(n):
+	return n >> 1 if not n & 1 else -((n + 1) >> 1)
+
+class Recorder:
+	"""
+		Records every tick of a game's inputs to out (a binary file)
+
+		The file starts with MAGIC, a version byte, then varints for the
+		(zigzagged) seed, width, height and topzone. After that it's a series
+		of entries, each of which starts with a varint header:
+
+			count << 4 | held << 1 | has_pressed
+
+		meaning count ticks with the same held keys (a bitmask, bit i is
+		HELD_KEYS[i]), the last of which had presses. If it did, the Action
+		values follow as bytes, terminated by a zero. A header of 0 means an 8
+		byte Game.state_hash() follows instead, for the state after all the
+		ticks so far. Idle stretches collapse into a byte or two, and the file
+		always ends with a checkpoint.
+	"""
+
+	def __init__(self, out, game, checkpoint_interval=CHECKPOINT_INTERVAL):
+		if game.seed is None:
+			raise ValueError("can only record games with a known seed")
+		self.out = out
+		self.game = game
+		self.checkpoint_interval = checkpoint_interval
+		self.ticks = 0
+		self.run_held = 0
+		self.run_length = 0
+
+		out.write(MAGIC + bytes([VERSION]))
+		for n in (zigzag(game.seed), game.width, game.height, game.topzone):
+			write_varint(out, n)
+		game.recorder = self
+
+	def record(self, pressed, held):
+		"""
+			called by Game.update(), before the tick happens
+		"""
+		if self.ticks and self.ticks % self.checkpoint_interval == 0:
+			self.checkpoint()
+
+		mask = 0
+		for i, name in enumerate(HELD_KEYS):
+			if name in held:
+				mask |= 1 << i
+		if self.run_length and mask != self.run_held:
+			self.flush()
+		self.run_held = mask
+		self.run_length += 1
+		if pressed:
+			self.flush(pressed)
+		self.ticks += 1
+
+	def flush(self, pressed=()):
+		if not self.run_length:
+			return
+		write_varint(self.out, self.run_length << 4 | self.run_held << 1 | bool(pressed))
+		if pressed:
+			self.out.write(bytes([action.value for action in pressed] + [0]))
+		self.run_length = 0
+
+	def checkpoint(self):
+		self.flush()
+		write_varint(self.out, 0)
+		self.out.write(self.game.state_hash())
+
+	def close(self):
+		self.checkpoint()
+		self.game.recorder = None
+		self.out.close()
+
+class Playback:
+	"""
+		Feeds a recording back into a game, one tick at a time
+
+		self.game starts out as a headless engine.Game, but can be swapped for
+		any other Game (e.g. a front-end one) part way through, as long as it
+		carries on from the same state.
+	"""
+
+	def __init__(self, data):
+		if data[:4] != MAGIC:
+			raise ValueError("not a recording")
+		if data[4] != VERSION:
+			raise ValueError("unsupported recording version {}".format(data[4]))
+		pos = 5
+		seed, pos = read_varint(data, pos)
+		self.seed = unzigzag(seed)
+		self.width, pos = read_varint(data, pos)
+		self.height, pos = read_varint(data, pos)
+		self.topzone, pos = read_varint(data, pos)
+
+		self.game = engine.Game(self.width, self.height, self.topzone, seed=self.seed)
+		self.tick = 0
+		self.checkpoints = 0
+		self.ticks = self.read_ticks(data, pos)
+
+	def read_ticks(self, data, pos):
+		"""
+			yields (pressed, held) for each tick, checking the checkpoints
+			along the way (which relies on the caller having applied the
+			previous tick before asking for the next one)
+		"""
+		held_sets = [
+			tuple(name for i, name in enumerate(HELD_KEYS) if mask & (1 << i))
+			for mask in range(1 << len(HELD_KEYS))
+		]
+		while pos < len(data):
+			header, pos = read_varint(data, pos)
+			if header == 0:
+				expected = bytes(data[pos:pos + 8])
+				pos += 8
+				if self.game.state_hash() != expected:
+					raise Desync("state diverged from the recording by tick {}".format(self.tick))
+				self.checkpoints += 1
+				continue
+
+			count = header >> 4
+			held = held_sets[(header >> 1) & 7]
+			for _ in range(count - 1):
+				self.tick += 1
+				yield [], held
+
+			pressed = []
+			if header & 1:
+				while data[pos]:
+					pressed.append(ACTIONS[data[pos]])
+					pos += 1
+				pos += 1
+			self.tick += 1
+			yield pressed, held
+
+	def run(self, stop=None):
+		"""
+			replays (headlessly, unless self.game has been swapped out) until
+			the recording ends or stop ticks have been played
+		"""
+		if self.tick == stop:
+			return
+		for pressed, held in self.ticks:
+			self.game.update(pressed, held)
+			if self.tick == stop:
+				break
+
+	def show(self):
+		"""
+			carry on in the pygame front-end (the keyboard takes over when
+			the recording ends)
+		"""
+		import main  # opens the window
+
+		# graft the headless game's state onto a front-end Game, rather than replaying it all again with sounds
+		state = main.Game(self.width, self.height, self.topzone, seed=self.seed)
+		state.__dict__.update(self.game.__dict__)
+		self.game = state
+		main.main(state, self.ticks)
+
+def main():
+	parser = argparse.ArgumentParser(description="replay recorded games")
+	parser.add_argument("recordings", nargs="+", metavar="FILE")
+	parser.add_argument("--show", type=int, metavar="TICK", help="fast-forward to TICK, then hand off to the pygame renderer")
+	args = parser.parse_args()
+
+	if args.show is not None and len(args.recordings) > 1:
+		parser.error("--show only works with a single recording")
+
+	failed = 0
+	for path in args.recordings:
+		with open(path, "rb") as f:
+			playback = Playback(f.read())
+
+		start = time.perf_counter()
+		try:
+			playback.run(args.show)
+		except Desync as e:
+			print("{}: {}".format(path, e))
+			failed += 1
+			continue
+		elapsed = time.perf_counter() - start
+
+		game = playback.game
+		print("{}: {} ticks, {} checkpoints ok, score {}, {} lines, level {} ({:.0f} ticks/s)".format(
+			path, playback.tick, playback.checkpoints,
+			game.score, game.line_count, game.level,
+			playback.tick / elapsed if elapsed else 0,
+		))
+
+		if args.show is not None:
+			playback.show()
+
+	if failed:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,148 @@
+"""
+Sound effect playback, shared by the front-ends.
+
+Rather than every sound effect calling .play() and grabbing whatever mixer
+channel is free, they all go through a SoundManager, which plays them on a
+fixed pool of voices:
+
+- each sound has a priority. when every voice is busy, a new sound takes over
+  the voice of the oldest, least important sound playing, as long as that's no
+  more important than it (otherwise the new sound is dropped), so a flurry of
+  moves can never cut off a tetris or a blockout
+- each sound is limited to a few voices of its own, so a held key repeating
+  move.wav at 30Hz restarts it, rather than piling up copies of it
+- the same sound triggered more than once in a tick only plays once
+
+The playing itself is up to a backend: PygameBackend (mixer channels),
+PygletBackend (media players), or NullBackend, which doesn't play anything
+(or load anything), for headless runs.
+"""
+
+import time
+
+VOICES = 8
+
+# name: (priority, max voices), where higher priorities take voices off lower ones
+SOUNDS = {
+	"move":      (0, 1),
+	"rotate":    (0, 1),
+	"hardDrop":  (1, 2),
+	"lock":      (1, 2),
+	"hold":      (1, 1),
+	"lineClear": (2, 1),
+	"collapse":  (2, 1),
+	"levelUp":   (3, 1),
+	"tetris":    (3, 1),
+	"blockout":  (3, 1),
+}
+DEFAULT_SOUND = (0, 1)
+
+class NullBackend:
+	"""
+		plays nothing, so nothing gets loaded and no audio device gets opened
+	"""
+	def play(self, voice, name):
+		pass
+
+	def busy(self, voice):
+		return False
+
+class PygameBackend:
+	"""
+		voice i is mixer channel i, and sounds is where they come from (an
+		assets.Sounds, which opens the mixer before the first one loads)
+	"""
+	def __init__(self, sounds, voices=VOICES):
+		self.sounds = sounds
+		self.voices = voices
+		self.channels = None  # (until the mixer's open)
+
+	def play(self, voice, name):
+		sound = self.sounds[name]
+		if self.channels is None:
+			import pygame
+			pygame.mixer.set_num_channels(self.voices)
+			self.channels = [pygame.mixer.Channel(i) for i in range(self.voices)]
+		self.channels[voice].play(sound)  # (cutting off whatever it was playing)
+
+	def busy(self, voice):
+		return self.channels is not None and self.channels[voice].get_busy()
+
+class PygletBackend:
+	"""
+		each voice is the pyglet Player its last sound was played with
+	"""
+	def __init__(self, sounds, voices=VOICES):
+		self.sounds = sounds
+		self.players = [None] * voices
+
+	def play(self, voice, name):
+		player = self.players[voice]
+		if player is not None:
+			player.delete()
+		self.players[voice] = self.sounds[name].play()
+
+	def busy(self, voice):
+		player = self.players[voice]
+		return player is not None and player.playing
+
+class SoundManager:
+	def __init__(self, backend, voices=VOICES, sounds=SOUNDS):
+		self.backend = backend
+		self.settings = sounds
+		self.voices = [None] * voices  # (name, priority, start time) of what each voice last played
+		self.triggered = set()  # names played this tick
+		self.dropped = 0  # sounds that didn't get a voice
+
+	def play(self, name):
+		if name in self.triggered:
+			return
+		self.triggered.add(name)
+		priority, max_voices = self.settings.get(name, DEFAULT_SOUND)
+		voice = self.pick_voice(name, priority, max_voices)
+		if voice is None:
+			self.dropped += 1
+			return
+		self.voices[voice] = (name, priority, time.perf_counter())
+		self.backend.play(voice, name)
+
+	def pick_voice(self, name, priority, max_voices):
+		"""
+			the voice to play name on, or None if it should be dropped
+		"""
+		voices = self.voices
+		busy = [i for i, playing in enumerate(voices) if playing is not None and self.backend.busy(i)]
+		oldest = lambda i: voices[i][2]
+
+		own = [i for i in busy if voices[i][0] == name]
+		if len(own) >= max_voices:
+			return min(own, key=oldest)  # (restart it)
+
+		for i in range(len(voices)):
+			if i not in busy:
+				return i
+
+		# steal the oldest of the least important, if nothing playing is more important than this
+		victims = [i for i in busy if voices[i][1] <= priority]
+		if not victims:
+			return None
+		return min(victims, key=lambda i: (voices[i][1], voices[i][2]))
+
+	def end_tick(self):
+		self.triggered.clear()
+
+class NullMusic:
+	"""
+		stands in for a music player when there's no audio
+	"""
+	def play(self, *args):
+		pass
+
+	def pause(self):
+		pass
+
+	def unpause(self):
+		pass
+
+	def stop(self):
+		pass
@@ -0,0 +1,111 @@
+"""
+Runs lots of headless games across a process pool, and reports how they went.
+
+	python3 tournament.py --games 10000 --policy greedy --out results.jsonl
+
+Game i gets seed --seed + i (for the piece sequence, and for the policy's own
+RNG), so two runs over the same seeds see exactly the same pieces, which is
+what you want when comparing a rule or bot change against the old version.
+Results are written to --out one JSON object per line, as soon as each game
+finishes (so in no particular order - use the seed field to match them up).
+"""
+
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+from bots import POLICIES
+import engine
+
+STATS = ("score", "line_count", "level", "pieces_placed", "ticks")
+
+def play(seed, policy="greedy", max_ticks=100000, width=engine.gridwidth, height=engine.gridheight, topzone=engine.topzone):
+	"""
+		plays one game to the end (or until max_ticks), returning its result
+	"""
+	game = engine.Game(width, height, topzone, seed=seed)
+	player = POLICIES[policy](seed)
+	ticks = 0
+	while game.gamestate != engine.GameState.GAMEOVER and ticks < max_ticks:
+		game.update(*player.act(game))
+		ticks += 1
+
+	return {
+		"seed": seed,
+		"score": game.score,
+		"line_count": game.line_count,
+		"level": game.level,
+		"pieces_placed": game.pieces_placed,
+		"ticks": ticks,
+		"gameover": game.gamestate == engine.GameState.GAMEOVER,
+	}
+
+def summarise(results):
+	lines = ["{} games, {} topped out".format(len(results), sum(r["gameover"] for r in results))]
+	lines.append("{:>14} {:>12} {:>12} {:>12} {:>12} {:>12}".format("", "mean", "stdev", "min", "median", "max"))
+	for stat in STATS:
+		values = [r[stat] for r in results]
+		lines.append("{:>14} {:>12.1f} {:>12.1f} {:>12} {:>12g} {:>12}".format(
+			stat,
+			statistics.mean(values),
+			statistics.pstdev(values),
+			min(values),
+			statistics.median(values),
+			max(values),
+		))
+	return "\n".join(lines)
+
+def main():
+	parser = argparse.ArgumentParser(description="run many seeded headless games in parallel")
+	parser.add_argument("--games", type=int, default=100, help="number of games to play")
+	parser.add_argument("--seed", type=int, default=0, help="seed of the first game (the rest count up from it)")
+	parser.add_argument("--policy", choices=sorted(POLICIES), default="greedy", help="which bot plays")
+	parser.add_argument("--max-ticks", type=int, default=100000, help="stop games that survive this long (60 ticks per second)")
+	parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of processes (default: one per core)")
+	parser.add_argument("--width", type=int, default=engine.gridwidth)
+	parser.add_argument("--height", type=int, default=engine.gridheight)
+	parser.add_argument("--topzone", type=int, default=engine.topzone)
+	parser.add_argument("--out", default="results.jsonl", help="where to write per-game results (- for stdout)")
+	args = parser.parse_args()
+
+	job = functools.partial(
+		play,
+		policy=args.policy,
+		max_ticks=args.max_ticks,
+		width=args.width,
+		height=args.height,
+		topzone=args.topzone,
+	)
+	seeds = range(args.seed, args.seed + args.games)
+	chunksize = max(1, args.games // (args.workers * 16))  # big enough to keep IPC overhead down, small enough to balance the load
+
+	results = []
+	start = time.perf_counter()
+	out = sys.stdout if args.out == "-" else open(args.out, "w")
+	try:
+		with multiprocessing.Pool(args.workers) as pool:
+			for result in pool.imap_unordered(job, seeds, chunksize):
+				out.write(json.dumps(result) + "\n")
+				out.flush()
+				results.append(result)
+	finally:
+		if out is not sys.stdout:
+			out.close()
+	elapsed = time.perf_counter() - start
+
+	if not results:
+		return
+	print(summarise(results), file=sys.stderr)
+	print("{:.1f}s, {:.1f} games/s, {:.0f} ticks/s".format(
+		elapsed,
+		len(results) / elapsed,
+		sum(r["ticks"] for r in results) / elapsed,
+	), file=sys.stderr)
+
+if __name__ == "__main__":
+	main()
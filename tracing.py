@@ -0,0 +1,118 @@
+"""
+Hot path call counts and timed spans, exported as Chrome trace events.
+
+Nothing in the engine or the renderers knows about tracing. Tracer.instrument()
+swaps a class's methods for wrappers that count every call and record how long
+each one took, so when tracing is off the hot paths are exactly what they always
+were (not even an "if tracing:" check).
+
+Once a frame, end_frame() turns the calls made since the last frame into a
+counter event (plus any other numbers the caller passes in, like how many
+particles are alive), so the trace viewer graphs calls per frame underneath the
+spans. export() writes the lot as JSON that chrome://tracing or
+https://ui.perfetto.dev can open.
+
+	python3 main.py --trace trace.json
+"""
+
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+from particles import ParticlePool
+
+# what instrument_game() traces, on both front-ends' Games
+GAME_HOT_PATHS = (
+	"does_collide", "drop_distance", "try_rotate", "ghost_y", "hard_drop", "check_lines", "stamp_piece",
+	"render_gameplay", "render_particles",
+)
+
+class Tracer:
+	def __init__(self, max_spans=1000000):
+		self.max_spans = max_spans  # (a few minutes' worth, after that spans are only counted)
+		self.start = time.perf_counter_ns()
+		self.spans = []  # (name, start ns, duration ns), turned into JSON at export, to keep the wrappers cheap
+		self.frames = []  # (start ns, end ns, {counter: value})
+		self.names = []  # everything instrumented, in the order it was instrumented
+		self.calls = collections.Counter()  # since the last end_frame()
+		self.totals = collections.Counter()
+		self.dropped = 0
+		self.frame_start = self.start
+
+	def instrument(self, cls, *names):
+		"""
+			wrap cls's methods names (which can be inherited) in counted,
+			timed spans, for the rest of the process
+		"""
+		for name in names:
+			method = getattr(cls, name)
+			label = method.__qualname__
+			self.names.append(label)
+			setattr(cls, name, self.wrap(method, label))
+
+	def instrument_game(self, game_class):
+		self.instrument(game_class, *GAME_HOT_PATHS)
+		self.instrument(ParticlePool, "update")
+
+	def wrap(self, fn, label):
+		spans = self.spans
+		calls = self.calls
+		clock = time.perf_counter_ns
+
+		@functools.wraps(fn)
+		def traced(*args, **kwargs):
+			calls[label] += 1
+			begin = clock()
+			try:
+				return fn(*args, **kwargs)
+			finally:
+				if len(spans) < self.max_spans:
+					spans.append((label, begin, clock() - begin))
+				else:
+					self.dropped += 1
+		return traced
+
+	def count(self, name, n=1):
+		"""
+			for things that aren't method calls (e.g. blits)
+		"""
+		self.calls[name] += n
+
+	def end_frame(self, **values):
+		now = time.perf_counter_ns()
+		counters = {name: 0 for name in self.names}  # (so a counter drops back to 0, rather than holding its last value)
+		counters.update(self.calls)
+		counters.update(values)
+		self.frames.append((self.frame_start, now, counters))
+		self.totals.update(self.calls)
+		self.calls.clear()
+		self.frame_start = now
+
+	def __str__(self):
+		frames = max(1, len(self.frames))
+		lines = ["{:<32} {:>10} {:>10}".format("calls", "total", "per frame")]
+		for name, total in self.totals.most_common():
+			lines.append("{:<32} {:>10} {:>10.1f}".format(name, total, total / frames))
+		return "\n".join(lines)
+
+	def export(self, path):
+		def us(ns):
+			return (ns - self.start) / 1000
+
+		pid = os.getpid()
+		tid = threading.get_ident()
+		events = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "falling-block-game"}}]
+		for start, end, counters in self.frames:
+			events.append({"name": "frame", "ph": "X", "ts": us(start), "dur": (end - start) / 1000, "pid": pid, "tid": tid})
+			events.append({"name": "calls per frame", "ph": "C", "ts": us(end), "pid": pid, "args": counters})
+		for name, start, duration in self.spans:
+			events.append({"name": name, "ph": "X", "ts": us(start), "dur": duration / 1000, "pid": pid, "tid": tid})
+		with open(path, "w") as f:
+			json.dump({
+				"traceEvents": events,
+				"displayTimeUnit": "ms",
+				"otherData": {"frames": len(self.frames), "calls": dict(self.totals), "dropped_spans": self.dropped},
+			}, f)